@@ -7,26 +7,71 @@ import base64
 import logging
 import datetime
 import pathlib
-from flask import Flask, Response, jsonify, redirect, render_template, request, url_for, flash, abort, send_from_directory
+import itertools
+import json
+import re
+import collections
+import tempfile
+import zipfile
+import csv
+import time
+import sqlite3
+import functools
+import secrets
+from flask import Flask, Response, jsonify, redirect, render_template, request, url_for, flash, abort, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, extract, or_, case, text, desc
+from sqlalchemy.orm import joinedload, selectinload, contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import func, or_, and_, case, text, event, select, inspect, table, literal, literal_column, union_all, cast
 from sqlalchemy.exc import IntegrityError, OperationalError
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+from markupsafe import Markup
 from flask_login import UserMixin, LoginManager, login_user, logout_user, login_required, current_user
-from weasyprint import HTML
-import pandas as pd
-from validate_docbr import CPF, CNPJ
-import requests
+from weasyprint import __version__ as versao_weasyprint
 from dateutil.relativedelta import relativedelta
 from enum import Enum
+import click
+from cache_pdf import CachePDF, chave_pdf
+from renderizador_pdf import RenderizadorPDF, CONCLUIDO, ERRO, DESCONHECIDO
+from validacao_documentos import (cpf_valido, cnpj_valido, validar_cpfs, validar_cnpjs, validar_telefones,
+                                  validar_ceps, auditar)
+from ativos_pdf import RegistroAtivosPDF, medir
+from exportacao_xlsx import Coluna, gerar_xlsx, MIMETYPE_XLSX, FORMATO_MOEDA, FORMATO_DATA, FORMATO_DATA_HORA
+from cliente_http import ClienteHTTP
+from consultas_externas import ServicoConsultas, ServidorStub, ErroConsulta, CNPJ, CEP
+from importacao_cadastros import ErroImportacao, ler_linhas, importar
+from snapshot_parquet import ddl_registro_alteracao, exportar_snapshot, ler_manifesto, instalar_registro_alteracao
+from cubo_analitico import Cubo, FATOS
+from cache_relatorios import CacheFragmentos, chave_pagina, ddl_geracoes, instalar_geracoes, ler_geracoes
+from planos_consulta import criar_indices, conferir_planos
+from perfil_sqlite import PERFIS, PERFIL_PADRAO, instalar_perfil, pragmas_em_uso, comparar_perfis
 
 # --- Configuração do App Flask ---
 app = Flask(__name__)
 app.secret_key = 'uma-chave-secreta-muito-segura'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+app.config['SQLITE_PERFIL'] = os.environ.get('SQLITE_PERFIL', PERFIL_PADRAO)
+app.config['SQLITE_PRAGMAS'] = os.environ.get('SQLITE_PRAGMAS', '')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PDF_CACHE_DIR'] = os.environ.get('PDF_CACHE_DIR', os.path.join(app.instance_path, 'cache_pdf'))
+app.config['PDF_CACHE_MAX_MB'] = int(os.environ.get('PDF_CACHE_MAX_MB', '200'))
+# Processos de renderização por worker web: os núcleos divididos entre os WEB_CONCURRENCY workers do gunicorn
+app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', max((os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', '1')), 1)))
+app.config['PDF_ESPERA_SEGUNDOS'] = float(os.environ.get('PDF_ESPERA_SEGUNDOS', '2'))
+app.config['BRASILAPI_URL'] = os.environ.get('BRASILAPI_URL', 'https://brasilapi.com.br')
+app.config['HTTP_TEMPO_LEITURA'] = float(os.environ.get('HTTP_TEMPO_LEITURA', '5'))
+app.config['HTTP_TENTATIVAS'] = int(os.environ.get('HTTP_TENTATIVAS', '3'))
+app.config['CONSULTAS_CACHE_DB'] = os.environ.get('CONSULTAS_CACHE_DB', os.path.join(app.instance_path, 'consultas_externas.db'))
+app.config['CACHE_RELATORIOS'] = os.environ.get('CACHE_RELATORIOS', '1') != '0'
+app.config['CACHE_RELATORIOS_DB'] = os.environ.get('CACHE_RELATORIOS_DB', os.path.join(app.instance_path, 'cache_relatorios.db'))
+app.config['CACHE_RELATORIOS_MAX_MB'] = int(os.environ.get('CACHE_RELATORIOS_MAX_MB', '100'))
+app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR', os.path.join(app.instance_path, 'snapshots'))
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 db = SQLAlchemy(app)
+with app.app_context():
+    # WAL, busy_timeout, cache e mmap em cada nova conexão do pool (perfil_sqlite.py)
+    instalar_perfil(db.engine, app.config['SQLITE_PERFIL'], app.config['SQLITE_PRAGMAS'])
 
 # --- Configuração do Flask-Login ---
 login_manager = LoginManager()
@@ -43,7 +88,9 @@ login_manager.login_message_category = "info"
 # Tabela de associação para Faturamento <-> Ordem de Serviço
 faturamento_os = db.Table('faturamento_os',
     db.Column('faturamento_id', db.Integer, db.ForeignKey('faturamento.id'), primary_key=True),
-    db.Column('ordem_servico_id', db.Integer, db.ForeignKey('ordem_servico.id'), primary_key=True)
+    db.Column('ordem_servico_id', db.Integer, db.ForeignKey('ordem_servico.id'), primary_key=True),
+    # A chave primária começa pela fatura; este cobre o caminho inverso (O.S. -> fatura)
+    db.Index('ix_faturamento_os_ordem_servico_id', 'ordem_servico_id')
 )
 
 class User(UserMixin, db.Model):
@@ -70,6 +117,7 @@ class Cliente(db.Model):
     cidade = db.Column(db.String(100))
     uf = db.Column(db.String(2))
     ordens = db.relationship('OrdemServico', backref='cliente', lazy=True)
+    resumo = db.relationship('ResumoCliente', uselist=False, viewonly=True)
     @property
     def nome_exibicao(self): return self.nome if self.tipo_pessoa == 'FISICA' else self.razao_social
     @property
@@ -122,6 +170,13 @@ class StatusOS(db.Model):
     cor = db.Column(db.String(20), default='secondary')
 
 class OrdemServico(db.Model):
+    # Índices casados com os filtros dos relatórios (status + período, cliente + período) e com a listagem por data
+    __table_args__ = (
+        db.Index('ix_ordem_servico_status_id_data_criacao', 'status_id', 'data_criacao'),
+        db.Index('ix_ordem_servico_status_id_data_fechamento', 'status_id', 'data_fechamento'),
+        db.Index('ix_ordem_servico_cliente_id_data_criacao', 'cliente_id', 'data_criacao'),
+        db.Index('ix_ordem_servico_data_criacao', 'data_criacao'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     problema = db.Column(db.Text, nullable=False)
     status_id = db.Column(db.Integer, db.ForeignKey('status_os.id'))
@@ -130,22 +185,28 @@ class OrdemServico(db.Model):
     data_fechamento = db.Column(db.DateTime, nullable=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
     valor_servicos = db.Column(db.Float, default=0.0)
+    # Totais persistidos, recalculados a cada flush que toca a O.S. ou suas peças
+    valor_pecas = db.Column(db.Float, default=0.0)
+    valor_total = db.Column(db.Float, default=0.0)
     pecas = db.relationship('Peca', backref='ordem_servico', lazy=True, cascade="all, delete-orphan")
-    @property
-    def valor_pecas(self): return sum(p.valor_total for p in self.pecas)
-    @property
-    def valor_total(self): return self.valor_servicos + self.valor_pecas
 
 class Peca(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     descricao = db.Column(db.String(200), nullable=False)
     quantidade = db.Column(db.Integer, nullable=False, default=1)
     valor_unitario = db.Column(db.Float, nullable=False, default=0.0)
-    ordem_servico_id = db.Column(db.Integer, db.ForeignKey('ordem_servico.id'), nullable=False)
+    ordem_servico_id = db.Column(db.Integer, db.ForeignKey('ordem_servico.id'), nullable=False, index=True)
+    # Produto de onde a peça saiu (NULL em peças antigas sem produto correspondente); a descrição fica como cópia
+    produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'), nullable=True, index=True)
+    produto = db.relationship('Produto')
     @property
     def valor_total(self): return self.quantidade * self.valor_unitario
 
 class Faturamento(db.Model):
+    __table_args__ = (
+        db.Index('ix_faturamento_data_emissao', 'data_emissao'),
+        db.Index('ix_faturamento_cliente_id_data_emissao', 'cliente_id', 'data_emissao'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     data_emissao = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     data_vencimento = db.Column(db.Date, nullable=False)
@@ -154,13 +215,14 @@ class Faturamento(db.Model):
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
     ordens = db.relationship('OrdemServico', secondary=faturamento_os, backref='faturamento', lazy='dynamic')
     cliente = db.relationship('Cliente')
+    valor_total_faturado = db.Column(db.Float, default=0.0)
     pagamentos = db.relationship('Pagamento', backref='faturamento', lazy=True, cascade="all, delete-orphan")
-    @property
-    def valor_total_faturado(self): return sum(os.valor_total for os in self.ordens.all())
 
 class Pagamento(db.Model):
+    # (status, data_vencimento) serve à paginação de contas a receber e ao fluxo de caixa (pendentes por vencimento)
+    __table_args__ = (db.Index('ix_pagamento_status_data_vencimento', 'status', 'data_vencimento'),)
     id = db.Column(db.Integer, primary_key=True)
-    faturamento_id = db.Column(db.Integer, db.ForeignKey('faturamento.id'), nullable=False)
+    faturamento_id = db.Column(db.Integer, db.ForeignKey('faturamento.id'), nullable=False, index=True)
     tipo_pagamento = db.Column(db.String(20), nullable=False)
     valor = db.Column(db.Float, nullable=False)
     data_vencimento = db.Column(db.Date, nullable=False)
@@ -169,9 +231,10 @@ class Pagamento(db.Model):
     status = db.Column(db.String(20), default='Pendente')
 
 class ContaPagar(db.Model):
+    __table_args__ = (db.Index('ix_conta_pagar_status_data_vencimento', 'status', 'data_vencimento'),)
     id = db.Column(db.Integer, primary_key=True)
     descricao = db.Column(db.String(200), nullable=False)
-    fornecedor_id = db.Column(db.Integer, db.ForeignKey('fornecedor.id'), nullable=True)
+    fornecedor_id = db.Column(db.Integer, db.ForeignKey('fornecedor.id'), nullable=True, index=True)
     valor = db.Column(db.Float, nullable=False)
     data_emissao = db.Column(db.Date, nullable=False, default=datetime.date.today)
     data_vencimento = db.Column(db.Date, nullable=False)
@@ -188,12 +251,27 @@ class EntradaEstoque(db.Model):
 
 class EntradaEstoqueItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    entrada_id = db.Column(db.Integer, db.ForeignKey('entrada_estoque.id'), nullable=False)
-    produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'), nullable=False)
+    entrada_id = db.Column(db.Integer, db.ForeignKey('entrada_estoque.id'), nullable=False, index=True)
+    produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'), nullable=False, index=True)
     quantidade = db.Column(db.Integer, nullable=False)
     valor_custo_unitario = db.Column(db.Float, nullable=False)
     produto = db.relationship('Produto')
 
+class MovimentoEstoque(db.Model):
+    """Razão de estoque, só de inserção: cada linha é uma movimentação e o saldo do produto logo depois dela."""
+    __tablename__ = 'movimento_estoque'
+    # (produto, data) responde o saldo em qualquer instante com uma única busca no índice
+    __table_args__ = (db.Index('ix_movimento_estoque_produto_id_data', 'produto_id', 'data'),)
+    id = db.Column(db.Integer, primary_key=True)
+    produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'), nullable=False)
+    data = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    tipo = db.Column(db.String(20), nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False)  # positiva = entrada, negativa = saída
+    saldo = db.Column(db.Integer, nullable=False)
+    ordem_servico_id = db.Column(db.Integer, db.ForeignKey('ordem_servico.id'), nullable=True, index=True)
+    entrada_estoque_id = db.Column(db.Integer, db.ForeignKey('entrada_estoque.id'), nullable=True, index=True)
+    produto = db.relationship('Produto')
+
 class Orcamento(db.Model):
     __tablename__ = 'orcamento'
     __table_args__ = {'extend_existing': True}
@@ -204,17 +282,15 @@ class Orcamento(db.Model):
     valor_servicos = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(20), default='Em Aberto')
     cliente = db.relationship('Cliente', backref='orcamentos')
+    valor_produtos = db.Column(db.Float, default=0.0)
+    valor_total = db.Column(db.Float, default=0.0)
     itens = db.relationship('OrcamentoItem', backref='orcamento', cascade="all, delete-orphan")
-    @property
-    def valor_produtos(self): return sum(item.valor_total for item in self.itens)
-    @property
-    def valor_total(self): return self.valor_servicos + self.valor_produtos
 
 class OrcamentoItem(db.Model):
     __tablename__ = 'orcamento_item'
     __table_args__ = {'extend_existing': True}
     id = db.Column(db.Integer, primary_key=True)
-    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id'), nullable=False)
+    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id'), nullable=False, index=True)
     produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'), nullable=False)
     descricao = db.Column(db.String(200), nullable=False)
     quantidade = db.Column(db.Integer, nullable=False)
@@ -223,6 +299,557 @@ class OrcamentoItem(db.Model):
     @property
     def valor_total(self): return self.quantidade * self.valor_unitario
 
+class ResumoMensalOS(db.Model):
+    """Faturamento agregado por mês de criação e status da O.S. (alimenta o dashboard)."""
+    __tablename__ = 'resumo_mensal_os'
+    ano_mes = db.Column(db.String(7), primary_key=True)
+    status_id = db.Column(db.Integer, db.ForeignKey('status_os.id'), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = db.Column(db.Float, nullable=False, default=0.0)
+
+class ResumoCliente(db.Model):
+    """Faturas e recebíveis agregados por cliente (relatório por cliente, página do cliente); só clientes com fatura."""
+    __tablename__ = 'resumo_cliente'
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), primary_key=True)
+    faturas = db.Column(db.Integer, nullable=False, default=0)
+    valor_faturado = db.Column(db.Float, nullable=False, default=0.0)
+    valor_recebido = db.Column(db.Float, nullable=False, default=0.0)
+    valor_em_aberto = db.Column(db.Float, nullable=False, default=0.0)
+    ultima_fatura = db.Column(db.DateTime)
+
+
+# --- Manutenção incremental dos agregados ---
+# Após cada flush, os totais das O.S., orçamentos e faturas tocados e os "baldes" (mês, status)
+# do resumo mensal são recalculados em SQL dentro da mesma transação, então nunca ficam defasados.
+def _valor_anterior(obj, atributo):
+    historico = inspect(obj).attrs[atributo].history
+    if historico.deleted: return historico.deleted[0]
+    return historico.unchanged[0] if historico.unchanged else None
+
+def _mes_referencia(data):
+    return data.strftime('%Y-%m') if data else None
+
+def _valor_pecas_sql():
+    return select(func.coalesce(func.sum(Peca.quantidade * Peca.valor_unitario), 0.0)).where(
+        Peca.ordem_servico_id == OrdemServico.id).scalar_subquery()
+
+def _valor_produtos_sql():
+    return select(func.coalesce(func.sum(OrcamentoItem.quantidade * OrcamentoItem.valor_unitario), 0.0)).where(
+        OrcamentoItem.orcamento_id == Orcamento.id).scalar_subquery()
+
+def _valor_fatura_sql():
+    return select(func.coalesce(func.sum(OrdemServico.valor_total), 0.0)).join(
+        faturamento_os, faturamento_os.c.ordem_servico_id == OrdemServico.id
+    ).where(faturamento_os.c.faturamento_id == Faturamento.id).scalar_subquery()
+
+def recalcular_totais(conexao, os_ids=None, orcamento_ids=None, faturamento_ids=None):
+    """Regrava os totais persistidos. `None` recalcula a tabela inteira; um conjunto vazio não faz nada."""
+    if os_ids is None or os_ids:
+        comando = OrdemServico.__table__.update().values(
+            valor_pecas=_valor_pecas_sql(), valor_total=func.coalesce(OrdemServico.valor_servicos, 0.0) + _valor_pecas_sql())
+        conexao.execute(comando if os_ids is None else comando.where(OrdemServico.id.in_(os_ids)))
+    if orcamento_ids is None or orcamento_ids:
+        comando = Orcamento.__table__.update().values(
+            valor_produtos=_valor_produtos_sql(), valor_total=func.coalesce(Orcamento.valor_servicos, 0.0) + _valor_produtos_sql())
+        conexao.execute(comando if orcamento_ids is None else comando.where(Orcamento.id.in_(orcamento_ids)))
+    if faturamento_ids is None or faturamento_ids:
+        comando = Faturamento.__table__.update().values(valor_total_faturado=_valor_fatura_sql())
+        conexao.execute(comando if faturamento_ids is None else comando.where(Faturamento.id.in_(faturamento_ids)))
+
+def divergencias_de_totais():
+    """Lista (tabela, id, valor gravado, valor esperado) de cada total persistido que não bate com os itens."""
+    verificacoes = [
+        ('ordem_servico', OrdemServico.id, OrdemServico.valor_total, func.coalesce(OrdemServico.valor_servicos, 0.0) + _valor_pecas_sql()),
+        ('orcamento', Orcamento.id, Orcamento.valor_total, func.coalesce(Orcamento.valor_servicos, 0.0) + _valor_produtos_sql()),
+        ('faturamento', Faturamento.id, Faturamento.valor_total_faturado, _valor_fatura_sql()),
+    ]
+    divergencias = []
+    for tabela, coluna_id, gravado, esperado in verificacoes:
+        consulta = select(coluna_id, gravado, esperado).where(func.abs(func.coalesce(gravado, -1.0) - esperado) > 0.005)
+        divergencias.extend((tabela, *linha) for linha in db.session.execute(consulta))
+    return divergencias
+
+def _consulta_resumo_mensal(ano_mes, status_id):
+    inicio = datetime.datetime.strptime(ano_mes, '%Y-%m')
+    return select(func.count(OrdemServico.id), func.coalesce(func.sum(OrdemServico.valor_total), 0.0)).where(
+        OrdemServico.status_id == status_id,
+        OrdemServico.data_criacao >= inicio,
+        OrdemServico.data_criacao < inicio + relativedelta(months=1))
+
+def _recalcular_resumo_mensal(conexao, ano_mes, status_id):
+    quantidade, valor_total = conexao.execute(_consulta_resumo_mensal(ano_mes, status_id)).one()
+    tabela = ResumoMensalOS.__table__
+    conexao.execute(tabela.delete().where(tabela.c.ano_mes == ano_mes, tabela.c.status_id == status_id))
+    if quantidade:
+        conexao.execute(tabela.insert().values(ano_mes=ano_mes, status_id=status_id, quantidade=quantidade, valor_total=valor_total))
+
+def reconstruir_resumo_mensal():
+    """Apaga e recalcula o resumo mensal inteiro a partir dos totais das O.S."""
+    tabela = ResumoMensalOS.__table__
+    ano_mes = func.strftime('%Y-%m', OrdemServico.data_criacao)
+    consulta = select(ano_mes, OrdemServico.status_id, func.count(OrdemServico.id), func.sum(OrdemServico.valor_total)).where(
+        OrdemServico.status_id.isnot(None), OrdemServico.data_criacao.isnot(None)
+    ).group_by(ano_mes, OrdemServico.status_id)
+    db.session.execute(tabela.delete())
+    db.session.execute(tabela.insert().from_select(['ano_mes', 'status_id', 'quantidade', 'valor_total'], consulta))
+    db.session.commit()
+
+def agregado_por_cliente(*filtros):
+    """(cliente_id, faturas, valor_faturado, valor_recebido, valor_em_aberto, ultima_fatura) das faturas que passam em `filtros`.
+
+    As parcelas entram como subconsultas por fatura (índice de pagamento.faturamento_id), sem multiplicar as faturas.
+    """
+    def parcelas(status):
+        return select(func.coalesce(func.sum(Pagamento.valor), 0.0)).where(
+            Pagamento.faturamento_id == Faturamento.id, Pagamento.status == status).scalar_subquery()
+    return select(
+        Faturamento.cliente_id, func.count(Faturamento.id).label('faturas'),
+        func.coalesce(func.sum(Faturamento.valor_total_faturado), 0.0).label('valor_faturado'),
+        func.sum(parcelas('Recebido')).label('valor_recebido'), func.sum(parcelas('Pendente')).label('valor_em_aberto'),
+        func.max(Faturamento.data_emissao).label('ultima_fatura'),
+    ).where(*filtros).group_by(Faturamento.cliente_id)
+
+def recalcular_resumo_clientes(conexao, cliente_ids=None):
+    """Regrava o resumo dos clientes informados (`None` = todos) a partir das faturas e parcelas."""
+    tabela = ResumoCliente.__table__
+    filtros = [] if cliente_ids is None else [Faturamento.cliente_id.in_(cliente_ids)]
+    conexao.execute(tabela.delete() if cliente_ids is None else tabela.delete().where(tabela.c.cliente_id.in_(cliente_ids)))
+    conexao.execute(tabela.insert().from_select(
+        ['cliente_id', 'faturas', 'valor_faturado', 'valor_recebido', 'valor_em_aberto', 'ultima_fatura'], agregado_por_cliente(*filtros)))
+
+@event.listens_for(db.session, 'after_flush')
+def manter_agregados(session, flush_context):
+    baldes, os_ids, orcamento_ids, faturamento_ids = set(), set(), set(), set()
+    cliente_ids, faturas_das_parcelas = set(), set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, OrdemServico):
+            if obj not in session.new:
+                baldes.add((_mes_referencia(_valor_anterior(obj, 'data_criacao')), _valor_anterior(obj, 'status_id')))
+            if obj not in session.deleted:
+                os_ids.add(obj.id)
+        elif isinstance(obj, Peca):
+            os_ids.update(i for i in (obj.ordem_servico_id, _valor_anterior(obj, 'ordem_servico_id')) if i)
+        elif isinstance(obj, Orcamento) and obj not in session.deleted:
+            orcamento_ids.add(obj.id)
+        elif isinstance(obj, OrcamentoItem):
+            orcamento_ids.update(i for i in (obj.orcamento_id, _valor_anterior(obj, 'orcamento_id')) if i)
+        elif isinstance(obj, Faturamento):
+            # Fatura cancelada (excluída) ainda traz o cliente cujo resumo precisa sair
+            cliente_ids.update(i for i in (obj.cliente_id, _valor_anterior(obj, 'cliente_id')) if i)
+            if obj not in session.deleted:
+                faturamento_ids.add(obj.id)
+        elif isinstance(obj, Pagamento):
+            faturas_das_parcelas.update(i for i in (obj.faturamento_id, _valor_anterior(obj, 'faturamento_id')) if i)
+    if not (baldes or os_ids or orcamento_ids or faturamento_ids or faturas_das_parcelas or cliente_ids):
+        return
+    conexao = session.connection()
+    if os_ids:
+        faturamento_ids.update(conexao.execute(
+            select(faturamento_os.c.faturamento_id).where(faturamento_os.c.ordem_servico_id.in_(os_ids))).scalars())
+        baldes.update(conexao.execute(
+            select(func.strftime('%Y-%m', OrdemServico.data_criacao), OrdemServico.status_id).where(OrdemServico.id.in_(os_ids))
+        ).all())
+    recalcular_totais(conexao, os_ids, orcamento_ids, faturamento_ids)
+    for ano_mes, status_id in {(m, int(s)) for m, s in baldes if m and s}:
+        _recalcular_resumo_mensal(conexao, ano_mes, status_id)
+    if faturamento_ids | faturas_das_parcelas:
+        cliente_ids.update(conexao.execute(
+            select(Faturamento.cliente_id).where(Faturamento.id.in_(faturamento_ids | faturas_das_parcelas))).scalars())
+    if cliente_ids:
+        recalcular_resumo_clientes(conexao, cliente_ids)
+    recalculados = session.info.setdefault('totais_recalculados', {OrdemServico: set(), Orcamento: set(), Faturamento: set()})
+    recalculados[OrdemServico] |= os_ids
+    recalculados[Orcamento] |= orcamento_ids
+    recalculados[Faturamento] |= faturamento_ids
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def expirar_totais_recalculados(session, flush_context):
+    # Os totais foram gravados direto em SQL; expira-os nos objetos já carregados para forçar releitura
+    atributos = {OrdemServico: ['valor_pecas', 'valor_total'], Orcamento: ['valor_produtos', 'valor_total'], Faturamento: ['valor_total_faturado']}
+    recalculados = session.info.pop('totais_recalculados', None)
+    if not recalculados:
+        return
+    for obj in list(session.identity_map.values()):
+        if obj.id in recalculados.get(type(obj), ()):
+            session.expire(obj, atributos[type(obj)])
+
+# --- Paginação por cursor (keyset) ---
+# As listagens avançam pela própria chave de ordenação ("WHERE chave > último visto") em vez de OFFSET,
+# então o custo de cada página não cresce com o tamanho da tabela.
+TAMANHO_PAGINA_PADRAO = 50
+TAMANHO_PAGINA_MAXIMO = 500
+
+def _codificar_cursor(valores):
+    def serializar(valor):
+        if isinstance(valor, datetime.datetime): return ['dt', valor.isoformat()]
+        if isinstance(valor, datetime.date): return ['d', valor.isoformat()]
+        return ['v', valor]
+    return base64.urlsafe_b64encode(json.dumps([serializar(v) for v in valores]).encode()).decode()
+
+def _decodificar_cursor(cursor):
+    def desserializar(tipo, valor):
+        if tipo == 'dt': return datetime.datetime.fromisoformat(valor)
+        if tipo == 'd': return datetime.date.fromisoformat(valor)
+        return valor
+    try:
+        return [desserializar(tipo, valor) for tipo, valor in json.loads(base64.urlsafe_b64decode(cursor.encode()))]
+    except (ValueError, TypeError):
+        abort(400, description='Cursor de paginação inválido.')
+
+def consulta_keyset(query, chaves, valores, limite):
+    """A consulta de uma página: filtro "depois de `valores`" (None = primeira página), ordenação e limite + 1."""
+    expressoes = [expressao for expressao, _ in chaves]
+    if valores is not None:
+        alternativas = []
+        for i, (expressao, direcao) in enumerate(chaves):
+            depois = expressao > valores[i] if direcao == 'asc' else expressao < valores[i]
+            alternativas.append(and_(*[expressoes[j] == valores[j] for j in range(i)], depois))
+        # A primeira condição, redundante, deixa o SQLite usar o índice da chave principal como faixa
+        primeira, direcao = chaves[0]
+        query = query.filter(primeira >= valores[0] if direcao == 'asc' else primeira <= valores[0], or_(*alternativas))
+    ordenacao = [expressao.asc() if direcao == 'asc' else expressao.desc() for expressao, direcao in chaves]
+    return query.add_columns(*[e.label(f'_chave_{i}') for i, e in enumerate(expressoes)]).order_by(*ordenacao).limit(limite + 1)
+
+def paginar_keyset(query, chaves, cursor=None, limite=None):
+    """Devolve (itens, proximo_cursor) da página seguinte ao `cursor`.
+
+    `chaves` é a ordenação como [(expressão, 'asc'|'desc'), ...]; a última chave precisa ser única (o id).
+    """
+    try:
+        limite = min(max(int(limite or TAMANHO_PAGINA_PADRAO), 1), TAMANHO_PAGINA_MAXIMO)
+    except ValueError:
+        limite = TAMANHO_PAGINA_PADRAO
+    valores = None
+    if cursor:
+        valores = _decodificar_cursor(cursor)
+        if len(valores) != len(chaves):
+            abort(400, description='Cursor de paginação inválido.')
+    linhas = consulta_keyset(query, chaves, valores, limite).all()
+    proximo_cursor = _codificar_cursor(list(linhas[limite - 1][1:])) if len(linhas) > limite else None
+    return [linha[0] for linha in linhas[:limite]], proximo_cursor
+
+def cabecalhos_paginacao(itens, proximo_cursor):
+    cabecalhos = {'X-Tamanho-Pagina': str(len(itens))}
+    if proximo_cursor: cabecalhos['X-Proximo-Cursor'] = proximo_cursor
+    return cabecalhos
+
+# --- Busca textual (SQLite FTS5) ---
+# Índices invertidos sobre os textos pesquisáveis, mantidos por triggers. O tokenizador remove acentos
+# e ignora maiúsculas; cada palavra digitada vira um prefixo ("joao silv" encontra "JOÃO SILVA").
+DDL_BUSCA_TEXTUAL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cliente_fts USING fts5(
+        nome, razao_social, cidade, content='cliente', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS cliente_fts_ai AFTER INSERT ON cliente BEGIN
+        INSERT INTO cliente_fts(rowid, nome, razao_social, cidade) VALUES (new.id, new.nome, new.razao_social, new.cidade);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cliente_fts_ad AFTER DELETE ON cliente BEGIN
+        INSERT INTO cliente_fts(cliente_fts, rowid, nome, razao_social, cidade) VALUES ('delete', old.id, old.nome, old.razao_social, old.cidade);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cliente_fts_au AFTER UPDATE OF nome, razao_social, cidade ON cliente BEGIN
+        INSERT INTO cliente_fts(cliente_fts, rowid, nome, razao_social, cidade) VALUES ('delete', old.id, old.nome, old.razao_social, old.cidade);
+        INSERT INTO cliente_fts(rowid, nome, razao_social, cidade) VALUES (new.id, new.nome, new.razao_social, new.cidade);
+    END""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS ordem_servico_fts USING fts5(
+        problema, content='ordem_servico', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS ordem_servico_fts_ai AFTER INSERT ON ordem_servico BEGIN
+        INSERT INTO ordem_servico_fts(rowid, problema) VALUES (new.id, new.problema);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ordem_servico_fts_ad AFTER DELETE ON ordem_servico BEGIN
+        INSERT INTO ordem_servico_fts(ordem_servico_fts, rowid, problema) VALUES ('delete', old.id, old.problema);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ordem_servico_fts_au AFTER UPDATE OF problema ON ordem_servico BEGIN
+        INSERT INTO ordem_servico_fts(ordem_servico_fts, rowid, problema) VALUES ('delete', old.id, old.problema);
+        INSERT INTO ordem_servico_fts(rowid, problema) VALUES (new.id, new.problema);
+    END""",
+]
+
+@event.listens_for(db.metadata, 'after_create')
+def criar_indices_busca(target, conexao, **kw):
+    for comando in DDL_BUSCA_TEXTUAL:
+        conexao.exec_driver_sql(comando)
+
+def consulta_fts(termo, colunas=None):
+    """Converte o texto digitado em uma expressão MATCH segura (palavras como prefixos, todas obrigatórias)."""
+    palavras = re.findall(r'\w+', termo)
+    if not palavras:
+        return None
+    expressao = ' '.join(f'"{p}"*' for p in palavras)
+    return f"{{{' '.join(colunas)}}} : ({expressao})" if colunas else expressao
+
+def resultados_fts(tabela_fts, consulta):
+    """Subconsulta (id, rank) das linhas que casam com `consulta`; rank menor = mais relevante (bm25)."""
+    return select(literal_column('rowid').label('id'), literal_column('rank').label('rank')).select_from(
+        table(tabela_fts)).where(literal_column(tabela_fts).op('MATCH')(consulta)).subquery()
+
+def filtro_prefixo_documento(digitos):
+    # Faixa [digitos, digitos + ':') = todo documento que começa com esses dígitos, usando os índices únicos
+    return or_(and_(Cliente.cpf >= digitos, Cliente.cpf < digitos + ':'),
+               and_(Cliente.cnpj >= digitos, Cliente.cnpj < digitos + ':'))
+
+# --- Snapshot Parquet para BI (snapshot_parquet.py) ---
+# Tabelas exportadas em Parquet tipado. Os triggers de registro_alteracao são criados junto com o
+# banco (e, em bancos antigos, no primeiro snapshot) para que o modo incremental saiba o que mudou.
+TABELAS_SNAPSHOT = [Cliente.__table__, OrdemServico.__table__, Peca.__table__, Faturamento.__table__,
+                    Pagamento.__table__, ContaPagar.__table__, EntradaEstoqueItem.__table__, MovimentoEstoque.__table__]
+
+@event.listens_for(db.metadata, 'after_create')
+def criar_registro_alteracao(target, conexao, **kw):
+    for comando in ddl_registro_alteracao(TABELAS_SNAPSHOT):
+        conexao.exec_driver_sql(comando)
+
+def gerar_snapshot(incremental=False):
+    conexao = db.engine.raw_connection()
+    try:
+        return exportar_snapshot(conexao.driver_connection, TABELAS_SNAPSHOT, app.config['SNAPSHOT_DIR'], incremental)
+    finally:
+        conexao.close()
+
+# --- Cubo analítico em memória (cubo_analitico.py) ---
+# Antes de cada pivô o cubo aplica o que mudou desde a última leitura (registro_alteracao); sem
+# alterações isso custa uma consulta. Nomes de status, clientes e produtos entram só no resultado.
+cubo_analitico = Cubo()
+
+def atualizar_cubo():
+    conexao = db.engine.raw_connection()
+    try:
+        if cubo_analitico.sequencia is None:
+            instalar_registro_alteracao(conexao.driver_connection, TABELAS_SNAPSHOT)
+        return cubo_analitico.atualizar(conexao.driver_connection)
+    finally:
+        conexao.close()
+
+def rotulos_do_cubo(coluna, ids):
+    """{id: nome} para as dimensões com cadastro (status, cliente, produto)."""
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return {}
+    if coluna == 'status_id':
+        return dict(db.session.execute(select(StatusOS.id, StatusOS.nome).where(StatusOS.id.in_(ids))).all())
+    if coluna == 'cliente_id':
+        return {c.id: c.nome if c.tipo_pessoa == 'FISICA' else c.razao_social for c in db.session.execute(
+            select(Cliente.id, Cliente.tipo_pessoa, Cliente.nome, Cliente.razao_social).where(Cliente.id.in_(ids)))}
+    if coluna == 'produto_id':
+        return dict(db.session.execute(select(Produto.id, Produto.descricao).where(Produto.id.in_(ids))).all())
+    return {}
+
+# --- Razão de estoque (movimento_estoque) ---
+# Toda alteração de Produto.quantidade_estoque passa por movimentar_estoque: um único UPDATE condicional
+# (o saldo nunca fica negativo) aplica a variação de todos os produtos de uma vez e devolve os saldos novos,
+# que são gravados no razão na mesma transação. O UPDATE pega a trava de escrita do SQLite antes de ler o
+# saldo, então dois técnicos baixando a mesma peça ao mesmo tempo não vendem o que não existe nem perdem
+# uma baixa. quantidade_estoque continua sendo o saldo atual; o saldo em uma data vem do razão.
+ENTRADA, SAIDA_OS, ESTORNO_OS, SALDO_INICIAL = 'ENTRADA', 'SAIDA_OS', 'ESTORNO_OS', 'SALDO_INICIAL'
+
+DDL_RAZAO_ESTOQUE = [
+    """CREATE TRIGGER IF NOT EXISTS movimento_estoque_sem_alteracao BEFORE UPDATE ON movimento_estoque BEGIN
+        SELECT RAISE(ABORT, 'movimento_estoque é somente de inserção: registre um movimento de estorno');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS movimento_estoque_sem_exclusao BEFORE DELETE ON movimento_estoque BEGIN
+        SELECT RAISE(ABORT, 'movimento_estoque é somente de inserção: registre um movimento de estorno');
+    END""",
+]
+
+@event.listens_for(db.metadata, 'after_create')
+def criar_razao_estoque(target, conexao, **kw):
+    for comando in DDL_RAZAO_ESTOQUE:
+        conexao.exec_driver_sql(comando)
+
+def movimentar_estoque(variacoes, tipo, ordem_servico_id=None, entrada_estoque_id=None):
+    """Aplica {produto_id: variação} (negativa = saída) e registra no razão; devolve {produto_id: saldo novo}.
+
+    Produtos cujo saldo ficaria negativo não são alterados e ficam fora do resultado.
+    """
+    variacoes = {produto_id: quantidade for produto_id, quantidade in variacoes.items() if quantidade}
+    if not variacoes:
+        return {}
+    tabela = Produto.__table__
+    saldo_novo = func.coalesce(tabela.c.quantidade_estoque, 0) + case(variacoes, value=tabela.c.id)
+    saldos = dict(db.session.execute(
+        tabela.update().where(tabela.c.id.in_(variacoes), saldo_novo >= 0).values(quantidade_estoque=saldo_novo)
+        .returning(tabela.c.id, tabela.c.quantidade_estoque)).all())
+    if saldos:
+        agora = datetime.datetime.utcnow()
+        db.session.execute(MovimentoEstoque.__table__.insert(), [
+            {'produto_id': produto_id, 'data': agora, 'tipo': tipo, 'quantidade': variacoes[produto_id], 'saldo': saldo,
+             'ordem_servico_id': ordem_servico_id, 'entrada_estoque_id': entrada_estoque_id}
+            for produto_id, saldo in saldos.items()])
+    # Produtos já carregados nesta sessão recebem o saldo novo sem ficarem marcados como alterados
+    for objeto in list(db.session.identity_map.values()):
+        if isinstance(objeto, Produto) and objeto.id in saldos:
+            set_committed_value(objeto, 'quantidade_estoque', saldos[objeto.id])
+    return saldos
+
+def _ultimo_saldo(momento=None):
+    """Saldo do último movimento do produto (até `momento`), como subconsulta correlacionada a Produto."""
+    consulta = select(MovimentoEstoque.saldo).where(MovimentoEstoque.produto_id == Produto.id)
+    if momento is not None:
+        consulta = consulta.where(MovimentoEstoque.data <= momento)
+    return consulta.order_by(MovimentoEstoque.data.desc(), MovimentoEstoque.id.desc()).limit(1).scalar_subquery()
+
+def consulta_saldos_em(momento, produto_ids=None):
+    consulta = select(Produto.id, func.coalesce(_ultimo_saldo(momento), 0))
+    return consulta.where(Produto.id.in_(produto_ids)) if produto_ids is not None else consulta
+
+def saldos_em(momento, produto_ids=None):
+    """{produto_id: saldo} no instante `momento` (UTC); produto sem movimento até lá tem saldo 0."""
+    return dict(db.session.execute(consulta_saldos_em(momento, produto_ids)).all())
+
+def divergencias_de_estoque():
+    """(produto_id, saldo do produto, saldo do último movimento) de cada produto fora de sincronia com o razão."""
+    ultimo = _ultimo_saldo()
+    consulta = select(Produto.id, Produto.quantidade_estoque, ultimo).where(
+        func.coalesce(Produto.quantidade_estoque, 0) != func.coalesce(ultimo, 0))
+    return db.session.execute(consulta).all()
+
+# --- Geração de PDFs (cache + pool de renderização) ---
+# O HTML renderizado já contém todos os dados da entidade; o PDF fica em disco sob o hash desse HTML
+# + versão do template, então qualquer alteração nas linhas gera uma chave nova automaticamente.
+# Na falta do PDF, o WeasyPrint roda no pool de processos (renderizador_pdf.py): a requisição espera
+# até PDF_ESPERA_SEGUNDOS e, se não der tempo, devolve 202 com o id da tarefa (= chave do cache).
+cache_pdf = CachePDF(app.config['PDF_CACHE_DIR'], app.config['PDF_CACHE_MAX_MB'] * 1024 * 1024)
+# Logo e folhas de static/css/pdf/ são lidos uma vez (ativos_pdf.py); os templates usam logo_path = "ativo:logo-pdf".
+registro_ativos_pdf = RegistroAtivosPDF(app.static_folder)
+renderizador_pdf = RenderizadorPDF(cache_pdf, app.static_folder, app.config['PDF_WORKERS'])
+FOLHAS_PDF = {
+    'fatura_pdf_template.html': 'documento.css',
+    'orcamento_pdf_template.html': 'documento.css',
+    'os_pdf_template.html': 'os.css',
+    'relatorio_clientes_pdf.html': 'relatorio.css',
+    'relatorio_os_pdf.html': 'relatorio.css',
+}
+_versoes_template = {}
+
+def versao_template(nome_template):
+    if app.debug or nome_template not in _versoes_template:
+        fonte = app.jinja_env.loader.get_source(app.jinja_env, nome_template)[0]
+        _versoes_template[nome_template] = f"{versao_weasyprint}:{registro_ativos_pdf.versao}:{chave_pdf(fonte)}"
+    return _versoes_template[nome_template]
+
+def _resposta_pdf(pdf, chave, nome_arquivo):
+    resposta = Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': f'inline; filename={nome_arquivo}'})
+    resposta.set_etag(chave)
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta.make_conditional(request)
+
+def _situacao_tarefa_pdf(chave, nome_arquivo):
+    estado = renderizador_pdf.estado(chave)
+    situacao = {'tarefa_id': chave, 'estado': estado,
+                'status_url': url_for('status_tarefa_pdf', tarefa_id=chave),
+                'download_url': url_for('baixar_tarefa_pdf', tarefa_id=chave, nome=nome_arquivo)}
+    if estado == ERRO: situacao['erro'] = renderizador_pdf.erro(chave)
+    return situacao
+
+def responder_pdf(nome_template, nome_arquivo, **contexto):
+    contexto.setdefault('logo_path', registro_ativos_pdf.url('logo-pdf'))
+    html_renderizado = render_template(nome_template, **contexto)
+    chave = chave_pdf(html_renderizado, versao_template(nome_template))
+    pdf = cache_pdf.obter(chave)
+    if pdf is not None:
+        return _resposta_pdf(pdf, chave, nome_arquivo)
+
+    renderizador_pdf.enviar(chave, html_renderizado, str(pathlib.Path(__file__).parent), FOLHAS_PDF.get(nome_template))
+    assincrono = request.args.get('assincrono') == '1'
+    if not assincrono and renderizador_pdf.aguardar(chave, app.config['PDF_ESPERA_SEGUNDOS']) == CONCLUIDO:
+        pdf = cache_pdf.obter(chave, contabilizar=False)
+        if pdf is not None:
+            return _resposta_pdf(pdf, chave, nome_arquivo)
+
+    situacao = _situacao_tarefa_pdf(chave, nome_arquivo)
+    codigo = 500 if situacao['estado'] == ERRO else 202
+    if assincrono or request.accept_mimetypes.best == 'application/json':
+        return jsonify(situacao), codigo
+    return render_template('pdf_processando.html', situacao=situacao), codigo
+
+# --- Cache dos relatórios (cache_relatorios.py) ---
+# Rotas com @pagina_em_cache devolvem o contexto do template em vez de chamar render_template. Os blocos
+# content e scripts renderizados ficam no cache com a chave das gerações das tabelas lidas pela página;
+# o restante de base.html (menu com o usuário, mensagens flash) é montado a cada requisição. Num acerto
+# a view nem roda. Numa falha a página sai em partes, como antes, e é guardada ao terminar.
+TABELAS_GERACAO = [Cliente.__table__, StatusOS.__table__, OrdemServico.__table__, faturamento_os, Faturamento.__table__,
+                   Pagamento.__table__, ContaPagar.__table__, ResumoMensalOS.__table__, ResumoCliente.__table__]
+BLOCOS_EM_CACHE = ('content', 'scripts')
+_MARCADOR_BLOCO = f'<!--bloco-{secrets.token_hex(8)}:'
+os.makedirs(os.path.dirname(app.config['CACHE_RELATORIOS_DB']), exist_ok=True)
+cache_relatorios = CacheFragmentos(app.config['CACHE_RELATORIOS_DB'], app.config['CACHE_RELATORIOS_MAX_MB'] * 1024 * 1024)
+_geracoes_instaladas = False
+
+@event.listens_for(db.metadata, 'after_create')
+def criar_geracoes(target, conexao, **kw):
+    for comando in ddl_geracoes(TABELAS_GERACAO):
+        conexao.exec_driver_sql(comando)
+
+def geracoes_atuais(nomes):
+    global _geracoes_instaladas
+    if not _geracoes_instaladas:
+        # Bancos criados antes do cache ganham os triggers no primeiro relatório
+        conexao = db.engine.raw_connection()
+        try:
+            instalar_geracoes(conexao.driver_connection, TABELAS_GERACAO)
+        finally:
+            conexao.close()
+        _geracoes_instaladas = True
+    # Na conexão da sessão: as consultas da view leem o banco no mesmo estado ou depois
+    return ler_geracoes(db.session.connection().connection.driver_connection, nomes)
+
+def _blocos_renderizados(nome_template, contexto):
+    """{bloco: gerador de texto} dos blocos de BLOCOS_EM_CACHE do template, renderizados sob demanda."""
+    template = app.jinja_env.get_or_select_template(nome_template)
+    app.update_template_context(contexto)
+    contexto_jinja = template.new_context(contexto)
+    return {bloco: template.blocks[bloco](contexto_jinja) for bloco in BLOCOS_EM_CACHE if bloco in template.blocks}
+
+def _resposta_com_blocos(blocos, chave=None):
+    casca = render_template('_pagina_em_cache.html', blocos={bloco: Markup(f'{_MARCADOR_BLOCO}{bloco}-->') for bloco in BLOCOS_EM_CACHE})
+    partes = re.split(re.escape(_MARCADOR_BLOCO) + r'(\w+)-->', casca)  # texto, bloco, texto, bloco, ..., texto
+
+    def gerar():
+        guardados, tamanho = {bloco: [] for bloco in BLOCOS_EM_CACHE}, 0
+        for i, parte in enumerate(partes):
+            if i % 2 == 0:
+                yield parte
+                continue
+            for pedaco in blocos.get(parte, ()):
+                if guardados is not None:
+                    guardados[parte].append(pedaco)
+                    tamanho += len(pedaco)
+                    if tamanho > cache_relatorios.limite_item:
+                        guardados = None  # não cabe no cache: segue só transmitindo
+                yield pedaco
+        if chave and guardados is not None:
+            try:
+                cache_relatorios.gravar(chave, {bloco: ''.join(pedacos) for bloco, pedacos in guardados.items()})
+            except sqlite3.OperationalError as e:
+                logging.warning(f"Relatório não guardado no cache: {e}")
+
+    return Response(stream_with_context(gerar()))
+
+def pagina_em_cache(nome_template, *tabelas, por_dia=False):
+    """A view devolve o contexto de `nome_template`; a página fica em cache até um commit em `tabelas`.
+
+    `por_dia` entra a data de hoje na chave, para páginas que dependem dela (dashboard). Se a view devolver
+    outra coisa (redirect, resposta pronta), ela passa direto, sem cache.
+    """
+    nomes = [tabela.name for tabela in tabelas]
+
+    def decorador(view):
+        @functools.wraps(view)
+        def envoltorio(*args, **kwargs):
+            chave = None
+            if app.config['CACHE_RELATORIOS']:
+                argumentos = request.args.items(multi=True)
+                if por_dia: argumentos = [*argumentos, ('_dia', datetime.date.today().isoformat())]
+                chave = chave_pagina(request.path, argumentos, versao_template(nome_template), geracoes_atuais(nomes))
+                blocos = cache_relatorios.obter(chave)
+                if blocos is not None:
+                    return _resposta_com_blocos({bloco: [texto] for bloco, texto in blocos.items()})
+            contexto = view(*args, **kwargs)
+            if not isinstance(contexto, dict):
+                return contexto
+            return _resposta_com_blocos(_blocos_renderizados(nome_template, contexto), chave)
+        return envoltorio
+    return decorador
+
 # ==============================================================================
 # 3. ROTAS PRINCIPAIS E DE AUTENTICAÇÃO
 # ==============================================================================
@@ -271,49 +898,41 @@ def logout():
 
 @app.route('/')
 @login_required
+@pagina_em_cache('dashboard.html', ResumoMensalOS.__table__, StatusOS.__table__, por_dia=True)
 def dashboard():
     hoje = datetime.date.today()
     status_concluidos_nomes = ['FINALIZADA', 'FATURADA']
-    status_concluidos = StatusOS.query.filter(StatusOS.nome.in_(status_concluidos_nomes)).all()
-    status_concluidos_ids = [s.id for s in status_concluidos]
-    
-    ordens_finalizadas_no_mes_lista = OrdemServico.query.filter(
-        OrdemServico.status_id.in_(status_concluidos_ids),
-        extract('month', OrdemServico.data_criacao) == hoje.month,
-        extract('year', OrdemServico.data_criacao) == hoje.year
-    ).all()
-    total_faturado_mes = sum(ordem.valor_total for ordem in ordens_finalizadas_no_mes_lista)
-    os_finalizadas_mes = len(ordens_finalizadas_no_mes_lista)
-    
-    status_aberta = StatusOS.query.filter_by(nome='ABERTA').first()
-    os_abertas = OrdemServico.query.filter_by(status_id=status_aberta.id).count() if status_aberta else 0
-    
+    primeiro_mes_grafico = hoje.replace(day=1) - relativedelta(months=5)
+    mes_atual = _mes_referencia(hoje)
+
+    # Uma única leitura no resumo mensal: os 6 meses do gráfico + as O.S. abertas de qualquer mês
+    resumo = db.session.query(ResumoMensalOS.ano_mes, StatusOS.nome, ResumoMensalOS.quantidade, ResumoMensalOS.valor_total).join(
+        StatusOS, StatusOS.id == ResumoMensalOS.status_id
+    ).filter(or_(ResumoMensalOS.ano_mes >= _mes_referencia(primeiro_mes_grafico), StatusOS.nome == 'ABERTA')).all()
+
+    faturamento_por_mes, os_abertas, os_finalizadas_mes = {}, 0, 0
+    for ano_mes, status_nome, quantidade, valor_total in resumo:
+        if status_nome == 'ABERTA':
+            os_abertas += quantidade
+        if status_nome in status_concluidos_nomes:
+            faturamento_por_mes[ano_mes] = faturamento_por_mes.get(ano_mes, 0) + valor_total
+            if ano_mes == mes_atual:
+                os_finalizadas_mes += quantidade
+    total_faturado_mes = faturamento_por_mes.get(mes_atual, 0)
     ticket_medio = (total_faturado_mes / os_finalizadas_mes) if os_finalizadas_mes > 0 else 0
-    
+
     chart_labels, chart_data = [], []
-    for i in range(6):
-        data_referencia = hoje - relativedelta(months=i)
-        primeiro_dia_mes = data_referencia.replace(day=1)
-        primeiro_dia_proximo_mes = primeiro_dia_mes + relativedelta(months=1)
-        ordens_do_mes = OrdemServico.query.filter(
-            OrdemServico.status_id.in_(status_concluidos_ids),
-            OrdemServico.data_criacao >= primeiro_dia_mes,
-            OrdemServico.data_criacao < primeiro_dia_proximo_mes
-        ).all()
-        faturamento_mes_total = sum(ordem.valor_total for ordem in ordens_do_mes)
-        nome_mes = primeiro_dia_mes.strftime('%b/%y')
-        chart_labels.append(nome_mes)
-        chart_data.append(faturamento_mes_total)
-    chart_labels.reverse()
-    chart_data.reverse()
-
-    return render_template('dashboard.html', 
-                           total_faturado=total_faturado_mes,
-                           os_abertas=os_abertas,
-                           os_finalizadas_mes=os_finalizadas_mes,
-                           ticket_medio=ticket_medio,
-                           chart_labels=chart_labels,
-                           chart_data=chart_data)
+    for i in range(5, -1, -1):
+        primeiro_dia_mes = hoje.replace(day=1) - relativedelta(months=i)
+        chart_labels.append(primeiro_dia_mes.strftime('%b/%y'))
+        chart_data.append(faturamento_por_mes.get(_mes_referencia(primeiro_dia_mes), 0))
+
+    return dict(total_faturado=total_faturado_mes,
+                os_abertas=os_abertas,
+                os_finalizadas_mes=os_finalizadas_mes,
+                ticket_medio=ticket_medio,
+                chart_labels=chart_labels,
+                chart_data=chart_data)
 
 
 # ==============================================================================
@@ -326,20 +945,17 @@ def dashboard():
 def gerenciar_clientes():
     if request.method == 'POST':
         tipo_pessoa = request.form['tipo_pessoa']
-        validador_cpf = CPF()
-        validador_cnpj = CNPJ()
-
         if tipo_pessoa == 'FISICA':
             cpf_raw = request.form.get('cpf', '')
             cpf_limpo = "".join(filter(str.isdigit, cpf_raw))
-            if not validador_cpf.validate(cpf_limpo):
+            if not cpf_valido(cpf_limpo):
                 flash('CPF inválido. Por favor, verifique o número digitado.', 'danger')
                 return redirect(url_for('gerenciar_clientes'))
             novo_cliente = Cliente(tipo_pessoa='FISICA', nome=request.form.get('nome', '').upper(), cpf=cpf_limpo)
         else:
             cnpj_raw = request.form.get('cnpj', '')
             cnpj_limpo = "".join(filter(str.isdigit, cnpj_raw))
-            if not validador_cnpj.validate(cnpj_limpo):
+            if not cnpj_valido(cnpj_limpo):
                 flash('CNPJ inválido. Por favor, verifique o número digitado.', 'danger')
                 return redirect(url_for('gerenciar_clientes'))
             novo_cliente = Cliente(tipo_pessoa='JURIDICA', razao_social=request.form.get('razao_social', '').upper(), cnpj=cnpj_limpo, inscricao_estadual="".join(filter(str.isdigit, request.form.get('inscricao_estadual', ''))))
@@ -372,38 +988,42 @@ def gerenciar_clientes():
 
     if search_term:
         doc_search_term = "".join(filter(str.isdigit, search_term))
-        search_filter = or_(
-            Cliente.nome.ilike(f'%{search_term}%'),
-            Cliente.razao_social.ilike(f'%{search_term}%'),
-            Cliente.cpf.ilike(f'%{doc_search_term}%'),
-            Cliente.cnpj.ilike(f'%{doc_search_term}%'),
-            Cliente.cidade.ilike(f'%{search_term}%')
-        )
-        query = query.filter(search_filter)
+        if doc_search_term and re.fullmatch(r'[\d.\-/ ]+', search_term):
+            query = query.filter(filtro_prefixo_documento(doc_search_term))
+        else:
+            # Busca por texto: resultados mais relevantes primeiro, paginados por (relevância, id)
+            consulta = consulta_fts(search_term)
+            if not consulta:
+                return render_template('clientes.html', clientes=[], search_term=search_term, proximo_cursor=None)
+            encontrados = resultados_fts('cliente_fts', consulta)
+            todos_clientes, proximo_cursor = paginar_keyset(query.join(encontrados, encontrados.c.id == Cliente.id),
+                                                            [(encontrados.c.rank, 'asc'), (Cliente.id, 'asc')],
+                                                            request.args.get('cursor'), request.args.get('limite'))
+            return render_template('clientes.html', clientes=todos_clientes, search_term=search_term, proximo_cursor=proximo_cursor)
     
     # Ordena pelo nome/razão social para um resultado mais intuitivo
-    ordem_inteligente = case((Cliente.nome != None, Cliente.nome), else_=Cliente.razao_social)
-    todos_clientes = query.order_by(ordem_inteligente.asc()).all()
+    ordem_inteligente = func.coalesce(case((Cliente.nome != None, Cliente.nome), else_=Cliente.razao_social), '')
+    todos_clientes, proximo_cursor = paginar_keyset(query, [(ordem_inteligente, 'asc'), (Cliente.id, 'asc')],
+                                                    request.args.get('cursor'), request.args.get('limite'))
     
-    return render_template('clientes.html', clientes=todos_clientes, search_term=search_term)
+    return render_template('clientes.html', clientes=todos_clientes, search_term=search_term, proximo_cursor=proximo_cursor)
 
 @app.route('/cliente/adicionar', methods=['GET', 'POST'])
 @login_required
 def adicionar_cliente():
     if request.method == 'POST':
         tipo_pessoa = request.form['tipo_pessoa']
-        validador_cpf, validador_cnpj = CPF(), CNPJ()
         if tipo_pessoa == 'FISICA':
             cpf_raw = request.form.get('cpf', '')
             cpf_limpo = "".join(filter(str.isdigit, cpf_raw))
-            if not validador_cpf.validate(cpf_limpo):
+            if not cpf_valido(cpf_limpo):
                 flash('CPF inválido. Por favor, verifique o número digitado.', 'danger')
                 return redirect(url_for('adicionar_cliente'))
             novo_cliente = Cliente(tipo_pessoa='FISICA', nome=request.form.get('nome', '').upper(), cpf=cpf_limpo)
         else:
             cnpj_raw = request.form.get('cnpj', '')
             cnpj_limpo = "".join(filter(str.isdigit, cnpj_raw))
-            if not validador_cnpj.validate(cnpj_limpo):
+            if not cnpj_valido(cnpj_limpo):
                 flash('CNPJ inválido. Por favor, verifique o número digitado.', 'danger')
                 return redirect(url_for('adicionar_cliente'))
             novo_cliente = Cliente(
@@ -439,18 +1059,17 @@ def editar_cliente(id):
     cliente = Cliente.query.get_or_404(id)
     if request.method == 'POST':
         cliente.tipo_pessoa = request.form['tipo_pessoa']
-        validador_cpf, validador_cnpj = CPF(), CNPJ()
         if cliente.tipo_pessoa == 'FISICA':
             cliente.nome = request.form.get('nome', '').upper()
             cliente.cpf = "".join(filter(str.isdigit, request.form.get('cpf', '')))
-            if not validador_cpf.validate(cliente.cpf):
+            if not cpf_valido(cliente.cpf):
                 flash('CPF inválido.', 'danger')
                 return redirect(url_for('editar_cliente', id=id))
         else:
             cliente.razao_social = request.form.get('razao_social', '').upper()
             cliente.cnpj = "".join(filter(str.isdigit, request.form.get('cnpj', '')))
             cliente.inscricao_estadual = "".join(filter(str.isdigit, request.form.get('inscricao_estadual', '')))
-            if not validador_cnpj.validate(cliente.cnpj):
+            if not cnpj_valido(cliente.cnpj):
                 flash('CNPJ inválido.', 'danger')
                 return redirect(url_for('editar_cliente', id=id))
         cliente.telefone = "".join(filter(str.isdigit, request.form.get('telefone', '')))
@@ -490,50 +1109,88 @@ def deletar_cliente(id):
 @login_required
 def relatorio_clientes_pdf():
     clientes = Cliente.query.order_by(Cliente.id.asc()).all()
-    data_geracao = datetime.datetime.now()
-    logo_data_uri = None
-    try:
-        project_path = pathlib.Path(__file__).parent
-        logo_path = project_path / 'static' / 'images' / 'logo.png'
-        with open(logo_path, 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        logo_data_uri = f"data:image/png;base64,{encoded_string}"
-    except FileNotFoundError:
-        logging.warning("Arquivo logo.png não encontrado para o PDF do relatório de clientes.")
-
-    # Certifique-se de que você tem o template 'relatorio_clientes_pdf.html' na pasta templates
-    html_renderizado = render_template('relatorio_clientes_pdf.html',
-                                       clientes=clientes,
-                                       data_geracao=data_geracao,
-                                       logo_path=logo_data_uri)
-    pdf = HTML(string=html_renderizado).write_pdf()
-    return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': 'inline; filename=relatorio_clientes.pdf'})
+    return responder_pdf('relatorio_clientes_pdf.html', 'relatorio_clientes.pdf',
+                         clientes=clientes, data_geracao=datetime.datetime.now())
 
 @app.route('/relatorio/clientes/excel')
 @login_required
 def relatorio_clientes_excel():
-    clientes = Cliente.query.order_by(Cliente.id.asc()).all()
-    dados_para_excel = []
-    for c in clientes:
-        dados_para_excel.append({
-            'ID': c.id,
-            'Nome/Razão Social': c.nome_exibicao,
-            'Documento': c.documento_exibicao,
-            'Telefone': c.telefone_formatado,
-            'Email': c.email,
-            'Cidade/UF': f"{c.cidade or ''}/{c.uf or ''}"
-        })
-
-    df = pd.DataFrame(dados_para_excel)
-    output = io.BytesIO()
-    # No seu app.py, a biblioteca para Excel é 'openpyxl', então vamos mantê-la
-    writer = pd.ExcelWriter(output, engine='openpyxl')
-    df.to_excel(writer, index=False, sheet_name='RelatorioClientes')
-    # O método close() é o correto para a versão mais recente do pandas/openpyxl
-    writer.close()
-    output.seek(0)
-
-    return Response(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers={'Content-Disposition': 'attachment; filename=relatorio_clientes.xlsx'})
+    colunas = [Coluna('ID', 8), Coluna('Nome/Razão Social', 40), Coluna('Documento', 20), Coluna('Telefone', 17),
+               Coluna('Email', 30), Coluna('Cidade/UF', 25)]
+    linhas = ((c.id, c.nome_exibicao, c.documento_exibicao, c.telefone_formatado, c.email, f"{c.cidade or ''}/{c.uf or ''}")
+              for c in Cliente.query.order_by(Cliente.id.asc()).yield_per(LINHAS_POR_LEITURA))
+    return responder_xlsx('relatorio_clientes.xlsx', 'RelatorioClientes', colunas, linhas)
+
+# --- IMPORTAÇÃO DE CLIENTES E FORNECEDORES (CSV/XLSX) ---
+IMPORTACOES = {'clientes': (Cliente, 'gerenciar_clientes'), 'fornecedores': (Fornecedor, 'gerenciar_fornecedores')}
+LIMITE_ERROS_TELA = 500
+
+def importar_cadastros(tipo, arquivo, nome_arquivo):
+    with db.engine.connect() as conexao:
+        return importar(conexao, IMPORTACOES[tipo][0].__table__, tipo, ler_linhas(arquivo, nome_arquivo))
+
+def _responder_importacao(tipo):
+    modelo, pagina = IMPORTACOES[tipo]
+    arquivo = request.files.get('arquivo')
+    json_pedido = request.accept_mimetypes.best == 'application/json'
+    if not arquivo or not arquivo.filename:
+        if json_pedido: return jsonify({'erro': 'Nenhum arquivo enviado.'}), 400
+        flash('Selecione um arquivo .csv ou .xlsx para importar.', 'warning')
+        return redirect(url_for(pagina))
+    try:
+        resultado = importar_cadastros(tipo, arquivo.stream, arquivo.filename)
+    except ErroImportacao as e:
+        if json_pedido: return jsonify({'erro': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(url_for(pagina))
+    logging.info(f"Importação de {tipo}: {resultado.importadas}/{resultado.lidas} linha(s) em {resultado.segundos:.2f} s")
+    if json_pedido:
+        return jsonify(resultado.como_dict())
+    return render_template('importacao_resultado.html', tipo=tipo, pagina=pagina,
+                           resultado=resultado.como_dict(LIMITE_ERROS_TELA), limite_erros=LIMITE_ERROS_TELA)
+
+@app.route('/clientes/importar', methods=['POST'])
+@login_required
+def importar_clientes():
+    return _responder_importacao('clientes')
+
+@app.route('/fornecedores/importar', methods=['POST'])
+@login_required
+def importar_fornecedores():
+    return _responder_importacao('fornecedores')
+
+# --- AUDITORIA DE CADASTROS (CPF/CNPJ, TELEFONE, CEP) ---
+LINHAS_POR_LOTE_AUDITORIA = 50000
+COLUNAS_AUDITORIA = ['tabela', 'id', 'campo', 'valor', 'problema']
+
+def _lotes_auditoria(modelo, *colunas):
+    # Paginação por id: cada lote é uma consulta curta, sem carregar objetos do ORM
+    ultimo_id = 0
+    while True:
+        linhas = db.session.execute(select(modelo.id, *colunas).where(modelo.id > ultimo_id)
+                                    .order_by(modelo.id).limit(LINHAS_POR_LOTE_AUDITORIA)).all()
+        if not linhas:
+            return
+        ultimo_id = linhas[-1][0]
+        yield [list(coluna) for coluna in zip(*linhas)]
+
+def auditar_cadastros():
+    """Devolve (problemas, linhas conferidas por tabela); cada problema é (tabela, id, campo, valor, problema)."""
+    problemas, conferidas = [], collections.Counter()
+    for ids, tipos, cpfs, cnpjs, telefones, ceps in _lotes_auditoria(
+            Cliente, Cliente.tipo_pessoa, Cliente.cpf, Cliente.cnpj, Cliente.telefone, Cliente.cep):
+        fisica = [tipo == 'FISICA' for tipo in tipos]
+        problemas += auditar('cliente', ids, 'cpf', cpfs, validar_cpfs, 'CPF inválido', fisica)
+        problemas += auditar('cliente', ids, 'cnpj', cnpjs, validar_cnpjs, 'CNPJ inválido', [not f for f in fisica])
+        problemas += auditar('cliente', ids, 'telefone', telefones, validar_telefones, 'telefone inválido', [bool(t) for t in telefones])
+        problemas += auditar('cliente', ids, 'cep', ceps, validar_ceps, 'CEP inválido', [bool(c) for c in ceps])
+        conferidas['cliente'] += len(ids)
+    for ids, cnpjs, telefones, ceps in _lotes_auditoria(Fornecedor, Fornecedor.cnpj, Fornecedor.telefone, Fornecedor.cep):
+        problemas += auditar('fornecedor', ids, 'cnpj', cnpjs, validar_cnpjs, 'CNPJ inválido', [bool(c) for c in cnpjs])
+        problemas += auditar('fornecedor', ids, 'telefone', telefones, validar_telefones, 'telefone inválido', [bool(t) for t in telefones])
+        problemas += auditar('fornecedor', ids, 'cep', ceps, validar_ceps, 'CEP inválido', [bool(c) for c in ceps])
+        conferidas['fornecedor'] += len(ids)
+    return problemas, conferidas
 
 # --- FORNECEDORES ---
 @app.route('/fornecedores')
@@ -544,16 +1201,16 @@ def gerenciar_fornecedores():
     if search_term:
         search_filter = or_(Fornecedor.razao_social.ilike(f'%{search_term}%'), Fornecedor.nome_fantasia.ilike(f'%{search_term}%'), Fornecedor.cnpj.ilike(f'%{search_term}%'))
         query = query.filter(search_filter)
-    todos_fornecedores = query.order_by(Fornecedor.razao_social).all()
-    return render_template('fornecedores.html', fornecedores=todos_fornecedores, search_term=search_term)
+    todos_fornecedores, proximo_cursor = paginar_keyset(query, [(Fornecedor.razao_social, 'asc'), (Fornecedor.id, 'asc')],
+                                                        request.args.get('cursor'), request.args.get('limite'))
+    return render_template('fornecedores.html', fornecedores=todos_fornecedores, search_term=search_term, proximo_cursor=proximo_cursor)
 
 @app.route('/fornecedor/adicionar', methods=['GET', 'POST'])
 @login_required
 def adicionar_fornecedor():
     if request.method == 'POST':
-        validador_cnpj = CNPJ()
         cnpj_limpo = "".join(filter(str.isdigit, request.form.get('cnpj', '')))
-        if cnpj_limpo and not validador_cnpj.validate(cnpj_limpo):
+        if cnpj_limpo and not cnpj_valido(cnpj_limpo):
             flash('CNPJ inválido.', 'danger')
             return redirect(url_for('adicionar_fornecedor'))
         novo_fornecedor = Fornecedor(
@@ -681,7 +1338,7 @@ def editar_produto(produto_id):
 def deletar_produto(produto_id):
     produto = Produto.query.get_or_404(produto_id)
     movimento_entrada = EntradaEstoqueItem.query.filter_by(produto_id=produto.id).first()
-    movimento_saida = Peca.query.filter_by(descricao=produto.descricao).first()
+    movimento_saida = Peca.query.filter_by(produto_id=produto.id).first()
     if movimento_entrada or movimento_saida:
         flash(f'Não é possível excluir o produto "{produto.descricao}", pois ele já possui movimentações.', 'danger')
         return redirect(url_for('estoque'))
@@ -736,8 +1393,28 @@ def deletar_status_os(id):
 @app.route('/estoque')
 @login_required
 def estoque():
-    produtos = Produto.query.order_by(Produto.descricao).all()
-    return render_template('estoque.html', produtos=produtos)
+    produtos, proximo_cursor = paginar_keyset(Produto.query, [(Produto.descricao, 'asc'), (Produto.id, 'asc')],
+                                              request.args.get('cursor'), request.args.get('limite'))
+    return render_template('estoque.html', produtos=produtos, proximo_cursor=proximo_cursor)
+
+@app.route('/estoque/saldos')
+@login_required
+def saldos_estoque():
+    # ?em=AAAA-MM-DD (fim do dia) ou AAAA-MM-DDTHH:MM, em UTC como o razão; ?produto_id= pode repetir
+    em = request.args.get('em')
+    try:
+        if not em:
+            momento = datetime.datetime.utcnow()
+        elif 'T' in em:
+            momento = datetime.datetime.fromisoformat(em)
+        else:
+            momento = datetime.datetime.combine(datetime.date.fromisoformat(em), datetime.time.max)
+        produto_ids = [int(i) for i in request.args.getlist('produto_id')] or None
+    except ValueError:
+        return jsonify({'erro': 'Parâmetros inválidos: use em=AAAA-MM-DD[THH:MM] e produto_id inteiro.'}), 400
+    saldos = saldos_em(momento, produto_ids)
+    return jsonify({'em': momento.isoformat(), 'saldos': [{'produto_id': produto_id, 'saldo': saldo}
+                                                          for produto_id, saldo in sorted(saldos.items())]})
 
 @app.route('/estoque/entrada', methods=['GET', 'POST'])
 @login_required
@@ -754,13 +1431,19 @@ def entrada_estoque():
             produtos_ids = request.form.getlist('produto_id[]')
             quantidades = request.form.getlist('quantidade[]')
             custos = request.form.getlist('custo[]')
+            variacoes, ultimo_custo = collections.Counter(), {}
             for i in range(len(produtos_ids)):
                 produto_id, quantidade, custo = int(produtos_ids[i]), int(quantidades[i]), float(custos[i])
-                item = EntradaEstoqueItem(entrada=nova_entrada, produto_id=produto_id, quantidade=quantidade, valor_custo_unitario=custo)
-                db.session.add(item)
-                produto = Produto.query.get(produto_id)
-                produto.quantidade_estoque += quantidade
-                produto.valor_custo = custo
+                if quantidade <= 0:
+                    raise ValueError(f'quantidade inválida na linha {i + 1}')
+                db.session.add(EntradaEstoqueItem(entrada=nova_entrada, produto_id=produto_id, quantidade=quantidade, valor_custo_unitario=custo))
+                variacoes[produto_id] += quantidade
+                ultimo_custo[produto_id] = custo
+            db.session.flush()
+            movimentar_estoque(variacoes, ENTRADA, entrada_estoque_id=nova_entrada.id)
+            if ultimo_custo:
+                db.session.execute(Produto.__table__.update().where(Produto.__table__.c.id.in_(ultimo_custo))
+                                   .values(valor_custo=case(ultimo_custo, value=Produto.__table__.c.id)))
             db.session.commit()
             flash('Entrada de estoque registrada com sucesso!', 'success')
         except Exception as e:
@@ -776,14 +1459,22 @@ def entrada_estoque():
 @login_required
 def listar_ordens():
     search_term = request.args.get('q', '')
-    query = OrdemServico.query
+    # Cliente e status vêm no mesmo SELECT das O.S. (sem N+1 na listagem)
+    query = OrdemServico.query.join(OrdemServico.cliente).options(contains_eager(OrdemServico.cliente), joinedload(OrdemServico.status))
     if search_term:
-        search_filter = or_(Cliente.nome.ilike(f'%{search_term}%'), OrdemServico.problema.ilike(f'%{search_term}%'))
-        if search_term.isdigit(): search_filter = or_(search_filter, OrdemServico.id == int(search_term))
-        query = query.filter(search_filter)
-    ordens = query.order_by(OrdemServico.data_criacao.desc()).all()
+        filtros = []
+        consulta = consulta_fts(search_term)
+        if consulta:
+            filtros.append(OrdemServico.id.in_(select(resultados_fts('ordem_servico_fts', consulta).c.id)))
+            filtros.append(OrdemServico.cliente_id.in_(select(resultados_fts('cliente_fts', consulta_fts(search_term, ['nome', 'razao_social'])).c.id)))
+        if search_term.isdigit():
+            filtros.append(OrdemServico.id == int(search_term))
+            filtros.append(filtro_prefixo_documento(search_term))
+        query = query.filter(or_(*filtros) if filtros else False)
+    ordens, proximo_cursor = paginar_keyset(query, [(OrdemServico.data_criacao, 'desc'), (OrdemServico.id, 'desc')],
+                                            request.args.get('cursor'), request.args.get('limite'))
     clientes = Cliente.query.order_by(Cliente.nome).all()
-    return render_template('index.html', ordens=ordens, clientes=clientes, search_term=search_term)
+    return render_template('index.html', ordens=ordens, clientes=clientes, search_term=search_term, proximo_cursor=proximo_cursor)
 
 @app.route('/os/adicionar', methods=['POST'])
 @login_required
@@ -855,15 +1546,18 @@ def adicionar_peca(os_id):
         flash(f'Não é possível adicionar peças pois o status da O.S. é "{os.status.nome}".', 'warning')
         return redirect(url_for('detalhe_os', id=os_id))
     try:
-        produto_id, quantidade = request.form['produto_id'], int(request.form['quantidade'])
-        produto = Produto.query.get(produto_id)
+        produto_id, quantidade = int(request.form['produto_id']), int(request.form['quantidade'])
+        produto = db.session.get(Produto, produto_id)
         if not produto:
             flash('Produto não encontrado.', 'danger')
-        elif produto.quantidade_estoque < quantidade:
+        elif quantidade <= 0:
+            flash('Informe uma quantidade maior que zero.', 'danger')
+        elif not movimentar_estoque({produto.id: -quantidade}, SAIDA_OS, ordem_servico_id=os_id):
+            db.session.refresh(produto, ['quantidade_estoque'])
             flash(f'Estoque insuficiente para "{produto.descricao}". Disponível: {produto.quantidade_estoque}', 'danger')
         else:
-            nova_peca = Peca(descricao=produto.descricao, quantidade=quantidade, valor_unitario=produto.valor_venda, ordem_servico_id=os_id)
-            produto.quantidade_estoque -= quantidade
+            nova_peca = Peca(descricao=produto.descricao, quantidade=quantidade, valor_unitario=produto.valor_venda,
+                             ordem_servico_id=os_id, produto_id=produto.id)
             db.session.add(nova_peca)
             db.session.commit()
             flash('Peça adicionada e estoque atualizado!', 'success')
@@ -881,9 +1575,8 @@ def deletar_peca(peca_id):
         flash(f'Não é possível remover peças pois o status da O.S. é "{peca.ordem_servico.status.nome}".', 'warning')
         return redirect(url_for('detalhe_os', id=os_id))
     try:
-        produto = Produto.query.filter_by(descricao=peca.descricao).first()
-        if produto:
-            produto.quantidade_estoque += peca.quantidade
+        if peca.produto_id:
+            movimentar_estoque({peca.produto_id: peca.quantidade}, ESTORNO_OS, ordem_servico_id=os_id)
         db.session.delete(peca)
         db.session.commit()
         flash('Peça removida e estoque estornado!', 'success')
@@ -989,19 +1682,24 @@ def converter_orcamento_para_os(id):
             status_id=status_aberta.id
         )
         db.session.add(nova_os)
+        baixas, descricoes = collections.Counter(), {}
         for item in orcamento.itens:
             peca = Peca(
                 ordem_servico=nova_os,
+                produto_id=item.produto_id,
                 descricao=item.descricao,
                 quantidade=item.quantidade,
                 valor_unitario=item.valor_unitario
             )
             db.session.add(peca)
-            produto = Produto.query.get(item.produto_id)
-            if produto.quantidade_estoque < item.quantidade:
-                flash(f'Atenção: Estoque insuficiente para "{produto.descricao}". Baixa não realizada.', 'warning')
-            else:
-                produto.quantidade_estoque -= item.quantidade
+            baixas[item.produto_id] -= item.quantidade
+            descricoes.setdefault(item.produto_id, item.descricao)
+        db.session.flush()
+        # Todas as baixas num único UPDATE; um produto sem saldo para o total pedido não é baixado
+        baixados = movimentar_estoque(baixas, SAIDA_OS, ordem_servico_id=nova_os.id)
+        for produto_id in baixas:
+            if produto_id not in baixados:
+                flash(f'Atenção: Estoque insuficiente para "{descricoes[produto_id]}". Baixa não realizada.', 'warning')
         orcamento.status = 'Aprovado'
         db.session.commit()
         flash(f'Orçamento #{id} convertido com sucesso para a O.S. #{nova_os.id}!', 'success')
@@ -1036,19 +1734,7 @@ def deletar_orcamento(id):
 @login_required
 def gerar_orcamento_pdf(id):
     orcamento = Orcamento.query.get_or_404(id)
-    logo_data_uri = None
-    try:
-        project_path = pathlib.Path(__file__).parent
-        logo_path = project_path / 'static' / 'images' / 'logo.png'
-        with open(logo_path, 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        logo_data_uri = f"data:image/png;base64,{encoded_string}"
-    except FileNotFoundError:
-        logging.warning("Arquivo logo.png não encontrado para o PDF do orçamento.")
-
-    html_renderizado = render_template('orcamento_pdf_template.html', orcamento=orcamento, logo_path=logo_data_uri)
-    pdf = HTML(string=html_renderizado, base_url=str(project_path)).write_pdf()
-    return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': f'inline; filename=orcamento_{orcamento.id}.pdf'})
+    return responder_pdf('orcamento_pdf_template.html', f'orcamento_{orcamento.id}.pdf', orcamento=orcamento)
 
 # ==============================================================================
 # 6. ROTAS FINANCEIRAS (FATURAMENTO, CONTAS A PAGAR/RECEBER)
@@ -1104,6 +1790,7 @@ def faturamento():
                 return redirect(url_for('faturamento'))
             for os in ordens:
                 os.status_id = status_faturada.id
+                nova_fatura.ordens.append(os)
             db.session.add(nova_fatura)
             db.session.commit()
             flash(f'Fatura #{nova_fatura.id} gerada com sucesso!', 'success')
@@ -1116,13 +1803,19 @@ def faturamento():
 
     data_inicio_str, data_fim_str, cliente_id = request.args.get('data_inicio'), request.args.get('data_fim'), request.args.get('cliente_id', 'todos')
     status_finalizada = StatusOS.query.filter(func.upper(StatusOS.nome) == 'FINALIZADA').first()
-    query = OrdemServico.query.filter(OrdemServico.status_id == status_finalizada.id) if status_finalizada else OrdemServico.query.filter(False)
+    ordens_para_faturar = filtrar_ordens_a_faturar(request.args, status_finalizada.id if status_finalizada else None).all()
+    todos_clientes = Cliente.query.order_by(Cliente.nome).all()
+    return render_template('faturamento.html', ordens=ordens_para_faturar, todos_clientes=todos_clientes, data_inicio=data_inicio_str, data_fim=data_fim_str, cliente_id_filtro=cliente_id)
+
+def filtrar_ordens_a_faturar(args, status_finalizada_id):
+    """O.S. finalizadas (fechadas no período, do cliente) disponíveis para faturar, das mais novas para as mais antigas."""
+    data_inicio_str, data_fim_str, cliente_id = args.get('data_inicio'), args.get('data_fim'), args.get('cliente_id', 'todos')
+    query = OrdemServico.query.options(joinedload(OrdemServico.cliente))
+    query = query.filter(OrdemServico.status_id == status_finalizada_id) if status_finalizada_id else query.filter(False)
     if data_inicio_str: query = query.filter(OrdemServico.data_fechamento >= datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date())
     if data_fim_str: query = query.filter(OrdemServico.data_fechamento <= datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date())
     if cliente_id != 'todos': query = query.filter(OrdemServico.cliente_id == int(cliente_id))
-    ordens_para_faturar = query.order_by(OrdemServico.data_criacao.desc()).all()
-    todos_clientes = Cliente.query.order_by(Cliente.nome).all()
-    return render_template('faturamento.html', ordens=ordens_para_faturar, todos_clientes=todos_clientes, data_inicio=data_inicio_str, data_fim=data_fim_str, cliente_id_filtro=cliente_id)
+    return query.order_by(OrdemServico.data_criacao.desc())
 
 @app.route('/faturamento/cancelar/<int:fatura_id>', methods=['POST'])
 @login_required
@@ -1148,8 +1841,11 @@ def cancelar_fatura(fatura_id):
 @app.route('/contas-a-receber')
 @login_required
 def gerenciar_contas_a_receber():
-    contas = Pagamento.query.order_by(Pagamento.status.asc(), Pagamento.data_vencimento.asc()).all()
-    return render_template('contas_a_receber.html', contas=contas, today_date=datetime.date.today())
+    query = Pagamento.query.options(joinedload(Pagamento.faturamento).joinedload(Faturamento.cliente),
+                                    joinedload(Pagamento.faturamento).selectinload(Faturamento.pagamentos))
+    contas, proximo_cursor = paginar_keyset(query, [(Pagamento.status, 'asc'), (Pagamento.data_vencimento, 'asc'), (Pagamento.id, 'asc')],
+                                            request.args.get('cursor'), request.args.get('limite'))
+    return render_template('contas_a_receber.html', contas=contas, today_date=datetime.date.today(), proximo_cursor=proximo_cursor)
 
 @app.route('/pagamento/receber/<int:pagamento_id>', methods=['POST'])
 @login_required
@@ -1206,9 +1902,11 @@ def gerenciar_contas_a_pagar():
             db.session.rollback()
             flash(f'Ocorreu um erro ao cadastrar a conta: {e}', 'danger')
         return redirect(url_for('gerenciar_contas_a_pagar'))
-    contas = ContaPagar.query.order_by(ContaPagar.status.asc(), ContaPagar.data_vencimento.asc()).all()
+    query = ContaPagar.query.options(joinedload(ContaPagar.fornecedor))
+    contas, proximo_cursor = paginar_keyset(query, [(ContaPagar.status, 'asc'), (ContaPagar.data_vencimento, 'asc'), (ContaPagar.id, 'asc')],
+                                            request.args.get('cursor'), request.args.get('limite'))
     fornecedores = Fornecedor.query.order_by(Fornecedor.razao_social).all()
-    return render_template('contas_a_pagar.html', contas=contas, fornecedores=fornecedores, today_date=datetime.date.today())
+    return render_template('contas_a_pagar.html', contas=contas, fornecedores=fornecedores, today_date=datetime.date.today(), proximo_cursor=proximo_cursor)
 
 @app.route('/conta/pagar/<int:conta_id>', methods=['POST'])
 @login_required
@@ -1277,144 +1975,553 @@ def editar_conta_a_pagar(conta_id):
 # ==============================================================================
 # 7. ROTAS DE RELATÓRIOS E EXPORTAÇÃO
 # ==============================================================================
-@app.route('/relatorio/os')
-@login_required
-def relatorio_os():
-    data_inicio_str, data_fim_str = request.args.get('data_inicio'), request.args.get('data_fim')
-    status_id, cliente_id = request.args.get('status_id', 'todos'), request.args.get('cliente_id', 'todos')
+def filtrar_ordens(args):
+    """Filtros do relatório de O.S. (período de criação, cliente, status), compartilhados com a exportação em lote."""
+    data_inicio_str, data_fim_str = args.get('data_inicio'), args.get('data_fim')
+    status_id, cliente_id = args.get('status_id', 'todos'), args.get('cliente_id', 'todos')
+    status_nome = args.get('status', 'todas')
     query = OrdemServico.query
     if data_inicio_str: query = query.filter(OrdemServico.data_criacao >= datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date())
     if data_fim_str: query = query.filter(OrdemServico.data_criacao < datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date() + datetime.timedelta(days=1))
     if status_id != 'todos': query = query.filter(OrdemServico.status_id == int(status_id))
+    # O formulário da tela envia o nome do status em "status"
+    if status_nome not in ('todas', 'todos', ''):
+        query = query.filter(OrdemServico.status_id.in_(select(StatusOS.id).where(func.upper(StatusOS.nome) == status_nome.upper())))
     if cliente_id != 'todos': query = query.filter(OrdemServico.cliente_id == int(cliente_id))
+    return query
+
+def filtrar_faturas(args):
+    """Filtros do relatório de faturamento (período de emissão, cliente), compartilhados com a exportação em lote."""
+    data_inicio_str, data_fim_str, cliente_id = args.get('data_inicio'), args.get('data_fim'), args.get('cliente_id', 'todos')
+    query = Faturamento.query
+    if data_inicio_str: query = query.filter(Faturamento.data_emissao >= datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date())
+    if data_fim_str: query = query.filter(Faturamento.data_emissao < datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date() + datetime.timedelta(days=1))
+    if cliente_id != 'todos': query = query.filter(Faturamento.cliente_id == int(cliente_id))
+    return query
+
+def consulta_relatorio_faturamento(args):
+    """Faturas filtradas com os totais das suas O.S. (serviços, peças, nº de O.S.), numa única consulta agrupada.
+
+    Usa os totais persistidos da O.S. (valor_servicos/valor_pecas). Uma O.S. ligada a mais de uma fatura do
+    filtro conta uma vez só no nº de O.S. (na primeira fatura), como o set() do cálculo antigo.
+    """
+    faturas = filtrar_faturas(args)
+    vinculos = select(
+        faturamento_os.c.faturamento_id, OrdemServico.valor_servicos, OrdemServico.valor_pecas,
+        func.row_number().over(partition_by=faturamento_os.c.ordem_servico_id, order_by=faturamento_os.c.faturamento_id).label('ordem'),
+    ).join(OrdemServico, OrdemServico.id == faturamento_os.c.ordem_servico_id).where(
+        faturamento_os.c.faturamento_id.in_(faturas.with_entities(Faturamento.id).scalar_subquery())).subquery()
+    por_fatura = select(
+        vinculos.c.faturamento_id,
+        func.sum(func.coalesce(vinculos.c.valor_servicos, 0.0)).label('servicos'),
+        func.sum(func.coalesce(vinculos.c.valor_pecas, 0.0)).label('pecas'),
+        func.sum(case((vinculos.c.ordem == 1, 1), else_=0)).label('ordens'),
+    ).group_by(vinculos.c.faturamento_id).subquery()
+    return faturas.outerjoin(por_fatura, por_fatura.c.faturamento_id == Faturamento.id).add_columns(
+        func.coalesce(por_fatura.c.servicos, 0.0), func.coalesce(por_fatura.c.pecas, 0.0), func.coalesce(por_fatura.c.ordens, 0)
+    ).options(joinedload(Faturamento.cliente)).order_by(Faturamento.data_emissao.desc(), Faturamento.id.desc())
+
+@app.route('/relatorio/os')
+@login_required
+@pagina_em_cache('relatorio_os.html', OrdemServico.__table__, Cliente.__table__, StatusOS.__table__)
+def relatorio_os():
+    data_inicio_str, data_fim_str = request.args.get('data_inicio'), request.args.get('data_fim')
+    status_id, cliente_id = request.args.get('status_id', 'todos'), request.args.get('cliente_id', 'todos')
+    query = filtrar_ordens(request.args).options(joinedload(OrdemServico.cliente), joinedload(OrdemServico.status))
     ordens = query.order_by(OrdemServico.data_criacao.desc()).all()
     todos_clientes = Cliente.query.order_by(Cliente.nome).all()
     status_disponiveis = StatusOS.query.all()
-    return render_template('relatorio_os.html', ordens=ordens, todos_clientes=todos_clientes, status_disponiveis=status_disponiveis,
-                           data_inicio=data_inicio_str, data_fim=data_fim_str, status_filtro=status_id, cliente_id_filtro=cliente_id)
+    return dict(ordens=ordens, todos_clientes=todos_clientes, status_disponiveis=status_disponiveis,
+                data_inicio=data_inicio_str, data_fim=data_fim_str, status_filtro=request.args.get('status', status_id), cliente_id_filtro=cliente_id)
+
+@app.route('/relatorio/os/pdf')
+@login_required
+def relatorio_os_pdf():
+    query = filtrar_ordens(request.args).options(joinedload(OrdemServico.cliente), joinedload(OrdemServico.status))
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+    if ids: query = query.filter(OrdemServico.id.in_(ids))
+    ordens = query.order_by(OrdemServico.data_criacao.desc()).all()
+    return responder_pdf('relatorio_os_pdf.html', 'relatorio_os.pdf', ordens=ordens, data_geracao=datetime.datetime.now(),
+                         total_relatorio=sum(ordem.valor_total or 0 for ordem in ordens))
 
 @app.route('/relatorio/faturamento')
 @login_required
+@pagina_em_cache('relatorio_faturamento.html', Faturamento.__table__, faturamento_os, OrdemServico.__table__, Cliente.__table__)
 def relatorio_faturamento():
     data_inicio_str, data_fim_str, cliente_id = request.args.get('data_inicio'), request.args.get('data_fim'), request.args.get('cliente_id', 'todos')
-    query_faturas = Faturamento.query
-    if data_inicio_str: query_faturas = query_faturas.filter(Faturamento.data_emissao >= datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date())
-    if data_fim_str: query_faturas = query_faturas.filter(Faturamento.data_emissao < datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date() + datetime.timedelta(days=1))
-    if cliente_id != 'todos': query_faturas = query_faturas.filter(Faturamento.cliente_id == int(cliente_id))
-    faturas_filtradas = query_faturas.order_by(Faturamento.id.desc()).all()
-    total_servicos = sum(os.valor_servicos for f in faturas_filtradas for os in f.ordens)
-    total_pecas = sum(os.valor_pecas for f in faturas_filtradas for os in f.ordens)
+    # Tabela e indicadores saem do mesmo resultado: o número de consultas não depende do período
+    linhas = consulta_relatorio_faturamento(request.args).all()
+    faturas_filtradas = [fatura for fatura, _, _, _ in linhas]
+    total_servicos = sum(servicos for _, servicos, _, _ in linhas)
+    total_pecas = sum(pecas for _, _, pecas, _ in linhas)
     faturamento_total = total_servicos + total_pecas
-    num_os_finalizadas = len(set(os.id for f in faturas_filtradas for os in f.ordens))
+    num_os_finalizadas = sum(ordens for _, _, _, ordens in linhas)
     ticket_medio = (faturamento_total / num_os_finalizadas) if num_os_finalizadas > 0 else 0
     todos_clientes = Cliente.query.order_by(Cliente.nome).all()
-    return render_template('relatorio_faturamento.html', faturas=faturas_filtradas, faturamento_total=faturamento_total,
-                           total_servicos=total_servicos, total_pecas=total_pecas, num_os_finalizadas=num_os_finalizadas,
-                           ticket_medio=ticket_medio, todos_clientes=todos_clientes, data_inicio=data_inicio_str,
-                           data_fim=data_fim_str, cliente_id_filtro=cliente_id)
+    return dict(faturas=faturas_filtradas, faturamento_total=faturamento_total,
+                total_servicos=total_servicos, total_pecas=total_pecas, num_os_finalizadas=num_os_finalizadas,
+                ticket_medio=ticket_medio, todos_clientes=todos_clientes, data_inicio=data_inicio_str,
+                data_fim=data_fim_str, cliente_id_filtro=cliente_id)
 
 @app.route('/relatorio/faturamento-por-cliente')
 @login_required
+@pagina_em_cache('relatorio_faturamento_cliente.html', ResumoCliente.__table__, Cliente.__table__, Faturamento.__table__, Pagamento.__table__)
 def relatorio_faturamento_cliente():
     data_inicio_str, data_fim_str = request.args.get('data_inicio'), request.args.get('data_fim')
-    data_inicio = datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date() if data_inicio_str else None
-    data_fim = datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date() if data_fim_str else None
-    query = db.session.query(
-        Cliente, func.count(Faturamento.id).label('num_faturas'), func.sum(Pagamento.valor).label('total_faturado')
-    ).join(Faturamento, Faturamento.cliente_id == Cliente.id).join(Pagamento, Pagamento.faturamento_id == Faturamento.id)
-    if data_inicio: query = query.filter(Faturamento.data_emissao >= data_inicio)
-    if data_fim: query = query.filter(Faturamento.data_emissao <= data_fim)
-    faturamento_por_cliente = query.group_by(Cliente.id).order_by(desc('total_faturado')).all()
-    return render_template('relatorio_faturamento_cliente.html', faturamento_por_cliente=faturamento_por_cliente,
-                           data_inicio=data_inicio_str, data_fim=data_fim_str)
+    faturamento_por_cliente = db.session.execute(consulta_faturamento_por_cliente(request.args)).all()
+    return dict(faturamento_por_cliente=faturamento_por_cliente, data_inicio=data_inicio_str, data_fim=data_fim_str)
 
-@app.route('/relatorio/fluxo-caixa')
-@login_required
-def relatorio_fluxo_caixa():
-    data_inicio_str, data_fim_str = request.args.get('data_inicio'), request.args.get('data_fim')
+def consulta_faturamento_por_cliente(args):
+    """(Cliente, faturas, faturado, recebido, em aberto, última fatura) por cliente, do maior faturamento para o menor.
+
+    Sem período, lê o resumo_cliente mantido a cada flush; com período, agrega só as faturas emitidas nele.
+    """
+    data_inicio_str, data_fim_str = args.get('data_inicio'), args.get('data_fim')
+    if not (data_inicio_str or data_fim_str):
+        resumo = ResumoCliente.__table__
+    else:
+        filtros = []
+        if data_inicio_str: filtros.append(Faturamento.data_emissao >= datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date())
+        if data_fim_str: filtros.append(Faturamento.data_emissao < datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date() + datetime.timedelta(days=1))
+        resumo = agregado_por_cliente(*filtros).subquery()
+    return select(Cliente, resumo.c.faturas, resumo.c.valor_faturado, resumo.c.valor_recebido, resumo.c.valor_em_aberto,
+                  resumo.c.ultima_fatura).join(resumo, resumo.c.cliente_id == Cliente.id).order_by(
+        resumo.c.valor_faturado.desc(), Cliente.id)
+
+def consultas_fluxo_caixa(args):
+    """Parcelas a receber e contas a pagar pendentes no período, cada uma já ordenada por vencimento."""
+    data_inicio_str, data_fim_str = args.get('data_inicio'), args.get('data_fim')
     data_inicio = datetime.datetime.strptime(data_inicio_str, '%Y-%m-%d').date() if data_inicio_str else None
     data_fim = datetime.datetime.strptime(data_fim_str, '%Y-%m-%d').date() if data_fim_str else None
     query_receber = Pagamento.query.filter(Pagamento.status == 'Pendente')
     if data_inicio: query_receber = query_receber.filter(Pagamento.data_vencimento >= data_inicio)
     if data_fim: query_receber = query_receber.filter(Pagamento.data_vencimento <= data_fim)
-    contas_a_receber = query_receber.all()
     query_pagar = ContaPagar.query.filter(ContaPagar.status == 'Pendente')
     if data_inicio: query_pagar = query_pagar.filter(ContaPagar.data_vencimento >= data_inicio)
     if data_fim: query_pagar = query_pagar.filter(ContaPagar.data_vencimento <= data_fim)
-    contas_a_pagar = query_pagar.all()
-    lancamentos = []
-    for conta in contas_a_receber:
-        lancamentos.append({'data': conta.data_vencimento, 'descricao': f"Recebimento Fatura #{conta.faturamento.id}", 'entrada': conta.valor, 'saida': 0})
-    for conta in contas_a_pagar:
-        lancamentos.append({'data': conta.data_vencimento, 'descricao': conta.descricao, 'entrada': 0, 'saida': conta.valor})
-    lancamentos.sort(key=lambda x: x['data'])
-    saldo = 0
-    for lancamento in lancamentos:
-        saldo += lancamento['entrada'] - lancamento['saida']
-        lancamento['saldo'] = saldo
-    return render_template('fluxo_caixa.html', lancamentos=lancamentos, data_inicio=data_inicio_str, data_fim=data_fim_str)
+    return (query_receber.order_by(Pagamento.data_vencimento, Pagamento.id),
+            query_pagar.order_by(ContaPagar.data_vencimento, ContaPagar.id))
+
+# Agrupamentos do fluxo de caixa: expressão SQL da data do balde (semana = segunda-feira) e rótulo da linha
+AGRUPAMENTOS_FLUXO_CAIXA = {
+    'dia': (lambda data: data, 'Dia'),
+    'semana': (lambda data: func.date(data, 'weekday 0', '-6 days', type_=db.Date), 'Semana de'),
+}
+
+def consulta_fluxo_caixa(args):
+    """Lançamentos do fluxo de caixa em uma consulta (UNION ALL) com o saldo acumulado por janela, em ordem de data.
+
+    Entradas vêm antes das saídas no mesmo dia. Com args['agrupar'] ('dia' ou 'semana') sai uma linha por
+    período com os totais e a contagem de recebimentos (qtd_entradas) e pagamentos (qtd_saidas).
+    """
+    query_receber, query_pagar = consultas_fluxo_caixa(args)
+    entradas = query_receber.with_entities(
+        Pagamento.data_vencimento.label('data'), literal(0).label('ordem'), Pagamento.id.label('id'),
+        ('Recebimento Fatura #' + cast(Pagamento.faturamento_id, db.String)).label('descricao'),
+        Pagamento.valor.label('entrada'), literal(0.0).label('saida')).order_by(None)
+    saidas = query_pagar.with_entities(
+        ContaPagar.data_vencimento, literal(1), ContaPagar.id, ContaPagar.descricao, literal(0.0), ContaPagar.valor).order_by(None)
+    lancamentos = union_all(entradas.statement, saidas.statement).subquery()
+    agrupamento = AGRUPAMENTOS_FLUXO_CAIXA.get(args.get('agrupar'))
+    if agrupamento is None:
+        ordem = (lancamentos.c.data, lancamentos.c.ordem, lancamentos.c.id)
+        return select(lancamentos.c.data, lancamentos.c.descricao, lancamentos.c.entrada, lancamentos.c.saida,
+                      func.sum(lancamentos.c.entrada - lancamentos.c.saida).over(order_by=ordem).label('saldo')).order_by(*ordem)
+    balde = agrupamento[0](lancamentos.c.data).label('data')
+    entrada, saida = func.sum(lancamentos.c.entrada), func.sum(lancamentos.c.saida)
+    return select(balde, entrada.label('entrada'), saida.label('saida'),
+                  func.count(case((lancamentos.c.ordem == 0, 1))).label('qtd_entradas'),
+                  func.count(case((lancamentos.c.ordem == 1, 1))).label('qtd_saidas'),
+                  func.sum(entrada - saida).over(order_by=balde).label('saldo')).group_by(balde).order_by(balde)
+
+def lancamentos_fluxo_caixa(args):
+    """Linhas de consulta_fluxo_caixa lidas em blocos, como dicts com data, descricao, entrada, saida e saldo."""
+    agrupamento = AGRUPAMENTOS_FLUXO_CAIXA.get(args.get('agrupar'))
+    for linha in db.session.execute(consulta_fluxo_caixa(args).execution_options(yield_per=LINHAS_POR_LEITURA)).mappings():
+        lancamento = dict(linha)
+        if agrupamento:
+            lancamento['descricao'] = (f"{agrupamento[1]} {linha['data'].strftime('%d/%m/%Y')}: {linha['qtd_entradas']} "
+                                       f"recebimento(s), {linha['qtd_saidas']} pagamento(s)")
+        yield lancamento
+
+@app.route('/relatorio/fluxo-caixa')
+@login_required
+@pagina_em_cache('fluxo_caixa.html', Pagamento.__table__, ContaPagar.__table__)
+def relatorio_fluxo_caixa():
+    data_inicio_str, data_fim_str = request.args.get('data_inicio'), request.args.get('data_fim')
+    # A página sai em partes conforme as linhas são lidas: o período não limita a memória do processo
+    return dict(lancamentos=lancamentos_fluxo_caixa(request.args), data_inicio=data_inicio_str,
+                data_fim=data_fim_str, agrupar=request.args.get('agrupar', ''))
 
 @app.route('/faturamento/pdf/<int:fatura_id>')
 @login_required
 def gerar_fatura_pdf(fatura_id):
     fatura = Faturamento.query.get_or_404(fatura_id)
-    logo_data_uri = None
-    try:
-        project_path = pathlib.Path(__file__).parent
-        logo_path = project_path / 'static' / 'images' / 'logo.png'
-        with open(logo_path, 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        logo_data_uri = f"data:image/png;base64,{encoded_string}"
-    except FileNotFoundError:
-        logging.warning("Arquivo logo.png não encontrado.")
-    html_renderizado = render_template('fatura_pdf_template.html', fatura=fatura, logo_path=logo_data_uri)
-    pdf = HTML(string=html_renderizado, base_url=str(project_path)).write_pdf()
-    return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': f'inline; filename=fatura_{fatura.id}.pdf'})
+    return responder_pdf('fatura_pdf_template.html', f'fatura_{fatura.id}.pdf', fatura=fatura)
 
 @app.route('/os/pdf/<int:id>')
 @login_required
 def gerar_os_pdf(id):
     os_obj = OrdemServico.query.get_or_404(id)
-    logo_data_uri = None
+    return responder_pdf('os_pdf_template.html', f'os_{os_obj.id}.pdf', os=os_obj)
+
+@app.route('/pdf/tarefas/<tarefa_id>')
+@login_required
+def status_tarefa_pdf(tarefa_id):
+    if not re.fullmatch(r'[0-9a-f]{64}', tarefa_id): abort(404)
+    situacao = _situacao_tarefa_pdf(tarefa_id, request.args.get('nome', f'{tarefa_id[:12]}.pdf'))
+    return jsonify(situacao), 404 if situacao['estado'] == DESCONHECIDO else 200
+
+@app.route('/pdf/tarefas/<tarefa_id>/arquivo')
+@login_required
+def baixar_tarefa_pdf(tarefa_id):
+    if not re.fullmatch(r'[0-9a-f]{64}', tarefa_id): abort(404)
+    nome_arquivo = secure_filename(request.args.get('nome', '')) or f'{tarefa_id[:12]}.pdf'
+    pdf = cache_pdf.obter(tarefa_id)
+    if pdf is not None:
+        return _resposta_pdf(pdf, tarefa_id, nome_arquivo)
+    situacao = _situacao_tarefa_pdf(tarefa_id, nome_arquivo)
+    codigos = {DESCONHECIDO: 404, ERRO: 500}
+    return jsonify(situacao), codigos.get(situacao['estado'], 202)
+
+# --- EXPORTAÇÃO DE PDFs EM LOTE ---
+# Os documentos são carregados do banco em blocos, renderizados em paralelo pelo pool (no máximo
+# 2 por processo em voo) e escritos na resposta um de cada vez, na ordem: a memória não cresce com
+# o número de documentos no ZIP. O PDF único precisa montar o arquivo inteiro, por isso tem limite.
+LOTE_PDF_BLOCO = 50
+LIMITE_PDF_UNICO = 500
+LOTES_PDF = {
+    'faturas': {'modelo': Faturamento, 'filtrar': filtrar_faturas, 'template': 'fatura_pdf_template.html', 'variavel': 'fatura',
+                'prefixo': 'fatura', 'relatorio': 'relatorio_faturamento',
+                'opcoes': (joinedload(Faturamento.cliente), selectinload(Faturamento.pagamentos))},
+    'os': {'modelo': OrdemServico, 'filtrar': filtrar_ordens, 'template': 'os_pdf_template.html', 'variavel': 'os',
+           'prefixo': 'os', 'relatorio': 'relatorio_os',
+           'opcoes': (joinedload(OrdemServico.cliente), joinedload(OrdemServico.status), selectinload(OrdemServico.pecas))},
+}
+
+def ids_lote_pdf(tipo, filtros):
+    lote = LOTES_PDF[tipo]
+    return [registro_id for (registro_id,) in lote['filtrar'](filtros).with_entities(lote['modelo'].id).order_by(lote['modelo'].id)]
+
+def _documentos_lote(tipo, ids):
+    lote = LOTES_PDF[tipo]
+    folha = FOLHAS_PDF.get(lote['template'])
+    for inicio in range(0, len(ids), LOTE_PDF_BLOCO):
+        bloco = ids[inicio:inicio + LOTE_PDF_BLOCO]
+        registros = {r.id: r for r in lote['modelo'].query.options(*lote['opcoes']).filter(lote['modelo'].id.in_(bloco))}
+        for registro_id in bloco:
+            html_renderizado = render_template(lote['template'], logo_path=registro_ativos_pdf.url('logo-pdf'),
+                                               **{lote['variavel']: registros[registro_id]})
+            yield f"{lote['prefixo']}_{registro_id}.pdf", chave_pdf(html_renderizado, versao_template(lote['template'])), html_renderizado, folha
+
+def _pdfs_lote(documentos):
+    """Gera (nome, pdf ou None, erro) na ordem dos documentos, mantendo uma janela limitada de tarefas no pool."""
+    base_url = str(pathlib.Path(__file__).parent)
+    janela = collections.deque()
+
+    def concluir(nome, chave):
+        estado = renderizador_pdf.aguardar(chave, renderizador_pdf.tempo_limite)
+        pdf = cache_pdf.obter(chave) if estado == CONCLUIDO else None
+        return nome, pdf, None if pdf is not None else (renderizador_pdf.erro(chave) or f'renderização não concluída ({estado})')
+
+    for nome, chave, html_renderizado, folha in documentos:
+        renderizador_pdf.enviar(chave, html_renderizado, base_url, folha)
+        janela.append((nome, chave))
+        if len(janela) >= 2 * renderizador_pdf.processos:
+            yield concluir(*janela.popleft())
+    while janela:
+        yield concluir(*janela.popleft())
+
+class _SaidaEmFluxo(io.RawIOBase):
+    """Destino não posicionável para o zipfile: acumula o que foi escrito até ser retirado."""
+    def __init__(self):
+        self.partes = []
+    def writable(self):
+        return True
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+    def retirar(self):
+        dados, self.partes = b''.join(self.partes), []
+        return dados
+
+def _zip_lote(resultados):
+    saida, erros = _SaidaEmFluxo(), []
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_STORED) as arquivo_zip:
+        for nome, pdf, erro in resultados:
+            if pdf is None:
+                erros.append(f'{nome}: {erro}')
+                continue
+            arquivo_zip.writestr(nome, pdf)
+            yield saida.retirar()
+        if erros: arquivo_zip.writestr('ERROS.txt', '\n'.join(erros))
+    yield saida.retirar()
+
+def _pdf_unico_lote(resultados):
+    from pypdf import PdfWriter
+    escritor = PdfWriter()
+    for nome, pdf, erro in resultados:
+        if pdf is None:
+            logging.error(f"PDF em lote: {nome} ficou de fora do arquivo único ({erro})")
+            continue
+        escritor.append(io.BytesIO(pdf))
+    escritor.compress_identical_objects(remove_identicals=True)  # o logo se repete em todas as páginas
+    with tempfile.TemporaryFile() as temporario:
+        escritor.write(temporario)
+        escritor.close()
+        temporario.seek(0)
+        while bloco := temporario.read(64 * 1024):
+            yield bloco
+
+def gerar_lote_pdf(tipo, ids, formato):
+    resultados = _pdfs_lote(_documentos_lote(tipo, ids))
+    return _pdf_unico_lote(resultados) if formato == 'pdf' else _zip_lote(resultados)
+
+def _responder_lote_pdf(tipo):
+    formato = 'pdf' if request.args.get('formato') == 'pdf' else 'zip'
+    filtros = {chave: valor for chave, valor in request.args.items() if chave != 'formato'}
+    ids = ids_lote_pdf(tipo, request.args)
+    if not ids:
+        flash('Nenhum documento encontrado com os filtros informados.', 'warning')
+        return redirect(url_for(LOTES_PDF[tipo]['relatorio'], **filtros))
+    if formato == 'pdf' and len(ids) > LIMITE_PDF_UNICO:
+        flash(f'{len(ids)} documentos: o PDF único aceita até {LIMITE_PDF_UNICO}. Use a exportação em ZIP.', 'warning')
+        return redirect(url_for(LOTES_PDF[tipo]['relatorio'], **filtros))
+    nome_arquivo = f"{tipo}_{datetime.date.today():%Y%m%d}.{formato}"
+    return Response(stream_with_context(gerar_lote_pdf(tipo, ids, formato)),
+                    mimetype='application/pdf' if formato == 'pdf' else 'application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={nome_arquivo}', 'X-Documentos': str(len(ids))})
+
+@app.route('/faturamento/pdf/lote')
+@login_required
+def gerar_faturas_pdf_lote():
+    return _responder_lote_pdf('faturas')
+
+@app.route('/os/pdf/lote')
+@login_required
+def gerar_os_pdf_lote():
+    return _responder_lote_pdf('os')
+
+# --- EXPORTAÇÃO PARA EXCEL ---
+# Consultas lidas em blocos (yield_per) alimentam a planilha write-only de exportacao_xlsx.py;
+# o arquivo segue em blocos na resposta. A memória não depende do número de linhas.
+LINHAS_POR_LEITURA = 1000
+
+def responder_xlsx(nome_arquivo, nome_planilha, colunas, linhas):
+    return Response(stream_with_context(gerar_xlsx(nome_planilha, colunas, linhas)), mimetype=MIMETYPE_XLSX,
+                    headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'})
+
+@app.route('/relatorio/os/excel')
+@login_required
+def relatorio_os_excel():
+    query = filtrar_ordens(request.args).options(joinedload(OrdemServico.cliente), joinedload(OrdemServico.status))
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+    if ids: query = query.filter(OrdemServico.id.in_(ids))
+    colunas = [Coluna('O.S.', 8), Coluna('Cliente', 40), Coluna('Criação', 17, FORMATO_DATA_HORA), Coluna('Fechamento', 17, FORMATO_DATA_HORA),
+               Coluna('Status', 15), Coluna('Serviços', 14, FORMATO_MOEDA), Coluna('Peças', 14, FORMATO_MOEDA), Coluna('Total', 14, FORMATO_MOEDA)]
+    linhas = ((o.id, o.cliente.nome_exibicao if o.cliente else 'CLIENTE REMOVIDO', o.data_criacao, o.data_fechamento,
+               o.status.nome if o.status else '', o.valor_servicos, o.valor_pecas, o.valor_total)
+              for o in query.order_by(OrdemServico.data_criacao.desc(), OrdemServico.id.desc()).yield_per(LINHAS_POR_LEITURA))
+    return responder_xlsx('relatorio_os.xlsx', 'OrdensServico', colunas, linhas)
+
+def consulta_consumo_pecas(args):
+    """Quantidade e valor das peças usadas por produto, nas O.S. que passam pelos filtros do relatório de O.S."""
+    ordens = filtrar_ordens(args).with_entities(OrdemServico.id)
+    consumo = select(Peca.produto_id, func.sum(Peca.quantidade).label('quantidade'),
+                     func.sum(Peca.quantidade * Peca.valor_unitario).label('valor')).where(
+        Peca.produto_id.is_not(None), Peca.ordem_servico_id.in_(ordens.scalar_subquery())).group_by(Peca.produto_id).subquery()
+    return select(Produto.id, Produto.descricao, consumo.c.quantidade, consumo.c.valor).join(
+        consumo, consumo.c.produto_id == Produto.id).order_by(consumo.c.quantidade.desc(), Produto.id)
+
+@app.route('/relatorio/consumo-pecas/excel')
+@login_required
+def relatorio_consumo_pecas_excel():
+    colunas = [Coluna('Produto', 8), Coluna('Descrição', 45), Coluna('Quantidade', 12), Coluna('Valor', 14, FORMATO_MOEDA)]
+    linhas = db.session.execute(consulta_consumo_pecas(request.args).execution_options(yield_per=LINHAS_POR_LEITURA))
+    return responder_xlsx('consumo_pecas.xlsx', 'ConsumoPecas', colunas, (tuple(linha) for linha in linhas))
+
+@app.route('/relatorio/faturamento/excel')
+@login_required
+def relatorio_faturamento_excel():
+    query = filtrar_faturas(request.args).options(joinedload(Faturamento.cliente))
+    colunas = [Coluna('Fatura', 8), Coluna('Emissão', 17, FORMATO_DATA_HORA), Coluna('Vencimento', 12, FORMATO_DATA),
+               Coluna('Cliente', 40), Coluna('Pagamento', 14), Coluna('Valor Total', 14, FORMATO_MOEDA)]
+    linhas = ((f.id, f.data_emissao, f.data_vencimento, f.cliente.nome_exibicao if f.cliente else 'N/A', f.tipo_pagamento, f.valor_total_faturado)
+              for f in query.order_by(Faturamento.id.desc()).yield_per(LINHAS_POR_LEITURA))
+    return responder_xlsx('relatorio_faturamento.xlsx', 'Faturamento', colunas, linhas)
+
+@app.route('/contas-a-receber/excel')
+@login_required
+def contas_a_receber_excel():
+    query = Pagamento.query.options(joinedload(Pagamento.faturamento).joinedload(Faturamento.cliente))
+    colunas = [Coluna('Parcela', 8), Coluna('Fatura', 8), Coluna('Cliente', 40), Coluna('Tipo', 14),
+               Coluna('Vencimento', 12, FORMATO_DATA), Coluna('Valor', 14, FORMATO_MOEDA), Coluna('Status', 12)]
+    linhas = ((p.id, p.faturamento_id, p.faturamento.cliente.nome_exibicao if p.faturamento.cliente else 'N/A', p.tipo_pagamento,
+               p.data_vencimento, p.valor, p.status)
+              for p in query.order_by(Pagamento.status, Pagamento.data_vencimento, Pagamento.id).yield_per(LINHAS_POR_LEITURA))
+    return responder_xlsx('contas_a_receber.xlsx', 'ContasAReceber', colunas, linhas)
+
+@app.route('/contas-a-pagar/excel')
+@login_required
+def contas_a_pagar_excel():
+    query = ContaPagar.query.options(joinedload(ContaPagar.fornecedor))
+    colunas = [Coluna('ID', 8), Coluna('Descrição', 40), Coluna('Fornecedor', 35), Coluna('Emissão', 12, FORMATO_DATA),
+               Coluna('Vencimento', 12, FORMATO_DATA), Coluna('Valor', 14, FORMATO_MOEDA), Coluna('Status', 12)]
+    linhas = ((c.id, c.descricao, c.fornecedor.razao_social if c.fornecedor else '', c.data_emissao, c.data_vencimento, c.valor, c.status)
+              for c in query.order_by(ContaPagar.status, ContaPagar.data_vencimento, ContaPagar.id).yield_per(LINHAS_POR_LEITURA))
+    return responder_xlsx('contas_a_pagar.xlsx', 'ContasAPagar', colunas, linhas)
+
+@app.route('/relatorio/fluxo-caixa/excel')
+@login_required
+def relatorio_fluxo_caixa_excel():
+    colunas = [Coluna('Data', 12, FORMATO_DATA), Coluna('Descrição', 45), Coluna('Entrada', 14, FORMATO_MOEDA),
+               Coluna('Saída', 14, FORMATO_MOEDA), Coluna('Saldo', 14, FORMATO_MOEDA)]
+    linhas = ((l['data'], l['descricao'], l['entrada'], l['saida'], l['saldo']) for l in lancamentos_fluxo_caixa(request.args))
+    return responder_xlsx('fluxo_caixa.xlsx', 'FluxoCaixa', colunas, linhas)
+
+# --- PLANOS DE EXECUÇÃO DAS CONSULTAS QUENTES ---
+# Tabelas de cadastro pequenas (poucas linhas), em que ler tudo é mais barato que usar índice
+TABELAS_PEQUENAS = {'status_os', 'resumo_mensal_os'}
+
+def consultas_quentes():
+    """(nome, consulta) das consultas de dashboard, faturamento, relatórios e contas, com filtros típicos."""
+    hoje = datetime.date.today()
+    periodo = {'data_inicio': (hoje - relativedelta(months=1)).isoformat(), 'data_fim': hoje.isoformat()}
+    agora = datetime.datetime.now()
+    ordens_os = [(OrdemServico.data_criacao, 'desc'), (OrdemServico.id, 'desc')]
+    ordens_pagamento = [(Pagamento.status, 'asc'), (Pagamento.data_vencimento, 'asc'), (Pagamento.id, 'asc')]
+    ordens_conta = [(ContaPagar.status, 'asc'), (ContaPagar.data_vencimento, 'asc'), (ContaPagar.id, 'asc')]
+    return [
+        ('dashboard: resumo mensal (recalculo)', _consulta_resumo_mensal(_mes_referencia(hoje), 1)),
+        ('dashboard: resumo mensal (leitura)', select(ResumoMensalOS).where(ResumoMensalOS.ano_mes >= _mes_referencia(hoje))),
+        ('ordens: página seguinte', consulta_keyset(OrdemServico.query, ordens_os, [agora, 1000], TAMANHO_PAGINA_PADRAO)),
+        ('faturamento: O.S. finalizadas no período', filtrar_ordens_a_faturar(periodo, 1)),
+        ('faturamento: O.S. finalizadas do cliente', filtrar_ordens_a_faturar({'cliente_id': '1'}, 1)),
+        ('relatorio_os: período', filtrar_ordens(periodo).order_by(OrdemServico.data_criacao.desc())),
+        ('relatorio_os: período e status', filtrar_ordens(dict(periodo, status_id='1')).order_by(OrdemServico.data_criacao.desc())),
+        ('relatorio_os: cliente', filtrar_ordens({'cliente_id': '1'}).order_by(OrdemServico.data_criacao.desc())),
+        ('relatorio_faturamento: período', consulta_relatorio_faturamento(periodo)),
+        ('relatorio_faturamento: cliente e período', consulta_relatorio_faturamento(dict(periodo, cliente_id='1'))),
+        ('relatorio_faturamento: O.S. da fatura', select(OrdemServico).join(faturamento_os).where(faturamento_os.c.faturamento_id == 1)),
+        ('relatorio_faturamento_cliente: resumo', consulta_faturamento_por_cliente({})),
+        ('relatorio_faturamento_cliente: período', consulta_faturamento_por_cliente(periodo)),
+        ('resumo_cliente: recálculo do cliente', agregado_por_cliente(Faturamento.cliente_id.in_([1]))),
+        ('relatorio_faturamento: fatura da O.S.', select(faturamento_os).where(faturamento_os.c.ordem_servico_id == 1)),
+        ('relatorio_fluxo_caixa: lançamentos', consulta_fluxo_caixa(periodo)),
+        ('relatorio_fluxo_caixa: por semana', consulta_fluxo_caixa(dict(periodo, agrupar='semana'))),
+        ('contas a receber: página seguinte', consulta_keyset(Pagamento.query, ordens_pagamento, ['Pendente', hoje, 1000], TAMANHO_PAGINA_PADRAO)),
+        ('contas a receber: pagamentos da fatura', select(Pagamento).where(Pagamento.faturamento_id == 1)),
+        ('contas a pagar: página seguinte', consulta_keyset(ContaPagar.query, ordens_conta, ['Pendente', hoje, 1000], TAMANHO_PAGINA_PADRAO)),
+        ('contas a pagar: contas do fornecedor', select(ContaPagar).where(ContaPagar.fornecedor_id == 1)),
+        ('totais: peças da O.S.', select(Peca).where(Peca.ordem_servico_id == 1)),
+        ('estoque: peças do produto', select(Peca).where(Peca.produto_id == 1)),
+        ('relatorio_consumo_pecas: período', consulta_consumo_pecas(periodo)),
+        ('totais: itens do orçamento', select(OrcamentoItem).where(OrcamentoItem.orcamento_id == 1)),
+        ('estoque: entradas do produto', select(EntradaEstoqueItem).where(EntradaEstoqueItem.produto_id == 1)),
+        ('estoque: saldo do produto em uma data', consulta_saldos_em(agora, [1])),
+        ('estoque: movimentos da O.S.', select(MovimentoEstoque).where(MovimentoEstoque.ordem_servico_id == 1)),
+    ]
+
+def conferir_planos_quentes():
+    with db.engine.connect() as conexao:
+        return conferir_planos(conexao, consultas_quentes(), set(db.metadata.tables), TABELAS_PEQUENAS)
+
+@app.route('/analitico/pivo')
+@login_required
+def pivo_analitico():
+    """?fato=ordens&dimensoes=mes,status&medidas=valor_total&inicio=AAAA-MM-DD&fim=AAAA-MM-DD&cliente=1,2"""
+    fato = request.args.get('fato', 'ordens')
+    lista = lambda nome: [v.strip() for v in request.args.get(nome, '').split(',') if v.strip()]
     try:
-        project_path = pathlib.Path(__file__).parent
-        logo_path = project_path / 'static' / 'images' / 'logo.png'
-        with open(logo_path, 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        logo_data_uri = f"data:image/png;base64,{encoded_string}"
-    except FileNotFoundError:
-        print("AVISO: Arquivo logo.png não encontrado.")
-    html_renderizado = render_template('os_pdf_template.html', os=os_obj, logo_path=logo_data_uri)
-    pdf = HTML(string=html_renderizado, base_url=str(project_path)).write_pdf()
-    return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': f'inline; filename=os_{os_obj.id}.pdf'})
+        inicio = datetime.date.fromisoformat(request.args['inicio']) if request.args.get('inicio') else None
+        fim = datetime.date.fromisoformat(request.args['fim']) if request.args.get('fim') else None
+        dimensoes = FATOS[fato]['dimensoes'] if fato in FATOS else {}
+        filtros = {nome: lista(nome) for nome in dimensoes if request.args.get(nome)}
+        atualizacao = atualizar_cubo()
+        inicio_consulta = time.perf_counter()
+        resultado = cubo_analitico.pivo(fato, lista('dimensoes'), lista('medidas'), inicio, fim, filtros)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    for nome in lista('dimensoes'):
+        coluna = dimensoes.get(nome)
+        nomes = rotulos_do_cubo(coluna, {linha[nome] for linha in resultado['linhas']})
+        if nomes:
+            for linha in resultado['linhas']:
+                linha[nome + '_nome'] = nomes.get(linha[nome])
+    resultado.update(fato=fato, milissegundos=round((time.perf_counter() - inicio_consulta) * 1000, 2), atualizacao=atualizacao)
+    return jsonify(resultado)
+
+@app.route('/analitico/estatisticas')
+@login_required
+def estatisticas_cubo_analitico():
+    # Cubo do processo atual
+    return jsonify(cubo_analitico.estatisticas())
 
 
 # ==============================================================================
 # 8. ROTAS DE API E UTILIDADES
 # ==============================================================================
+# CNPJ/CEP passam pelo cache de consultas externas (consultas_externas.py), compartilhado com os blueprints
+os.makedirs(app.instance_path, exist_ok=True)
+cliente_http = ClienteHTTP(tempo_leitura=app.config['HTTP_TEMPO_LEITURA'], tentativas=app.config['HTTP_TENTATIVAS'])
+consultas_externas = ServicoConsultas(app.config['CONSULTAS_CACHE_DB'], app.config['BRASILAPI_URL'], sessao=cliente_http)
+
+def responder_consulta_externa(tipo, valor, mensagem_nao_encontrado):
+    try:
+        encontrado, dados = consultas_externas.consultar(tipo, valor)
+    except ErroConsulta as e:
+        # Resposta degradada: o formulário mostra o aviso e o cadastro segue com preenchimento manual
+        logging.error(f"Erro ao consultar BrasilAPI ({tipo}): {e}")
+        cabecalhos = {'Retry-After': str(max(int(e.tentar_novamente_em), 1))} if e.tentar_novamente_em is not None else {}
+        return jsonify({'erro': f'Consulta de {tipo.upper()} indisponível no momento; preencha os dados manualmente.',
+                        'degradado': True}), 503, cabecalhos
+    return (jsonify(dados), 200) if encontrado else (jsonify({'erro': mensagem_nao_encontrado}), 404)
+
 @app.route('/consulta-cnpj/<cnpj>')
 @login_required
 def consulta_cnpj(cnpj):
     cnpj_limpo = "".join(filter(str.isdigit, cnpj))
     if len(cnpj_limpo) != 14: return jsonify({'erro': 'CNPJ inválido'}), 400
-    try:
-        response = requests.get(f'https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}')
-        return jsonify(response.json()) if response.status_code == 200 else jsonify({'erro': 'CNPJ não encontrado'}), 404
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Erro ao consultar BrasilAPI: {e}")
-        return jsonify({'erro': 'Falha na comunicação com o serviço'}), 500
+    return responder_consulta_externa(CNPJ, cnpj_limpo, 'CNPJ não encontrado')
 
 @app.route('/consulta-cep/<cep>')
 @login_required
 def consulta_cep(cep):
     cep_limpo = "".join(filter(str.isdigit, cep))
     if len(cep_limpo) != 8: return jsonify({'erro': 'CEP inválido'}), 400
-    try:
-        response = requests.get(f'https://brasilapi.com.br/api/cep/v1/{cep_limpo}')
-        return jsonify(response.json()) if response.status_code == 200 else jsonify({'erro': 'CEP não encontrado'}), 404
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Erro ao consultar BrasilAPI (CEP): {e}")
-        return jsonify({'erro': 'Falha na comunicação com o serviço'}), 500
+    return responder_consulta_externa(CEP, cep_limpo, 'CEP não encontrado')
+
+@app.route('/consultas-externas/estatisticas')
+@login_required
+def estatisticas_consultas_externas():
+    # Contadores do processo atual
+    return jsonify(consultas_externas.estatisticas())
+
+@app.route('/cache-relatorios/estatisticas')
+@login_required
+def estatisticas_cache_relatorios():
+    # Contadores de acerto/falha são do processo atual; páginas e bytes refletem o arquivo compartilhado
+    return jsonify(cache_relatorios.estatisticas())
+
+@app.route('/cache-pdf/estatisticas')
+@login_required
+def estatisticas_cache_pdf():
+    # Contadores de acerto/falha são do processo atual; tamanho e arquivos refletem o diretório compartilhado
+    return jsonify(cache_pdf.estatisticas())
+
+@app.route('/snapshot-parquet', methods=['GET', 'POST'])
+@login_required
+def snapshot_parquet():
+    # GET lista o manifesto; POST gera um snapshot (?incremental=1 exporta só o que mudou desde o último)
+    if request.method == 'POST':
+        return jsonify(gerar_snapshot(request.values.get('incremental') == '1')), 201
+    return jsonify(ler_manifesto(app.config['SNAPSHOT_DIR']))
+
+@app.route('/snapshot-parquet/<nome>/<arquivo>')
+@login_required
+def baixar_snapshot_parquet(nome, arquivo):
+    return send_from_directory(os.path.join(app.config['SNAPSHOT_DIR'], secure_filename(nome)), arquivo,
+                               mimetype='application/vnd.apache.parquet', as_attachment=True)
 
 
 # ==============================================================================
@@ -1546,6 +2653,313 @@ def migrate_financeiro_command():
     print("Tabelas financeiras verificadas/criadas.")
     print("Migração financeira concluída.")
 
+@app.cli.command("migrate-busca")
+def migrate_busca_command():
+    print("Criando os índices de busca textual (FTS5)...")
+    conexao = db.session.connection()
+    criar_indices_busca(None, conexao)
+    for tabela_fts in ('cliente_fts', 'ordem_servico_fts'):
+        conexao.exec_driver_sql(f"INSERT INTO {tabela_fts}({tabela_fts}) VALUES ('rebuild')")
+        print(f"  - Índice '{tabela_fts}' reconstruído.")
+    db.session.commit()
+    print("Migração da busca textual concluída.")
+
+@app.cli.command("cache-pdf")
+@click.option('--limpar', is_flag=True, help='Remove todos os PDFs do cache.')
+def cache_pdf_command(limpar):
+    if limpar:
+        cache_pdf.limpar()
+        print("Cache de PDFs esvaziado.")
+    descartados = cache_pdf.podar()
+    if descartados: print(f"{descartados} PDF(s) descartado(s) para respeitar o limite de tamanho.")
+    estatisticas = cache_pdf.estatisticas()
+    print(f"Cache de PDFs em {cache_pdf.diretorio}: {estatisticas['arquivos']} arquivo(s), "
+          f"{estatisticas['bytes'] / 1024 / 1024:.1f} MB de {estatisticas['limite_bytes'] / 1024 / 1024:.0f} MB.")
+
+@app.cli.command("cache-relatorios")
+@click.option('--limpar', is_flag=True, help='Remove todas as páginas do cache de relatórios.')
+def cache_relatorios_command(limpar):
+    geracoes = geracoes_atuais([tabela.name for tabela in TABELAS_GERACAO])
+    if limpar:
+        cache_relatorios.limpar()
+        print("Cache de relatórios esvaziado.")
+    estatisticas = cache_relatorios.estatisticas()
+    print(f"Cache de relatórios em {cache_relatorios.caminho_db}: {estatisticas['paginas']} página(s), "
+          f"{estatisticas['bytes'] / 1024 / 1024:.1f} MB de {estatisticas['limite_bytes'] / 1024 / 1024:.0f} MB.")
+    print("Gerações: " + ", ".join(f"{nome}={geracao}" for nome, geracao in geracoes.items()))
+
+@app.cli.command("benchmark-pdf")
+@click.option('--repeticoes', default=10, show_default=True, help='Renderizações medidas por documento.')
+def benchmark_pdf_command(repeticoes):
+    """Compara o tempo por PDF: logo em data URI + CSS embutido x registro de ativos pré-carregado."""
+    documentos = [
+        ('fatura_pdf_template.html', 'fatura', Faturamento.query.order_by(Faturamento.id.desc()).first()),
+        ('orcamento_pdf_template.html', 'orcamento', Orcamento.query.order_by(Orcamento.id.desc()).first()),
+        ('os_pdf_template.html', 'os', OrdemServico.query.order_by(OrdemServico.id.desc()).first()),
+    ]
+    base_url = str(pathlib.Path(__file__).parent)
+    with app.test_request_context():
+        for nome_template, variavel, registro in documentos:
+            if registro is None:
+                print(f"  - {nome_template}: nenhum registro para renderizar, pulando.")
+                continue
+            html_renderizado = render_template(nome_template, logo_path=registro_ativos_pdf.url('logo-pdf'), **{variavel: registro})
+            folha = FOLHAS_PDF.get(nome_template)
+            antes = medir(lambda: registro_ativos_pdf.renderizar_sem_reuso(html_renderizado, base_url, folha), repeticoes)
+            depois = medir(lambda: registro_ativos_pdf.renderizar(html_renderizado, base_url, folha), repeticoes)
+            print(f"  - {nome_template} #{registro.id}: antes {antes:.1f} ms/PDF, depois {depois:.1f} ms/PDF ({antes / depois:.2f}x)")
+
+@app.cli.command("exportar-pdf-lote")
+@click.argument('tipo', type=click.Choice(sorted(LOTES_PDF)))
+@click.option('--data-inicio', help='AAAA-MM-DD (inclusive).')
+@click.option('--data-fim', help='AAAA-MM-DD (inclusive).')
+@click.option('--cliente-id', default='todos', show_default=True)
+@click.option('--status-id', default='todos', show_default=True, help='Somente para O.S.')
+@click.option('--formato', type=click.Choice(['zip', 'pdf']), default='zip', show_default=True)
+@click.option('--saida', required=True, type=click.Path(dir_okay=False), help='Arquivo a ser gravado.')
+def exportar_pdf_lote_command(tipo, data_inicio, data_fim, cliente_id, status_id, formato, saida):
+    filtros = {'data_inicio': data_inicio, 'data_fim': data_fim, 'cliente_id': cliente_id, 'status_id': status_id}
+    with app.test_request_context():
+        ids = ids_lote_pdf(tipo, filtros)
+        if not ids:
+            print("Nenhum documento encontrado com os filtros informados.")
+            return
+        if formato == 'pdf' and len(ids) > LIMITE_PDF_UNICO:
+            print(f"{len(ids)} documentos: o PDF único aceita até {LIMITE_PDF_UNICO}. Use --formato zip.")
+            return
+        print(f"Exportando {len(ids)} documento(s) com {renderizador_pdf.processos} processo(s) de renderização...")
+        with open(saida, 'wb') as arquivo:
+            for bloco in gerar_lote_pdf(tipo, ids, formato):
+                arquivo.write(bloco)
+    print(f"Arquivo gravado em {saida}.")
+
+@app.cli.command("snapshot-parquet")
+@click.option('--incremental', is_flag=True, help='Exporta só as linhas alteradas desde o último snapshot.')
+def snapshot_parquet_command(incremental):
+    snapshot = gerar_snapshot(incremental)
+    print(f"Snapshot {snapshot['tipo']} gravado em {os.path.join(app.config['SNAPSHOT_DIR'], snapshot['nome'])} "
+          f"({snapshot['segundos']:.2f} s):")
+    for tabela, entrada in snapshot['tabelas'].items():
+        excluidos = f", {entrada['excluidos']} excluída(s)" if entrada.get('excluidos') else ''
+        print(f"  - {tabela}: {entrada['linhas']} linha(s){excluidos} em {entrada['segundos']:.2f} s")
+
+@app.cli.command("stub-brasilapi")
+@click.option('--porta', default=8765, show_default=True)
+@click.option('--atraso', default=0.0, show_default=True, help='Segundos de espera antes de cada resposta.')
+@click.option('--taxa-erro', default=0.0, show_default=True, help='Fração das requisições respondidas com --status-erro.')
+@click.option('--status-erro', default=503, show_default=True)
+def stub_brasilapi_command(porta, atraso, taxa_erro, status_erro):
+    """Sobe uma imitação local da BrasilAPI (use BRASILAPI_URL=http://127.0.0.1:<porta> no app)."""
+    servidor = ServidorStub(porta=porta, atraso=atraso, taxa_erro=taxa_erro, status_erro=status_erro)
+    print(f"BrasilAPI de teste em {servidor.url} (Ctrl+C para encerrar).")
+    try:
+        servidor.executar()
+    except KeyboardInterrupt:
+        servidor.encerrar()
+
+@app.cli.command("importar-cadastros")
+@click.argument('tipo', type=click.Choice(sorted(IMPORTACOES)))
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--relatorio', type=click.Path(dir_okay=False), help='Grava as linhas rejeitadas (CSV) neste arquivo.')
+def importar_cadastros_command(tipo, arquivo, relatorio):
+    with open(arquivo, 'rb') as entrada:
+        try:
+            resultado = importar_cadastros(tipo, entrada, arquivo)
+        except ErroImportacao as e:
+            print(f"Erro: {e}")
+            return
+    print(f"{resultado.lidas} linha(s) lida(s), {resultado.importadas} importada(s), "
+          f"{len(resultado.erros)} rejeitada(s) em {resultado.segundos:.2f} s.")
+    for linha, erro in resultado.erros[:20]:
+        print(f"  - linha {linha}: {erro}")
+    if len(resultado.erros) > 20: print(f"  ... e mais {len(resultado.erros) - 20}.")
+    if relatorio and resultado.erros:
+        with open(relatorio, 'w', encoding='utf-8-sig', newline='') as saida:
+            saida.write(resultado.relatorio_csv())
+        print(f"Relatório de erros gravado em {relatorio}.")
+
+@app.cli.command("auditar-cadastros")
+@click.option('--relatorio', default='auditoria_cadastros.csv', show_default=True, type=click.Path(dir_okay=False),
+              help='CSV com uma linha por campo reprovado.')
+def auditar_cadastros_command(relatorio):
+    """Confere CPF/CNPJ (dígitos verificadores), telefone e CEP de todos os clientes e fornecedores."""
+    inicio = time.perf_counter()
+    problemas, conferidas = auditar_cadastros()
+    segundos = time.perf_counter() - inicio
+    with open(relatorio, 'w', encoding='utf-8-sig', newline='') as saida:
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(COLUNAS_AUDITORIA)
+        escritor.writerows(problemas)
+    print(f"{sum(conferidas.values())} cadastro(s) conferido(s) em {segundos:.2f} s "
+          f"({', '.join(f'{tabela}: {total}' for tabela, total in conferidas.items())}).")
+    for (tabela, problema), total in sorted(collections.Counter((p[0], p[4]) for p in problemas).items()):
+        print(f"  - {tabela}: {total} {problema}")
+    print(f"{len(problemas)} problema(s) gravado(s) em {relatorio}." if problemas else "Nenhum problema encontrado.")
+
+@app.cli.command("perfil-sqlite")
+def perfil_sqlite_command():
+    """Mostra o perfil configurado e os pragmas efetivos numa conexão do pool."""
+    print(f"Perfil: {app.config['SQLITE_PERFIL']}" + (f" + {app.config['SQLITE_PRAGMAS']}" if app.config['SQLITE_PRAGMAS'] else ''))
+    with db.engine.connect() as conexao:
+        for nome, valor in pragmas_em_uso(conexao.connection.driver_connection).items():
+            print(f"  - {nome} = {valor}")
+
+@app.cli.command("benchmark-sqlite")
+@click.option('--perfil', 'perfis', multiple=True, type=click.Choice(sorted(PERFIS)), help='Repetível; padrão: todos.')
+@click.option('--escritores', default=4, show_default=True)
+@click.option('--leitores', default=4, show_default=True)
+@click.option('--segundos', default=5.0, show_default=True)
+def benchmark_sqlite_command(perfis, escritores, leitores, segundos):
+    """Leituras e escritas concorrentes (um processo por conexão) num banco temporário, para cada perfil."""
+    print(f"{escritores} escritor(es) e {leitores} leitor(es) por {segundos:.0f} s em cada perfil...")
+    os.makedirs(app.instance_path, exist_ok=True)
+    for medicao in comparar_perfis(perfis or None, escritores, leitores, segundos, app.instance_path):
+        print(f"  - {medicao['perfil']}:")
+        for papel in ('escrita', 'leitura'):
+            dados = medicao[papel]
+            print(f"      {papel}: {dados['operacoes_por_segundo']:.0f} op/s, p99 {dados['p99_ms']:.1f} ms, "
+                  f"{dados['database_is_locked']} 'database is locked'")
+
+@app.cli.command("rebuild-resumo-mensal")
+def rebuild_resumo_mensal_command():
+    print("Reconstruindo o resumo mensal de faturamento das O.S....")
+    db.create_all()
+    reconstruir_resumo_mensal()
+    print(f"Resumo mensal reconstruído: {ResumoMensalOS.query.count()} linha(s) (mês x status).")
+
+@app.cli.command("rebuild-resumo-clientes")
+def rebuild_resumo_clientes_command():
+    print("Reconstruindo o resumo de faturamento e recebíveis por cliente...")
+    db.create_all()
+    recalcular_resumo_clientes(db.session.connection())
+    db.session.commit()
+    print(f"Resumo por cliente reconstruído: {ResumoCliente.query.count()} cliente(s) com fatura.")
+
+@app.cli.command("migrate-totais")
+def migrate_totais_command():
+    print("Iniciando migração dos totais persistidos...")
+    colunas = {'ordem_servico': ['valor_pecas', 'valor_total'], 'orcamento': ['valor_produtos', 'valor_total'], 'faturamento': ['valor_total_faturado']}
+    for tabela, nomes in colunas.items():
+        for nome in nomes:
+            try:
+                db.session.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {nome} FLOAT DEFAULT 0.0'))
+                db.session.commit()
+                print(f"  - Coluna '{tabela}.{nome}' adicionada com sucesso.")
+            except OperationalError as e:
+                db.session.rollback()
+                if "duplicate column name" in str(e): print(f"  - Coluna '{tabela}.{nome}' já existe, pulando.")
+                else: print(f"  - Erro ao adicionar coluna '{tabela}.{nome}': {e}")
+    recalcular_totais(db.session.connection())
+    db.session.commit()
+    print("  - Totais de O.S., orçamentos e faturas recalculados.")
+    db.create_all()
+    reconstruir_resumo_mensal()
+    print("Migração dos totais concluída.")
+
+@app.cli.command("verificar-totais")
+@click.option('--corrigir', is_flag=True, help='Regrava os totais divergentes após listá-los.')
+def verificar_totais_command(corrigir):
+    divergencias = divergencias_de_totais()
+    if not divergencias:
+        print("Nenhuma divergência encontrada: todos os totais persistidos conferem.")
+        return
+    print(f"Encontradas {len(divergencias)} divergência(s):")
+    for tabela, registro_id, gravado, esperado in divergencias:
+        print(f"  - {tabela} #{registro_id}: gravado {gravado if gravado is not None else 'NULL'} / esperado {esperado:.2f}")
+    if corrigir:
+        recalcular_totais(db.session.connection())
+        recalcular_resumo_clientes(db.session.connection())
+        reconstruir_resumo_mensal()
+        print("Totais recalculados e resumos mensal e por cliente reconstruídos.")
+
+@app.cli.command("migrate-peca-produto")
+@click.option('--lote', default=5000, show_default=True, help='Peças atualizadas por transação.')
+def migrate_peca_produto_command(lote):
+    """Cria peca.produto_id e preenche as peças antigas casando a descrição com a do produto."""
+    print("Ligando as peças das O.S. aos produtos...")
+    try:
+        db.session.execute(text('ALTER TABLE peca ADD COLUMN produto_id INTEGER REFERENCES produto(id)'))
+        db.session.commit()
+        print("  - Coluna 'produto_id' adicionada com sucesso.")
+    except Exception as e:
+        if "duplicate column name" in str(e): print("  - Coluna 'produto_id' já existe, pulando.")
+        else: print(f"  - Aviso ao adicionar coluna em 'peca': {e}")
+        db.session.rollback()
+    with db.engine.begin() as conexao:
+        criar_indices(conexao, db.metadata)
+    # Lotes por faixa de id: cada transação trava o banco por pouco tempo e a migração pode ser interrompida
+    produto_da_peca = select(Produto.id).where(Produto.descricao == Peca.descricao).scalar_subquery()
+    ultimo_id = 0
+    while True:
+        ids = db.session.execute(select(Peca.id).where(Peca.id > ultimo_id, Peca.produto_id.is_(None))
+                                 .order_by(Peca.id).limit(lote)).scalars().all()
+        if not ids:
+            break
+        db.session.execute(Peca.__table__.update().where(Peca.id.between(ids[0], ids[-1]), Peca.produto_id.is_(None))
+                           .values(produto_id=produto_da_peca))
+        db.session.commit()
+        ultimo_id = ids[-1]
+        print(f"  - Peças até #{ultimo_id} conferidas.")
+    sem_produto = db.session.execute(select(func.count()).where(Peca.produto_id.is_(None))).scalar()
+    print(f"  - {sem_produto} peça(s) sem produto com a mesma descrição ficaram com produto_id vazio.")
+    print("Migração das peças concluída.")
+
+@app.cli.command("migrate-estoque")
+def migrate_estoque_command():
+    print("Criando o razão de estoque...")
+    db.create_all()
+    criar_razao_estoque(None, db.session.connection())
+    # Saldo de abertura: produtos sem movimento entram no razão com o saldo que têm hoje
+    sem_movimento = select(Produto.id, func.coalesce(Produto.quantidade_estoque, 0)).where(
+        ~select(MovimentoEstoque.id).where(MovimentoEstoque.produto_id == Produto.id).exists())
+    agora = datetime.datetime.utcnow()
+    linhas = [{'produto_id': produto_id, 'data': agora, 'tipo': SALDO_INICIAL, 'quantidade': saldo, 'saldo': saldo}
+              for produto_id, saldo in db.session.execute(sem_movimento)]
+    if linhas:
+        db.session.execute(MovimentoEstoque.__table__.insert(), linhas)
+    db.session.commit()
+    print(f"  - {len(linhas)} produto(s) receberam o saldo inicial no razão.")
+    print("Migração do razão de estoque concluída.")
+
+@app.cli.command("verificar-estoque")
+def verificar_estoque_command():
+    divergencias = divergencias_de_estoque()
+    if not divergencias:
+        print("Nenhuma divergência encontrada: o estoque de todos os produtos confere com o razão.")
+        return
+    print(f"Encontradas {len(divergencias)} divergência(s):")
+    for produto_id, gravado, no_razao in divergencias:
+        print(f"  - produto #{produto_id}: estoque {gravado if gravado is not None else 'NULL'} / "
+              f"razão {no_razao if no_razao is not None else 'sem movimento'}")
+    raise SystemExit(1)
+
+@app.cli.command("migrate-indices")
+def migrate_indices_command():
+    print("Criando os índices declarados nos modelos...")
+    with db.engine.begin() as conexao:
+        criados, existentes = criar_indices(conexao, db.metadata)
+    for nome in criados:
+        print(f"  - Índice '{nome}' criado.")
+    print(f"  - {len(existentes)} índice(s) já existiam, pulando.")
+    db.create_all()
+    print("Migração dos índices concluída.")
+
+@app.cli.command("verificar-indices")
+@click.option('--planos', is_flag=True, help='Mostra o plano completo de cada consulta.')
+def verificar_indices_command(planos):
+    """EXPLAIN QUERY PLAN das consultas quentes; falha se alguma ler uma tabela inteira."""
+    com_varredura = 0
+    for nome, linhas, varreduras in conferir_planos_quentes():
+        com_varredura += bool(varreduras)
+        print(f"  [{'VARREDURA: ' + ', '.join(varreduras) if varreduras else 'ok'}] {nome}")
+        if planos or varreduras:
+            for linha in linhas:
+                print(f"        {linha}")
+    if com_varredura:
+        print(f"{com_varredura} consulta(s) com varredura completa de tabela (rode 'flask migrate-indices').")
+        raise SystemExit(1)
+    print("Nenhuma consulta quente lê uma tabela inteira.")
+
 # ======================================================================
 # 10. ROTAS API (JSON) PARA MOBILE
 # ======================================================================
@@ -1578,7 +2992,7 @@ def api_login_route():
 
 @app.route('/api/clientes', methods=['GET'])
 def api_listar_clientes():
-    clientes = Cliente.query.all()
+    clientes, proximo_cursor = paginar_keyset(Cliente.query, [(Cliente.id, 'asc')], request.args.get('cursor'), request.args.get('limite'))
     clientes_json = [
         {
             "id": c.id,
@@ -1588,11 +3002,13 @@ def api_listar_clientes():
             "email": c.email
         } for c in clientes
     ]
-    return jsonify(clientes_json), 200
+    return jsonify(clientes_json), 200, cabecalhos_paginacao(clientes, proximo_cursor)
 
 @app.route('/api/ordens', methods=['GET'])
 def api_listar_ordens():
-    ordens = OrdemServico.query.order_by(OrdemServico.data_criacao.desc()).all()
+    query = OrdemServico.query.options(joinedload(OrdemServico.cliente), joinedload(OrdemServico.status))
+    ordens, proximo_cursor = paginar_keyset(query, [(OrdemServico.data_criacao, 'desc'), (OrdemServico.id, 'desc')],
+                                            request.args.get('cursor'), request.args.get('limite'))
     ordens_json = [
         {
             "id": os.id,
@@ -1603,11 +3019,13 @@ def api_listar_ordens():
             "data_criacao": os.data_criacao.strftime("%Y-%m-%d %H:%M:%S")
         } for os in ordens
     ]
-    return jsonify(ordens_json), 200
+    return jsonify(ordens_json), 200, cabecalhos_paginacao(ordens, proximo_cursor)
 
 @app.route('/api/ordens/<int:id>', methods=['GET'])
 def api_detalhe_ordem(id):
-    os = OrdemServico.query.get_or_404(id)
+    os = OrdemServico.query.options(
+        joinedload(OrdemServico.cliente), joinedload(OrdemServico.status), selectinload(OrdemServico.pecas)
+    ).filter_by(id=id).first_or_404()
     os_json = {
         "id": os.id,
         "cliente": os.cliente.nome_exibicao,
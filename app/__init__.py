@@ -1,22 +1,32 @@
 # app/__init__.py
 
+import os
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from consultas_externas import ServicoConsultas, BRASILAPI_URL
+from perfil_sqlite import PERFIL_PADRAO, instalar_perfil
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 gerenciador_login = LoginManager()
+# Cache de CNPJ/CEP; o arquivo padrão é o mesmo usado pelo app.py, então os dois compartilham as consultas
+consultas_externas = ServicoConsultas(
+    os.environ.get('CONSULTAS_CACHE_DB', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'consultas_externas.db')),
+    os.environ.get('BRASILAPI_URL', BRASILAPI_URL))
 
 def criar_app():
     """Função que cria e configura a aplicação Flask."""
     app = Flask(__name__)
     
     app.config['SECRET_KEY'] = 'uma-chave-secreta-muito-dificil-de-adivinhar'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../database.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///../database.db')
 
     db.init_app(app)
+    with app.app_context():
+        instalar_perfil(db.engine, os.environ.get('SQLITE_PERFIL', PERFIL_PADRAO), os.environ.get('SQLITE_PRAGMAS', ''))
     bcrypt.init_app(app)
     gerenciador_login.init_app(app)
     
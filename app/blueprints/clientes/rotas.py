@@ -2,10 +2,11 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required
-from sqlalchemy import or_
 from app.modelos import Cliente, Contato # Certifique-se de que seus modelos estão sendo importados
 from app import db # Certifique-se de que a instância do SQLAlchemy está importada
-import requests
+from app.busca import responder_busca_dinamica, cache_busca
+from app import consultas_externas
+from consultas_externas import ErroConsulta, CNPJ
 from validate_docbr import CPF # Biblioteca para validação de CPF/CNPJ
 from email_validator import validate_email, EmailNotValidError # Biblioteca para validação de email
 
@@ -137,6 +138,7 @@ def criar():
 
             db.session.add(novo_cliente)
             db.session.commit()
+            cache_busca.limpar()
             flash('Cliente e contatos cadastrados com sucesso!', 'success')
             return redirect(url_for('clientes.listar'))
 
@@ -159,24 +161,20 @@ def criar():
 def consultar_cnpj(cnpj):
     """Consulta dados de CNPJ em uma API externa."""
     try:
-        cnpj_limpo = ''.join(filter(str.isdigit, cnpj))
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}"
-        response = requests.get(url, timeout=5)
-
-        if response.status_code == 200:
-            dados = response.json()
-            # Mapeamento dos campos da API para os campos do formulário
-            dados_mapeados = {
-                'nome': dados.get('razao_social'), 'endereco': dados.get('logradouro'),
-                'numero': dados.get('numero'), 'cidade': dados.get('municipio'),
-                'uf': dados.get('uf'), 'cep': dados.get('cep'),
-                'telefone': dados.get('ddd_telefone_1')
-            }
-            return jsonify(dados_mapeados)
-        else:
-            return jsonify({'erro': 'CNPJ não encontrado ou inválido'}), 404
-    except requests.exceptions.RequestException as e:
-        return jsonify({'erro': f'Erro ao acessar a API externa: {e}'}), 500
+        encontrado, dados = consultas_externas.consultar(CNPJ, cnpj)
+    except ErroConsulta as e:
+        return jsonify({'erro': f'Erro ao acessar a API externa: {e}', 'degradado': True}), 503
+
+    if not encontrado:
+        return jsonify({'erro': 'CNPJ não encontrado ou inválido'}), 404
+    # Mapeamento dos campos da API para os campos do formulário
+    dados_mapeados = {
+        'nome': dados.get('razao_social'), 'endereco': dados.get('logradouro'),
+        'numero': dados.get('numero'), 'cidade': dados.get('municipio'),
+        'uf': dados.get('uf'), 'cep': dados.get('cep'),
+        'telefone': dados.get('ddd_telefone_1')
+    }
+    return jsonify(dados_mapeados)
 
 
 # ----------------------------------------------------------------------
@@ -186,33 +184,5 @@ def consultar_cnpj(cnpj):
 @clientes.route('/api/clientes/buscar', methods=['GET'])
 @login_required 
 def api_buscar_clientes():
-    """Endpoint de API para busca dinâmica na listagem de clientes."""
-    termo = request.args.get('termo', '').strip()
-    
-    query = Cliente.query.order_by(Cliente.nome)
-    
-    if termo:
-        search_pattern = f'%{termo}%'
-        
-        query = query.filter(
-            or_(
-                Cliente.nome.ilike(search_pattern),
-                Cliente.documento.ilike(search_pattern)
-            )
-        )
-    
-    clientes_encontrados = query.all()
-
-    resultado = []
-    for cliente in clientes_encontrados:
-        # Pega o telefone do primeiro contato (se houver)
-        primeiro_contato = cliente.contatos[0] if cliente.contatos else None
-        
-        resultado.append({
-            'id': cliente.id,
-            'nome': cliente.nome,
-            'documento': cliente.documento, 
-            'telefone': primeiro_contato.telefone if primeiro_contato else None,
-        })
-    
-    return jsonify(resultado)
\ No newline at end of file
+    """Endpoint de API para busca dinâmica na listagem de clientes (resultados limitados e em cache)."""
+    return responder_busca_dinamica(Cliente, Contato, Contato.cliente_id)
\ No newline at end of file
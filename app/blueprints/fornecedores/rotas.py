@@ -2,10 +2,11 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required
-from sqlalchemy import or_
 # Importe os NOVOS modelos de Fornecedor
 from app.modelos import db, Fornecedor, ContatoFornecedor 
-import requests
+from app.busca import responder_busca_dinamica, cache_busca
+from app import consultas_externas
+from consultas_externas import ErroConsulta, CNPJ
 from validate_docbr import CPF
 from email_validator import validate_email, EmailNotValidError
 
@@ -90,6 +91,7 @@ def criar():
 
             db.session.add(novo_fornecedor)
             db.session.commit()
+            cache_busca.limpar()
             flash('Fornecedor e contatos cadastrados com sucesso!', 'success')
             return redirect(url_for('fornecedores.listar'))
 
@@ -113,23 +115,19 @@ def criar():
 def consultar_cnpj(cnpj):
     # A lógica é IDÊNTICA à do cliente
     try:
-        cnpj_limpo = ''.join(filter(str.isdigit, cnpj))
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}"
-        response = requests.get(url, timeout=5)
-
-        if response.status_code == 200:
-            dados = response.json()
-            dados_mapeados = {
-                'nome': dados.get('razao_social'), 'endereco': dados.get('logradouro'),
-                'numero': dados.get('numero'), 'cidade': dados.get('municipio'),
-                'uf': dados.get('uf'), 'cep': dados.get('cep'),
-                'telefone': dados.get('ddd_telefone_1')
-            }
-            return jsonify(dados_mapeados)
-        else:
-            return jsonify({'erro': 'CNPJ não encontrado ou inválido'}), 404
-    except requests.exceptions.RequestException as e:
-        return jsonify({'erro': f'Erro ao acessar a API externa: {e}'}), 500
+        encontrado, dados = consultas_externas.consultar(CNPJ, cnpj)
+    except ErroConsulta as e:
+        return jsonify({'erro': f'Erro ao acessar a API externa: {e}', 'degradado': True}), 503
+
+    if not encontrado:
+        return jsonify({'erro': 'CNPJ não encontrado ou inválido'}), 404
+    dados_mapeados = {
+        'nome': dados.get('razao_social'), 'endereco': dados.get('logradouro'),
+        'numero': dados.get('numero'), 'cidade': dados.get('municipio'),
+        'uf': dados.get('uf'), 'cep': dados.get('cep'),
+        'telefone': dados.get('ddd_telefone_1')
+    }
+    return jsonify(dados_mapeados)
 
 
 # -----------------------------------------------------
@@ -138,36 +136,8 @@ def consultar_cnpj(cnpj):
 @fornecedores.route('/api/buscar', methods=['GET'])
 @login_required 
 def api_buscar_fornecedores():
-    termo = request.args.get('termo', '').strip()
-    
-    # Busca na tabela de Fornecedores
-    query = Fornecedor.query.order_by(Fornecedor.nome)
-    
-    if termo:
-        search_pattern = f'%{termo}%'
-        
-        query = query.filter(
-            or_(
-                Fornecedor.nome.ilike(search_pattern),
-                Fornecedor.documento.ilike(search_pattern)
-            )
-        )
-    
-    fornecedores_encontrados = query.all()
-
-    resultado = []
-    for fornecedor in fornecedores_encontrados:
-        # Busca o contato na relação contatos_fornecedor
-        primeiro_contato = fornecedor.contatos_fornecedor[0] if fornecedor.contatos_fornecedor else None
-        
-        resultado.append({
-            'id': fornecedor.id,
-            'nome': fornecedor.nome,
-            'documento': fornecedor.documento, 
-            'telefone': primeiro_contato.telefone if primeiro_contato else None,
-        })
-    
-    return jsonify(resultado)
+    # Mesma busca limitada e em cache do cliente, sobre Fornecedor/ContatoFornecedor
+    return responder_busca_dinamica(Fornecedor, ContatoFornecedor, ContatoFornecedor.fornecedor_id)
 
 # -----------------------------------------------------
 # ROTAS PLACEHOLDERS (Para evitar BuildError no listar.html)
@@ -0,0 +1,86 @@
+# app/busca.py
+
+import threading
+import time
+from collections import OrderedDict
+from flask import jsonify, request
+from sqlalchemy import or_, select
+from . import db
+
+# Limites da busca dinâmica (live search / autocomplete)
+LIMITE_LISTAGEM = 100          # modo padrão: tabela filtrada da tela de listagem
+LIMITE_TYPEAHEAD = 10          # modo typeahead: sugestões de um campo de autocomplete
+TAMANHO_MINIMO_TYPEAHEAD = 2   # abaixo disso o typeahead responde vazio, sem consultar o banco
+VALIDADE_CACHE_SEGUNDOS = 10
+
+
+class CacheBusca:
+    """Cache LRU em memória com validade curta para as respostas da busca dinâmica."""
+
+    def __init__(self, capacidade=512, validade=VALIDADE_CACHE_SEGUNDOS):
+        self.capacidade = capacidade
+        self.validade = validade
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave):
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None or item[0] < time.monotonic():
+                self._itens.pop(chave, None)
+                return None
+            self._itens.move_to_end(chave)
+            return item[1]
+
+    def guardar(self, chave, valor):
+        with self._trava:
+            self._itens[chave] = (time.monotonic() + self.validade, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+
+
+cache_busca = CacheBusca()
+
+
+def buscar_com_primeiro_contato(modelo, modelo_contato, coluna_fk, termo, limite):
+    """Busca por nome/documento trazendo o telefone do primeiro contato na mesma consulta."""
+    telefone = select(modelo_contato.telefone).where(coluna_fk == modelo.id).order_by(
+        modelo_contato.id).limit(1).scalar_subquery()
+    query = db.session.query(modelo.id, modelo.nome, modelo.documento, telefone.label('telefone')).order_by(modelo.nome)
+    if termo:
+        search_pattern = f'%{termo}%'
+        query = query.filter(or_(modelo.nome.ilike(search_pattern), modelo.documento.ilike(search_pattern)))
+    return [
+        {'id': id_, 'nome': nome, 'documento': documento, 'telefone': telefone}
+        for id_, nome, documento, telefone in query.limit(limite).all()
+    ]
+
+
+def responder_busca_dinamica(modelo, modelo_contato, coluna_fk):
+    """Resposta JSON da busca dinâmica (`?termo=` e, opcionalmente, `?modo=typeahead`).
+
+    Repetições do mesmo termo são atendidas pelo cache em memória e a resposta leva ETag,
+    então teclas digitadas em sequência não voltam a consultar o SQLite.
+    """
+    termo = request.args.get('termo', '').strip()
+    typeahead = request.args.get('modo') == 'typeahead'
+    if typeahead and len(termo) < TAMANHO_MINIMO_TYPEAHEAD:
+        resultado = []
+    else:
+        chave = (modelo.__tablename__, typeahead, termo.lower())
+        resultado = cache_busca.obter(chave)
+        if resultado is None:
+            limite = LIMITE_TYPEAHEAD if typeahead else LIMITE_LISTAGEM
+            resultado = buscar_com_primeiro_contato(modelo, modelo_contato, coluna_fk, termo, limite)
+            cache_busca.guardar(chave, resultado)
+
+    resposta = jsonify(resultado)
+    resposta.cache_control.private = True
+    resposta.cache_control.max_age = VALIDADE_CACHE_SEGUNDOS if typeahead else 0
+    resposta.add_etag()
+    return resposta.make_conditional(request)
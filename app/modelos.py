@@ -19,7 +19,7 @@ class Usuario(db.Model, UserMixin):
 
 class Cliente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(120), nullable=False)  # OBRIGATÓRIO
+    nome = db.Column(db.String(120), nullable=False, index=True)  # OBRIGATÓRIO
     documento = db.Column(db.String(20), unique=True, nullable=False) # OBRIGATÓRIO
     
     # NOVO: Atributo real para armazenar o valor da IE (privado)
@@ -67,7 +67,7 @@ class Contato(db.Model):
     email = db.Column(db.String(120), nullable=True)
     telefone = db.Column(db.String(20), nullable=True)
 
-    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f"Contato('{self.nome}', '{self.cliente.nome}')"
@@ -79,7 +79,7 @@ class Contato(db.Model):
 class Fornecedor(db.Model):
     __tablename__ = 'fornecedores'
     id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(150), nullable=False)
+    nome = db.Column(db.String(150), nullable=False, index=True)
     documento = db.Column(db.String(20), unique=True, nullable=False) # CNPJ/CPF
     ie = db.Column(db.String(20), default='ISENTO') # Inscrição Estadual
     endereco = db.Column(db.String(150))
@@ -110,7 +110,7 @@ class Fornecedor(db.Model):
 class ContatoFornecedor(db.Model):
     __tablename__ = 'contatos_fornecedor'
     id = db.Column(db.Integer, primary_key=True)
-    fornecedor_id = db.Column(db.Integer, db.ForeignKey('fornecedores.id'), nullable=False)
+    fornecedor_id = db.Column(db.Integer, db.ForeignKey('fornecedores.id'), nullable=False, index=True)
     nome = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120))
     telefone = db.Column(db.String(20))
@@ -0,0 +1,136 @@
+# ativos_pdf.py
+# Recursos estáticos dos PDFs (logo e folhas de estilo), carregados uma única vez por processo.
+#
+# Os templates referenciam o logo por "ativo:<nome>" em vez de um data URI base64 montado a cada
+# requisição; o WeasyPrint busca esses endereços na memória pelo url_fetcher do registro. As folhas
+# de static/css/pdf/ são compiladas uma vez, com uma FontConfiguration compartilhada, e passadas
+# prontas ao write_pdf. O HTML fica menor (e mais barato de hashear e de enviar ao pool), e a
+# versão do registro entra na chave do cache de PDFs. Não importa app.py.
+
+import hashlib
+import io
+import os
+import time
+
+ESQUEMA = 'ativo:'
+FOLHA_BASE = 'base.css'
+ALTURA_LOGO_PDF = 220  # max-height de 70px no cabeçalho, a 300 dpi
+
+
+def _redimensionar_png(conteudo, altura):
+    try:
+        from PIL import Image
+    except ImportError:
+        return conteudo
+    with Image.open(io.BytesIO(conteudo)) as imagem:
+        if imagem.height <= altura:
+            return conteudo
+        largura = round(imagem.width * altura / imagem.height)
+        saida = io.BytesIO()
+        imagem.resize((largura, altura), Image.LANCZOS).save(saida, format='PNG', optimize=True)
+    # Um PNG já bem comprimido pode crescer ao ser reamostrado; nesse caso fica o original
+    return saida.getvalue() if saida.tell() < len(conteudo) else conteudo
+
+
+class RegistroAtivosPDF:
+    def __init__(self, diretorio_static):
+        self.diretorio_static = diretorio_static
+        self.ativos = {}   # nome -> (mime, bytes)
+        self.folhas = {}   # nome do arquivo .css -> texto
+        self._compiladas = {}
+        self._font_config = None
+        self._buscador = None
+        self._cache_imagens = {}
+        self.carregar()
+
+    def carregar(self):
+        caminho_logo = os.path.join(self.diretorio_static, 'images', 'logo.png')
+        if os.path.exists(caminho_logo):
+            with open(caminho_logo, 'rb') as arquivo:
+                logo = arquivo.read()
+            self.ativos['logo'] = ('image/png', logo)
+            self.ativos['logo-pdf'] = ('image/png', _redimensionar_png(logo, ALTURA_LOGO_PDF))
+        pasta_css = os.path.join(self.diretorio_static, 'css', 'pdf')
+        if os.path.isdir(pasta_css):
+            for nome in sorted(os.listdir(pasta_css)):
+                if nome.endswith('.css'):
+                    with open(os.path.join(pasta_css, nome), encoding='utf-8') as arquivo:
+                        self.folhas[nome] = arquivo.read()
+        digest = hashlib.sha256()
+        for nome, (_, conteudo) in sorted(self.ativos.items()):
+            digest.update(nome.encode('utf-8') + b'\0' + conteudo)
+        for nome, texto in sorted(self.folhas.items()):
+            digest.update(nome.encode('utf-8') + b'\0' + texto.encode('utf-8'))
+        self.versao = digest.hexdigest()[:16]
+
+    def url(self, nome):
+        return ESQUEMA + nome if nome in self.ativos else None
+
+    # --- Lado WeasyPrint (usado nos processos de renderização) ---
+
+    def font_config(self):
+        if self._font_config is None:
+            from weasyprint.text.fonts import FontConfiguration
+            self._font_config = FontConfiguration()
+        return self._font_config
+
+    def url_fetcher(self):
+        if self._buscador is None:
+            self._buscador = _criar_buscador(self.ativos)
+        return self._buscador
+
+    def folhas_compiladas(self, folha=None):
+        nomes = [FOLHA_BASE] + ([folha] if folha else [])
+        from weasyprint import CSS
+        for nome in nomes:
+            if nome not in self._compiladas and nome in self.folhas:
+                self._compiladas[nome] = CSS(string=self.folhas[nome], font_config=self.font_config(),
+                                             url_fetcher=self.url_fetcher())
+        return [self._compiladas[nome] for nome in nomes if nome in self._compiladas]
+
+    def renderizar(self, html, base_url=None, folha=None):
+        from weasyprint import HTML
+        return HTML(string=html, base_url=base_url, url_fetcher=self.url_fetcher()).write_pdf(
+            stylesheets=self.folhas_compiladas(folha), font_config=self.font_config(), cache=self._cache_imagens)
+
+    def renderizar_sem_reuso(self, html, base_url=None, folha=None):
+        """Caminho anterior, para comparação: logo em data URI e CSS embutido, tudo refeito a cada PDF."""
+        import base64
+        from weasyprint import HTML
+        for nome, (mime, conteudo) in self.ativos.items():
+            html = html.replace(f'"{ESQUEMA}{nome}"', f'"data:{mime};base64,{base64.b64encode(conteudo).decode()}"')
+        estilos = ''.join(self.folhas.get(nome, '') for nome in (FOLHA_BASE, folha) if nome)
+        html = html.replace('</head>', f'<style>{estilos}</style></head>', 1)
+        return HTML(string=html, base_url=base_url).write_pdf()
+
+
+def _criar_buscador(ativos):
+    try:
+        from weasyprint.urls import URLFetcher, URLFetcherResponse
+    except ImportError:
+        # WeasyPrint < 70: o url_fetcher é uma função que devolve um dict
+        from weasyprint import default_url_fetcher
+
+        def buscar(url):
+            if url.startswith(ESQUEMA):
+                mime, conteudo = ativos[url[len(ESQUEMA):]]
+                return {'string': conteudo, 'mime_type': mime}
+            return default_url_fetcher(url)
+        return buscar
+
+    class BuscadorAtivos(URLFetcher):
+        def fetch(self, url, headers=None):
+            if url.startswith(ESQUEMA):
+                mime, conteudo = ativos[url[len(ESQUEMA):]]
+                return URLFetcherResponse(url, conteudo, {'Content-Type': mime})
+            return super().fetch(url, headers)
+    return BuscadorAtivos()
+
+
+def medir(funcao, repeticoes):
+    """Tempo médio (ms) de `funcao()` após uma execução de aquecimento."""
+    funcao()
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return (time.perf_counter() - inicio) * 1000 / repeticoes
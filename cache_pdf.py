@@ -0,0 +1,113 @@
+# cache_pdf.py
+# Cache em disco, endereçado por conteúdo, dos PDFs gerados pelo WeasyPrint.
+#
+# A chave é o SHA-256 da versão do template + HTML renderizado: qualquer alteração
+# nos dados da fatura/O.S./orçamento (ou no próprio template) muda o HTML e,
+# portanto, a chave — não existe invalidação manual. Arquivos antigos são
+# descartados por LRU (mtime) quando o diretório passa do limite de tamanho.
+# Não importa app.py, para poder ser usado também por processos de renderização.
+
+import hashlib
+import os
+import tempfile
+import threading
+
+EXTENSAO = '.pdf'
+
+
+def chave_pdf(html, versao_template=''):
+    """Chave do cache para um HTML já renderizado."""
+    digest = hashlib.sha256(versao_template.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(html.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CachePDF:
+    def __init__(self, diretorio, limite_bytes=200 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.limite_bytes = limite_bytes
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+        self._trava = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho(self, chave):
+        return os.path.join(self.diretorio, chave + EXTENSAO)
+
+    def obter(self, chave, contabilizar=True):
+        """Bytes do PDF em cache ou None. Um acerto renova a posição do arquivo no LRU."""
+        caminho = self.caminho(chave)
+        try:
+            with open(caminho, 'rb') as arquivo:
+                conteudo = arquivo.read()
+            os.utime(caminho)
+        except FileNotFoundError:
+            if contabilizar:
+                with self._trava: self.falhas += 1
+            return None
+        if contabilizar:
+            with self._trava: self.acertos += 1
+        return conteudo
+
+    def gravar(self, chave, conteudo):
+        # Grava em arquivo temporário e renomeia: leitores concorrentes nunca veem um PDF pela metade
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix='.tmp')
+        try:
+            with os.fdopen(descritor, 'wb') as arquivo:
+                arquivo.write(conteudo)
+            os.replace(temporario, self.caminho(chave))
+        except BaseException:
+            if os.path.exists(temporario): os.remove(temporario)
+            raise
+        self.podar()
+
+    def _arquivos(self):
+        arquivos = []
+        with os.scandir(self.diretorio) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith(EXTENSAO): continue
+                try:
+                    info = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                arquivos.append((info.st_mtime, info.st_size, entrada.path))
+        return arquivos
+
+    def podar(self):
+        """Remove os PDFs usados há mais tempo até o diretório caber no limite."""
+        arquivos = self._arquivos()
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        if total <= self.limite_bytes: return 0
+        removidos = 0
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.limite_bytes: break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+            removidos += 1
+        with self._trava: self.descartes += removidos
+        return removidos
+
+    def limpar(self):
+        for _, _, caminho in self._arquivos():
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+    def estatisticas(self):
+        arquivos = self._arquivos()
+        consultas = self.acertos + self.falhas
+        return {
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'descartes': self.descartes,
+            'taxa_acerto': round(self.acertos / consultas, 4) if consultas else None,
+            'arquivos': len(arquivos),
+            'bytes': sum(tamanho for _, tamanho, _ in arquivos),
+            'limite_bytes': self.limite_bytes,
+        }
@@ -0,0 +1,126 @@
+# cache_relatorios.py
+# Cache dos relatórios, compartilhado pelos workers e invalidado por contadores de geração por tabela.
+#
+# Cada tabela acompanhada tem um contador em "geracao_tabela", incrementado por triggers AFTER
+# INSERT/UPDATE/DELETE dentro da própria transação que escreve: o contador só muda quando a
+# alteração é gravada, e nada que escreva no banco (rotas, comandos, SQL direto) passa sem mudá-lo.
+# A chave de uma página junta caminho, argumentos da URL, versão do template e as gerações das
+# tabelas que ela lê; um commit em qualquer delas muda a chave, então nunca se serve um relatório
+# vencido e não há prazo de validade para acertar. As gerações são lidas antes dos dados, de modo
+# que o conteúdo gravado numa chave é sempre pelo menos tão novo quanto ela. Os fragmentos (blocos
+# já renderizados) ficam numa tabela SQLite em arquivo próprio; chaves de gerações antigas deixam
+# de ser pedidas e saem por LRU quando o total passa do limite. Não importa app.py.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+TABELA_GERACOES = 'geracao_tabela'
+RENOVAR_USO_SEGUNDOS = 60  # um acerto só regrava usado_em se a marca tiver mais que isso
+
+
+def ddl_geracoes(tabelas):
+    """Comandos (idempotentes) que criam a tabela de gerações e os triggers de cada tabela."""
+    comandos = [f"""CREATE TABLE IF NOT EXISTS {TABELA_GERACOES} (
+        tabela TEXT PRIMARY KEY, geracao INTEGER NOT NULL DEFAULT 0)"""]
+    for tabela in tabelas:
+        nome = tabela.name
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            comandos.append(f"""CREATE TRIGGER IF NOT EXISTS {nome}_geracao_{evento.lower()} AFTER {evento} ON {nome} BEGIN
+                INSERT INTO {TABELA_GERACOES}(tabela, geracao) VALUES ('{nome}', 1)
+                ON CONFLICT (tabela) DO UPDATE SET geracao = geracao + 1;
+            END""")
+    return comandos
+
+
+def instalar_geracoes(conexao, tabelas):
+    for comando in ddl_geracoes(tabelas):
+        conexao.execute(comando)
+    conexao.commit()
+
+
+def ler_geracoes(conexao, nomes):
+    """{tabela: geração} numa conexão DB-API do sqlite3; tabela ainda não alterada conta como 0."""
+    geracoes = dict.fromkeys(nomes, 0)
+    geracoes.update(conexao.execute(
+        f'SELECT tabela, geracao FROM {TABELA_GERACOES} WHERE tabela IN ({", ".join("?" * len(geracoes))})',
+        tuple(geracoes)).fetchall())
+    return geracoes
+
+
+def chave_pagina(caminho, argumentos, versao, geracoes):
+    """Chave do cache: argumentos em qualquer ordem geram a mesma chave."""
+    partes = [caminho, sorted((str(nome), str(valor)) for nome, valor in argumentos), versao, sorted(geracoes.items())]
+    return hashlib.sha256(json.dumps(partes, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CacheFragmentos:
+    def __init__(self, caminho_db, limite_bytes=100 * 1024 * 1024, limite_item=None):
+        self.caminho_db = caminho_db
+        self.limite_bytes = limite_bytes
+        self.limite_item = limite_item or limite_bytes // 10  # páginas maiores (fluxo de caixa de anos) não entram
+        self.acertos = 0
+        self.falhas = 0
+        self._trava = threading.Lock()
+        self._local = threading.local()
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho_db, timeout=5)
+            conexao.execute('PRAGMA journal_mode = WAL')  # leituras dos workers não esperam pela gravação de outro
+            conexao.execute("""CREATE TABLE IF NOT EXISTS fragmento_relatorio (
+                chave TEXT PRIMARY KEY, blocos TEXT NOT NULL, bytes INTEGER NOT NULL, usado_em REAL NOT NULL)""")
+            conexao.commit()
+            self._local.conexao = conexao
+        return conexao
+
+    def obter(self, chave):
+        """{bloco: html} em cache ou None."""
+        conexao = self._conexao()
+        linha = conexao.execute('SELECT blocos, usado_em FROM fragmento_relatorio WHERE chave = ?', (chave,)).fetchone()
+        if linha is None:
+            with self._trava: self.falhas += 1
+            return None
+        with self._trava: self.acertos += 1
+        agora = time.time()
+        if linha[1] < agora - RENOVAR_USO_SEGUNDOS:
+            try:
+                conexao.execute('UPDATE fragmento_relatorio SET usado_em = ? WHERE chave = ?', (agora, chave))
+                conexao.commit()
+            except sqlite3.OperationalError:
+                conexao.rollback()  # banco ocupado: a posição no LRU fica para o próximo acerto
+        return json.loads(linha[0])
+
+    def gravar(self, chave, blocos):
+        """Guarda os blocos (se couberem em limite_item) e descarta os menos usados acima do limite total."""
+        texto = json.dumps(blocos, ensure_ascii=False)
+        tamanho = len(texto.encode('utf-8'))
+        if tamanho > self.limite_item:
+            return False
+        conexao = self._conexao()
+        conexao.execute('INSERT OR REPLACE INTO fragmento_relatorio VALUES (?, ?, ?, ?)', (chave, texto, tamanho, time.time()))
+        conexao.execute("""DELETE FROM fragmento_relatorio WHERE chave IN (
+            SELECT chave FROM (SELECT chave, sum(bytes) OVER (ORDER BY usado_em DESC, chave) AS acumulado
+                               FROM fragmento_relatorio) WHERE acumulado > ?)""", (self.limite_bytes,))
+        conexao.commit()
+        return True
+
+    def limpar(self):
+        conexao = self._conexao()
+        conexao.execute('DELETE FROM fragmento_relatorio')
+        conexao.commit()
+
+    def estatisticas(self):
+        paginas, total = self._conexao().execute('SELECT count(*), coalesce(sum(bytes), 0) FROM fragmento_relatorio').fetchone()
+        consultas = self.acertos + self.falhas
+        return {
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': round(self.acertos / consultas, 4) if consultas else None,
+            'paginas': paginas,
+            'bytes': total,
+            'limite_bytes': self.limite_bytes,
+        }
@@ -0,0 +1,159 @@
+# cliente_http.py
+# Cliente HTTP de saída compartilhado, para as APIs externas (BrasilAPI).
+#
+# - Session com pool de conexões keep-alive (recriada após fork, um pool por worker do gunicorn);
+# - tempos limite de conexão e de leitura sempre definidos, mais um prazo total por chamada;
+# - novas tentativas limitadas, só para falhas transitórias (conexão, tempo esgotado, 429/502/503/504),
+#   com espera exponencial e jitter ("full jitter"), respeitando Retry-After;
+# - disjuntor (circuit breaker) por host: após CIRCUITO_FALHAS falhas seguidas ele abre e as chamadas
+#   falham na hora com CircuitoAberto, sem ocupar o worker; passada a espera, uma chamada de teste
+#   decide se fecha de novo ou reabre.
+# Não importa app.py.
+
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TEMPO_CONEXAO = 3.05
+TEMPO_LEITURA = 5
+PRAZO_TOTAL = 10
+TENTATIVAS = 3
+ESPERA_BASE = 0.2
+ESPERA_MAXIMA = 2
+STATUS_TRANSITORIOS = {429, 502, 503, 504}
+CIRCUITO_FALHAS = 5
+CIRCUITO_ESPERA = 30
+TAMANHO_POOL = 10
+
+FECHADO, ABERTO, MEIO_ABERTO = 'fechado', 'aberto', 'meio_aberto'
+
+
+class CircuitoAberto(requests.exceptions.RequestException):
+    """O host está marcado como indisponível; a chamada nem foi feita."""
+
+    def __init__(self, host, segundos_restantes):
+        super().__init__(f'{host} indisponível; nova tentativa em {segundos_restantes:.0f} s')
+        self.host = host
+        self.segundos_restantes = segundos_restantes
+
+
+class Disjuntor:
+    def __init__(self, falhas=CIRCUITO_FALHAS, espera=CIRCUITO_ESPERA):
+        self.limite_falhas = falhas
+        self.espera = espera
+        self.estado = FECHADO
+        self.falhas = 0
+        self.aberto_em = 0.0
+        self.aberturas = 0
+        self._teste_em_andamento = False
+        self._trava = threading.Lock()
+
+    def permitir(self):
+        """Devolve os segundos até a próxima tentativa se a chamada deve ser recusada, ou None."""
+        with self._trava:
+            if self.estado == FECHADO:
+                return None
+            restante = self.aberto_em + self.espera - time.monotonic()
+            if self.estado == ABERTO and restante <= 0:
+                self.estado = MEIO_ABERTO
+            if self.estado == MEIO_ABERTO and not self._teste_em_andamento:
+                # Só uma chamada de teste por vez; as demais continuam falhando rápido
+                self._teste_em_andamento = True
+                return None
+            return max(restante, 0)
+
+    def sucesso(self):
+        with self._trava:
+            self.estado, self.falhas, self._teste_em_andamento = FECHADO, 0, False
+
+    def falha(self):
+        with self._trava:
+            self.falhas += 1
+            self._teste_em_andamento = False
+            if self.estado == MEIO_ABERTO or self.falhas >= self.limite_falhas:
+                if self.estado != ABERTO: self.aberturas += 1
+                self.estado, self.aberto_em = ABERTO, time.monotonic()
+
+
+class ClienteHTTP:
+    def __init__(self, tempo_conexao=TEMPO_CONEXAO, tempo_leitura=TEMPO_LEITURA, tentativas=TENTATIVAS,
+                 prazo_total=PRAZO_TOTAL, circuito_falhas=CIRCUITO_FALHAS, circuito_espera=CIRCUITO_ESPERA):
+        self.tempo_conexao = tempo_conexao
+        self.tempo_leitura = tempo_leitura
+        self.tentativas = max(tentativas, 1)
+        self.prazo_total = prazo_total
+        self.circuito_falhas = circuito_falhas
+        self.circuito_espera = circuito_espera
+        self._sessao = None
+        self._sessao_pid = None
+        self._disjuntores = {}
+        self._trava = threading.Lock()
+
+    def _obter_sessao(self):
+        # Conexões abertas antes de um fork não podem ser compartilhadas entre processos
+        if self._sessao is None or self._sessao_pid != os.getpid():
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=TAMANHO_POOL, pool_maxsize=TAMANHO_POOL, max_retries=0)
+            sessao.mount('http://', adaptador)
+            sessao.mount('https://', adaptador)
+            self._sessao, self._sessao_pid = sessao, os.getpid()
+        return self._sessao
+
+    def disjuntor(self, url):
+        host = urlsplit(url).netloc
+        with self._trava:
+            if host not in self._disjuntores:
+                self._disjuntores[host] = Disjuntor(self.circuito_falhas, self.circuito_espera)
+            return self._disjuntores[host]
+
+    def _espera(self, tentativa, resposta=None):
+        if resposta is not None and resposta.headers.get('Retry-After', '').isdigit():
+            return min(int(resposta.headers['Retry-After']), ESPERA_MAXIMA)
+        return random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa))
+
+    def get(self, url, **kwargs):
+        """GET com tempos limite, novas tentativas e disjuntor. Levanta CircuitoAberto se o host estiver marcado como fora."""
+        disjuntor = self.disjuntor(url)
+        restante = disjuntor.permitir()
+        if restante is not None:
+            raise CircuitoAberto(urlsplit(url).netloc, restante)
+
+        limite = time.monotonic() + self.prazo_total
+        sessao = self._obter_sessao()
+        for tentativa in range(self.tentativas):
+            ultima = tentativa == self.tentativas - 1
+            leitura = min(self.tempo_leitura, max(limite - time.monotonic(), 0.1))
+            try:
+                resposta = sessao.get(url, timeout=(self.tempo_conexao, leitura), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                resposta = None
+                if ultima:
+                    disjuntor.falha()
+                    raise
+            except requests.exceptions.RequestException:
+                # Corpo truncado, redirecionamentos demais, URL inválida...: não se repete, mas a chamada
+                # precisa registrar o resultado, senão a chamada de teste do disjuntor nunca termina
+                disjuntor.falha()
+                raise
+            if resposta is not None and resposta.status_code not in STATUS_TRANSITORIOS:
+                # Um 500 não é repetido, mas conta como falha do host
+                disjuntor.falha() if resposta.status_code >= 500 else disjuntor.sucesso()
+                return resposta
+            espera = self._espera(tentativa, resposta)
+            if ultima or time.monotonic() + espera >= limite:
+                disjuntor.falha()
+                if resposta is None:
+                    raise requests.exceptions.Timeout(f'Prazo de {self.prazo_total} s esgotado para {url}')
+                return resposta
+            time.sleep(espera)
+
+    def estatisticas(self):
+        with self._trava:
+            disjuntores = dict(self._disjuntores)
+        return {host: {'estado': d.estado, 'falhas_seguidas': d.falhas, 'aberturas': d.aberturas}
+                for host, d in disjuntores.items()}
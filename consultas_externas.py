@@ -0,0 +1,296 @@
+# consultas_externas.py
+# Consultas de CNPJ e CEP na BrasilAPI com cache em dois níveis.
+#
+# 1. LRU em memória do processo (sem I/O);
+# 2. tabela SQLite em arquivo próprio, compartilhada pelos workers e preservada entre reinícios.
+# Cada tipo de consulta tem a sua validade; "não encontrado" também é guardado, por menos tempo,
+# para que um documento inexistente não vá à rede a cada tentativa. Falhas de rede e erros 5xx
+# não são guardados. Consultas simultâneas à mesma chave são agrupadas: só a primeira sai para
+# a rede e as demais esperam pelo mesmo resultado. As chamadas saem pelo ClienteHTTP (cliente_http.py:
+# pool de conexões, tempos limite, novas tentativas, disjuntor); se a API falhar e houver no disco uma
+# resposta já vencida, ela é devolvida no lugar do erro. ServidorStub imita a BrasilAPI localmente,
+# para testes (BRASILAPI_URL=http://127.0.0.1:<porta>). Não importa app.py.
+
+import collections
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from cliente_http import ClienteHTTP, CircuitoAberto
+
+BRASILAPI_URL = 'https://brasilapi.com.br'
+CAPACIDADE_MEMORIA = 1024
+
+CNPJ, CEP = 'cnpj', 'cep'
+ROTAS = {CNPJ: '/api/cnpj/v1/{}', CEP: '/api/cep/v1/{}'}
+VALIDADE_SEGUNDOS = {CNPJ: 30 * 86400, CEP: 90 * 86400}
+VALIDADE_NAO_ENCONTRADO = 86400
+
+
+class ErroConsulta(Exception):
+    """A API externa não respondeu ou respondeu com erro; nada foi guardado no cache."""
+
+    def __init__(self, mensagem, tentar_novamente_em=None):
+        super().__init__(mensagem)
+        self.tentar_novamente_em = tentar_novamente_em
+
+
+class _Consulta:
+    # Consulta em andamento, compartilhada por quem pedir a mesma chave enquanto ela não termina
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class ServicoConsultas:
+    def __init__(self, caminho_db, base_url=BRASILAPI_URL, capacidade=CAPACIDADE_MEMORIA, sessao=None):
+        self.caminho_db = caminho_db
+        self.base_url = base_url.rstrip('/')
+        self.capacidade = capacidade
+        self.sessao = sessao or ClienteHTTP()
+        self._memoria = collections.OrderedDict()  # (tipo, chave) -> (expira_em, encontrado, dados)
+        self._em_andamento = {}
+        self._trava = threading.Lock()
+        self._local = threading.local()
+        self.contadores = collections.Counter()
+
+    # --- Cache em disco ---
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho_db, timeout=5)
+            conexao.execute("""CREATE TABLE IF NOT EXISTS consulta_externa (
+                tipo TEXT NOT NULL, chave TEXT NOT NULL, encontrado INTEGER NOT NULL, dados TEXT,
+                expira_em REAL NOT NULL, PRIMARY KEY (tipo, chave))""")
+            conexao.commit()
+            self._local.conexao = conexao
+        return conexao
+
+    def _ler_disco(self, tipo, chave, vencidas=False):
+        linha = self._conexao().execute(
+            'SELECT expira_em, encontrado, dados FROM consulta_externa WHERE tipo = ? AND chave = ? AND expira_em > ?',
+            (tipo, chave, 0 if vencidas else time.time())).fetchone()
+        if linha is None:
+            return None
+        expira_em, encontrado, dados = linha
+        return expira_em, bool(encontrado), json.loads(dados) if dados else None
+
+    def _gravar_disco(self, tipo, chave, entrada):
+        expira_em, encontrado, dados = entrada
+        conexao = self._conexao()
+        conexao.execute('INSERT OR REPLACE INTO consulta_externa VALUES (?, ?, ?, ?, ?)',
+                        (tipo, chave, int(encontrado), json.dumps(dados) if dados is not None else None, expira_em))
+        conexao.commit()
+
+    # --- Cache em memória ---
+
+    def _ler_memoria(self, tipo, chave):
+        with self._trava:
+            entrada = self._memoria.get((tipo, chave))
+            if entrada is None:
+                return None
+            if entrada[0] <= time.time():
+                del self._memoria[(tipo, chave)]
+                return None
+            self._memoria.move_to_end((tipo, chave))
+            return entrada
+
+    def _gravar_memoria(self, tipo, chave, entrada):
+        with self._trava:
+            self._memoria[(tipo, chave)] = entrada
+            self._memoria.move_to_end((tipo, chave))
+            while len(self._memoria) > self.capacidade:
+                self._memoria.popitem(last=False)
+
+    # --- Consulta ---
+
+    def _buscar_na_rede(self, tipo, chave):
+        try:
+            resposta = self.sessao.get(self.base_url + ROTAS[tipo].format(chave))
+        except CircuitoAberto as e:
+            raise ErroConsulta(str(e), tentar_novamente_em=e.segundos_restantes) from e
+        except requests.exceptions.RequestException as e:
+            raise ErroConsulta(f'Falha na comunicação com a BrasilAPI: {e}') from e
+        if resposta.status_code == 200:
+            try:
+                dados = resposta.json()
+            except ValueError as e:  # corpo truncado ou HTML de um proxy no meio do caminho
+                raise ErroConsulta(f'BrasilAPI respondeu com JSON inválido: {e}') from e
+            return time.time() + VALIDADE_SEGUNDOS[tipo], True, dados
+        if resposta.status_code in (400, 404):
+            return time.time() + VALIDADE_NAO_ENCONTRADO, False, None
+        raise ErroConsulta(f'BrasilAPI respondeu {resposta.status_code}')
+
+    def _resolver(self, tipo, chave):
+        entrada = self._ler_disco(tipo, chave)
+        if entrada is not None:
+            self._contar('acertos_disco')
+        else:
+            self._contar('consultas_rede')
+            try:
+                entrada = self._buscar_na_rede(tipo, chave)
+            except ErroConsulta:
+                self._contar('erros')
+                # Resposta degradada: melhor um cadastro de semanas atrás do que nenhum
+                vencida = self._ler_disco(tipo, chave, vencidas=True)
+                if vencida is None:
+                    raise
+                self._contar('respostas_vencidas')
+                return vencida
+            self._gravar_disco(tipo, chave, entrada)
+        self._gravar_memoria(tipo, chave, entrada)
+        return entrada
+
+    def consultar(self, tipo, valor):
+        """Devolve (encontrado, dados) para o CNPJ/CEP `valor`; levanta ErroConsulta se a API falhar."""
+        chave = re.sub(r'\D', '', valor)
+        self._contar('consultas')
+        entrada = self._ler_memoria(tipo, chave)
+        if entrada is not None:
+            self._contar('acertos_memoria')
+            return entrada[1], entrada[2]
+
+        with self._trava:
+            consulta = self._em_andamento.get((tipo, chave))
+            responsavel = consulta is None
+            if responsavel:
+                consulta = self._em_andamento[(tipo, chave)] = _Consulta()
+        if not responsavel:
+            self._contar('agrupadas')
+            consulta.concluida.wait()
+            if consulta.erro is not None:
+                raise consulta.erro
+            return consulta.resultado[1], consulta.resultado[2]
+
+        try:
+            consulta.resultado = self._resolver(tipo, chave)
+        except Exception as e:  # quem esperava recebe o mesmo erro, qualquer que seja
+            consulta.erro = e
+            raise
+        finally:
+            with self._trava:
+                del self._em_andamento[(tipo, chave)]
+            consulta.concluida.set()
+        return consulta.resultado[1], consulta.resultado[2]
+
+    def _contar(self, nome):
+        with self._trava:
+            self.contadores[nome] += 1
+
+    def estatisticas(self):
+        with self._trava:
+            contadores = dict(self.contadores)
+            itens_memoria = len(self._memoria)
+        consultas = contadores.get('consultas', 0)
+        # Acerto = respondida sem ir à rede (memória, disco ou carona em uma consulta em andamento)
+        sem_rede = sum(contadores.get(nome, 0) for nome in ('acertos_memoria', 'acertos_disco', 'agrupadas'))
+        return {
+            'consultas': consultas,
+            'acertos_memoria': contadores.get('acertos_memoria', 0),
+            'acertos_disco': contadores.get('acertos_disco', 0),
+            'agrupadas': contadores.get('agrupadas', 0),
+            'consultas_rede': contadores.get('consultas_rede', 0),
+            'erros': contadores.get('erros', 0),
+            'respostas_vencidas': contadores.get('respostas_vencidas', 0),
+            'taxa_acerto': round(sem_rede / consultas, 4) if consultas else None,
+            'itens_memoria': itens_memoria,
+            'disjuntores': self.sessao.estatisticas() if hasattr(self.sessao, 'estatisticas') else {},
+        }
+
+    def limpar(self):
+        with self._trava:
+            self._memoria.clear()
+        conexao = self._conexao()
+        conexao.execute('DELETE FROM consulta_externa')
+        conexao.commit()
+
+
+class ServidorStub:
+    """Imitação local da BrasilAPI: responde CNPJs/CEPs de `dados`, 404 para o resto, e conta as requisições.
+
+    `atraso`, `taxa_erro` (fração das requisições que recebem `status_erro`) e `corpo_quebrado` (resposta
+    "chunked" malformada, que o requests acusa como ChunkedEncodingError) podem ser alterados com o servidor no ar.
+    """
+
+    def __init__(self, dados=None, porta=0, atraso=0.0, taxa_erro=0.0, status_erro=503):
+        self.dados = dados if dados is not None else DADOS_STUB
+        self.atraso = atraso
+        self.taxa_erro = taxa_erro
+        self.status_erro = status_erro
+        self.corpo_quebrado = False
+        self.requisicoes = collections.Counter()
+        servidor = self
+
+        class Manipulador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                servidor.requisicoes[self.path] += 1
+                if servidor.atraso: time.sleep(servidor.atraso)
+                if servidor.taxa_erro and random.random() < servidor.taxa_erro:
+                    self.send_response(servidor.status_erro)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if servidor.corpo_quebrado:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    self.wfile.write(b'zz\r\n{}\r\n')  # tamanho de bloco inválido
+                    return
+                for tipo, rota in ROTAS.items():
+                    prefixo = rota.format('')
+                    if self.path.startswith(prefixo):
+                        registro = servidor.dados.get(tipo, {}).get(self.path[len(prefixo):])
+                        break
+                else:
+                    registro = None
+                corpo = json.dumps(registro if registro is not None else {'message': 'não encontrado'}).encode('utf-8')
+                try:
+                    self.send_response(200 if registro is not None else 404)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(corpo)))
+                    self.end_headers()
+                    self.wfile.write(corpo)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # o cliente desistiu por tempo limite
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer(('127.0.0.1', porta), Manipulador)
+        self.porta = self._http.server_address[1]
+        self.url = f'http://127.0.0.1:{self.porta}'
+
+    def iniciar(self):
+        threading.Thread(target=self._http.serve_forever, daemon=True).start()
+        return self
+
+    def executar(self):
+        self._http.serve_forever()
+
+    def encerrar(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+
+DADOS_STUB = {
+    CNPJ: {
+        '11222333000181': {
+            'cnpj': '11222333000181', 'razao_social': 'EMPRESA EXEMPLO LTDA', 'nome_fantasia': 'EXEMPLO',
+            'logradouro': 'RUA DAS FLORES', 'numero': '100', 'bairro': 'CENTRO', 'municipio': 'SAO PAULO',
+            'uf': 'SP', 'cep': '01001000', 'ddd_telefone_1': '1133334444', 'email': 'contato@exemplo.com.br',
+        },
+    },
+    CEP: {
+        '01001000': {'cep': '01001000', 'state': 'SP', 'city': 'São Paulo', 'neighborhood': 'Sé',
+                     'street': 'Praça da Sé', 'service': 'stub'},
+    },
+}
@@ -0,0 +1,261 @@
+# cubo_analitico.py
+# Cubo analítico em memória (pandas) para cortes ad hoc de O.S., peças, faturas e parcelas.
+#
+# As quatro tabelas ficam em DataFrames colunares, indexados pelo id, só com as colunas que os
+# cortes usam. A primeira carga lê tudo; as seguintes leem apenas as linhas registradas em
+# "registro_alteracao" (os mesmos triggers do snapshot Parquet) depois da última sequência vista,
+# e substituem/removem essas linhas no DataFrame. Leitura e sequência vêm da mesma transação,
+# então nenhuma alteração se perde entre uma atualização e outra. `pivo` filtra por período e
+# dimensões e agrupa em memória; as dimensões de tempo (ano, mes, semana, dia) saem da data de
+# cada fato. Cada processo (worker do gunicorn) mantém o seu cubo. Não importa app.py.
+
+import datetime
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from snapshot_parquet import TABELA_ALTERACOES
+
+# tabela: (colunas lidas, colunas de data)
+TABELAS = {
+    'ordem_servico': (['id', 'data_criacao', 'status_id', 'cliente_id', 'valor_servicos', 'valor_pecas', 'valor_total'], ['data_criacao']),
+    'peca': (['id', 'ordem_servico_id', 'produto_id', 'quantidade', 'valor_unitario'], []),
+    'faturamento': (['id', 'data_emissao', 'cliente_id', 'valor_total_faturado'], ['data_emissao']),
+    'pagamento': (['id', 'faturamento_id', 'data_vencimento', 'status', 'tipo_pagamento', 'valor'], ['data_vencimento']),
+}
+
+# fato: coluna de data, dimensões (nome -> coluna) e medidas (nome -> (coluna, agregação))
+FATOS = {
+    'ordens': {
+        'data': 'data_criacao',
+        'dimensoes': {'status': 'status_id', 'cliente': 'cliente_id', 'fatura': 'faturamento_id'},
+        'medidas': {'quantidade': ('id', 'count'), 'valor_servicos': ('valor_servicos', 'sum'),
+                    'valor_pecas': ('valor_pecas', 'sum'), 'valor_total': ('valor_total', 'sum')},
+    },
+    'pecas': {
+        'data': 'data_criacao',
+        'dimensoes': {'status': 'status_id', 'cliente': 'cliente_id', 'produto': 'produto_id', 'ordem': 'ordem_servico_id'},
+        'medidas': {'itens': ('id', 'count'), 'quantidade': ('quantidade', 'sum'), 'valor': ('valor', 'sum')},
+    },
+    'faturas': {
+        'data': 'data_emissao',
+        'dimensoes': {'cliente': 'cliente_id'},
+        'medidas': {'quantidade': ('id', 'count'), 'valor': ('valor_total_faturado', 'sum')},
+    },
+    'pagamentos': {
+        'data': 'data_vencimento',
+        'dimensoes': {'status': 'status', 'tipo': 'tipo_pagamento', 'cliente': 'cliente_id', 'fatura': 'faturamento_id'},
+        'medidas': {'quantidade': ('id', 'count'), 'valor': ('valor', 'sum')},
+    },
+}
+DIMENSOES_DE_TEMPO = ('ano', 'mes', 'semana', 'dia')
+LIMITE_LINHAS = 10000
+
+
+class Cubo:
+    def __init__(self):
+        self.tabelas = {}
+        self.sequencia = None
+        self.atualizado_em = None
+        self._quadros = {}
+        self._trava = threading.Lock()
+
+    # --- Carga ---
+
+    def _ler(self, cursor, tabela, ids=None):
+        colunas, datas = TABELAS[tabela]
+        selecionadas = [f'"{coluna}"' for coluna in colunas]
+        if tabela == 'ordem_servico':
+            # A fatura da O.S. (faturamento_os) entra como coluna do fato
+            selecionadas.append('(SELECT min(faturamento_id) FROM faturamento_os WHERE ordem_servico_id = ordem_servico.id)')
+        consulta = f'SELECT {", ".join(selecionadas)} FROM "{tabela}"'
+        if ids is None:
+            linhas = cursor.execute(consulta).fetchall()
+        else:
+            linhas = []
+            for inicio in range(0, len(ids), 500):
+                bloco = ids[inicio:inicio + 500]
+                linhas.extend(cursor.execute(f'{consulta} WHERE id IN ({", ".join("?" * len(bloco))})', bloco).fetchall())
+        nomes = colunas + (['faturamento_id'] if tabela == 'ordem_servico' else [])
+        quadro = pd.DataFrame.from_records(linhas, columns=nomes)
+        for coluna in datas:
+            # O SQLite guarda datas como texto ISO
+            quadro[coluna] = pd.to_datetime(quadro[coluna], format='ISO8601', errors='coerce')
+        for coluna in nomes:
+            if coluna.endswith('_id'):
+                quadro[coluna] = quadro[coluna].astype('Int64')  # chaves com NULL continuam inteiras
+        return quadro.set_index('id', drop=False)
+
+    def _alteracoes(self, cursor):
+        """{tabela: (ids alterados, ids excluídos)} desde a última sequência vista."""
+        marcadores = ', '.join('?' * len(TABELAS))
+        alteracoes = {tabela: ([], []) for tabela in TABELAS}
+        for tabela, registro_id, excluido in cursor.execute(
+                f'SELECT tabela, registro_id, excluido FROM {TABELA_ALTERACOES} WHERE sequencia > ? AND tabela IN ({marcadores})',
+                (self.sequencia, *TABELAS)):
+            alteracoes[tabela][1 if excluido else 0].append(registro_id)
+        return alteracoes
+
+    def atualizar(self, conexao):
+        """Carrega (1ª vez) ou aplica as alterações desde a última carga; `conexao` é uma conexão DB-API do sqlite3.
+
+        Os triggers de registro_alteracao das quatro tabelas precisam existir antes da primeira carga.
+        """
+        with self._trava:
+            inicio = time.perf_counter()
+            cursor = conexao.cursor()
+            try:
+                cursor.execute('BEGIN')
+                sequencia = cursor.execute(f'SELECT coalesce(max(sequencia), 0) FROM {TABELA_ALTERACOES}').fetchone()[0]
+                if self.sequencia is None:
+                    self.tabelas = {tabela: self._ler(cursor, tabela) for tabela in TABELAS}
+                    tipo, linhas = 'completa', {tabela: len(quadro) for tabela, quadro in self.tabelas.items()}
+                elif sequencia == self.sequencia:
+                    tipo, linhas = 'sem_alteracoes', {}
+                else:
+                    alteracoes = self._alteracoes(cursor)
+                    # O.S. cuja fatura pode ter mudado: as ligadas às faturas alteradas/excluídas (antes e depois)
+                    faturas = alteracoes['faturamento'][0] + alteracoes['faturamento'][1]
+                    if faturas:
+                        ordens = self.tabelas['ordem_servico']
+                        alteracoes['ordem_servico'][0].extend(ordens.index[ordens['faturamento_id'].isin(faturas)])
+                        for bloco in range(0, len(faturas), 500):
+                            parte = faturas[bloco:bloco + 500]
+                            alteracoes['ordem_servico'][0].extend(linha[0] for linha in cursor.execute(
+                                f'SELECT ordem_servico_id FROM faturamento_os WHERE faturamento_id IN ({", ".join("?" * len(parte))})', parte))
+                    linhas = {}
+                    for tabela, (alterados, excluidos) in alteracoes.items():
+                        alterados = sorted({int(i) for i in alterados} - set(excluidos))
+                        if not (alterados or excluidos):
+                            continue
+                        novos = self._ler(cursor, tabela, alterados)
+                        atual = self.tabelas[tabela]
+                        fora = atual.index.isin(excluidos) | atual.index.isin(alterados)
+                        self.tabelas[tabela] = pd.concat([atual[~fora], novos]) if len(novos) else atual[~fora]
+                        linhas[tabela] = len(novos) + len(excluidos)
+                    tipo = 'incremental'
+                conexao.commit()
+            except BaseException:
+                conexao.rollback()
+                raise
+            finally:
+                cursor.close()
+            if tipo != 'sem_alteracoes':
+                self._quadros = {}
+            self.sequencia = sequencia
+            self.atualizado_em = datetime.datetime.now()
+            return {'tipo': tipo, 'sequencia': sequencia, 'linhas': linhas, 'segundos': round(time.perf_counter() - inicio, 4)}
+
+    # --- Consulta ---
+
+    def _quadro(self, fato):
+        """(DataFrame do fato com a data, as dimensões e as medidas; datas em dias), guardado até a próxima alteração."""
+        if fato not in self._quadros:
+            ordens, faturas = self.tabelas['ordem_servico'], self.tabelas['faturamento']
+            if fato == 'ordens':
+                quadro = ordens
+            elif fato == 'faturas':
+                quadro = faturas
+            elif fato == 'pecas':
+                pecas = self.tabelas['peca']
+                da_ordem = ordens.reindex(pecas['ordem_servico_id'])
+                quadro = pecas.assign(
+                    data_criacao=da_ordem['data_criacao'].to_numpy(), status_id=da_ordem['status_id'].to_numpy(),
+                    cliente_id=da_ordem['cliente_id'].to_numpy(), valor=pecas['quantidade'] * pecas['valor_unitario'])
+            else:
+                pagamentos = self.tabelas['pagamento']
+                quadro = pagamentos.assign(cliente_id=faturas['cliente_id'].reindex(pagamentos['faturamento_id']).to_numpy())
+            self._quadros[fato] = quadro, quadro[FATOS[fato]['data']].to_numpy().astype('M8[D]')
+        return self._quadros[fato]
+
+    def pivo(self, fato, dimensoes=(), medidas=(), inicio=None, fim=None, filtros=None, limite=LIMITE_LINHAS):
+        """Agrupa o fato pelas dimensões e devolve {'linhas': [...], 'truncado': bool}.
+
+        `inicio`/`fim` (datetime.date, inclusivos) filtram pela data do fato; `filtros` é {dimensão: [valores]}.
+        Dimensão ou medida desconhecida gera ValueError. Sem medidas, usa todas as do fato.
+        """
+        if fato not in FATOS:
+            raise ValueError(f"Fato desconhecido: {fato!r} (use {', '.join(FATOS)})")
+        definicao = FATOS[fato]
+        medidas = list(medidas) or list(definicao['medidas'])
+        for nome in dimensoes:
+            if nome not in definicao['dimensoes'] and nome not in DIMENSOES_DE_TEMPO:
+                raise ValueError(f"Dimensão desconhecida para {fato}: {nome!r}")
+        for nome in medidas:
+            if nome not in definicao['medidas']:
+                raise ValueError(f"Medida desconhecida para {fato}: {nome!r}")
+        with self._trava:
+            quadro, dias = self._quadro(fato)
+        datas = quadro[definicao['data']]
+        mascara = np.ones(len(quadro), dtype=bool)
+        if inicio:
+            mascara &= (datas >= pd.Timestamp(inicio)).to_numpy()
+        if fim:
+            mascara &= (datas < pd.Timestamp(fim) + pd.Timedelta(days=1)).to_numpy()
+        for nome, valores in (filtros or {}).items():
+            if nome not in definicao['dimensoes']:
+                raise ValueError(f"Dimensão desconhecida para {fato}: {nome!r}")
+            coluna = quadro[definicao['dimensoes'][nome]]
+            if pd.api.types.is_numeric_dtype(coluna):
+                valores = pd.to_numeric(pd.Series(list(valores)), errors='raise')
+            mascara &= coluna.isin(list(valores)).to_numpy()
+        selecao, dias = quadro[mascara], dias[mascara]
+
+        # Agrupa por códigos (factorize + bincount) em vez de groupby().agg(); a ordem das linhas sai das dimensões
+        grupos, codigos_das_dimensoes = np.zeros(len(selecao), dtype=np.int64), []
+        for nome in dimensoes:
+            codigos, valores = pd.factorize(self._chave(selecao, dias, definicao, nome), sort=True, use_na_sentinel=False)
+            grupos = pd.factorize(grupos * len(valores) + codigos)[0]
+            codigos_das_dimensoes.append((nome, codigos, valores))
+        quantidade_grupos = int(grupos.max()) + 1 if len(grupos) else (0 if dimensoes else 1)
+        primeira_linha = np.empty(quantidade_grupos, dtype=np.int64)
+        primeira_linha[grupos[::-1]] = np.arange(len(grupos) - 1, -1, -1)
+        ordem = np.lexsort([codigos[primeira_linha] for _, codigos, _ in reversed(codigos_das_dimensoes)]) \
+            if dimensoes else np.arange(quantidade_grupos)
+        resultado = {}
+        for nome, codigos, valores in codigos_das_dimensoes:
+            valores = valores[codigos[primeira_linha[ordem]]]
+            if nome in DIMENSOES_DE_TEMPO:
+                valores = self._rotulo_de_tempo(valores, nome)
+            elif definicao['dimensoes'][nome].endswith('_id'):
+                # Int64 anulável sai do factorize como float (1.0, nan); os rótulos do app procuram pelo id inteiro
+                valores = np.array([None if pd.isna(v) else int(v) for v in valores], dtype=object)
+            resultado[nome] = valores
+        for nome in medidas:
+            coluna, agregacao = definicao['medidas'][nome]
+            if agregacao == 'count':
+                resultado[nome] = np.bincount(grupos, minlength=quantidade_grupos)[ordem]
+            else:
+                serie = selecao[coluna]
+                pesos = serie.to_numpy(dtype=float, na_value=0.0)
+                somas = np.bincount(grupos, weights=np.where(np.isnan(pesos), 0.0, pesos), minlength=quantidade_grupos)[ordem]
+                resultado[nome] = somas.round().astype(np.int64) if pd.api.types.is_integer_dtype(serie) else somas
+        resultado = pd.DataFrame(resultado)
+        truncado = len(resultado) > limite
+        resultado = resultado.head(limite)
+        resultado = resultado.astype(object).where(resultado.notna(), None)
+        return {'linhas': resultado.to_dict('records'), 'truncado': truncado}
+
+    @staticmethod
+    def _chave(selecao, dias, definicao, nome):
+        if nome not in DIMENSOES_DE_TEMPO:
+            return selecao[definicao['dimensoes'][nome]].to_numpy()
+        if nome == 'dia':
+            return dias
+        if nome == 'semana':
+            # 1970-01-01 foi uma quinta-feira: recua até a segunda-feira
+            return dias - ((dias.astype(np.int64) + 3) % 7).astype('m8[D]')
+        return dias.astype('M8[M]' if nome == 'mes' else 'M8[Y]')
+
+    @staticmethod
+    def _rotulo_de_tempo(valores, nome):
+        formato = {'ano': '%Y', 'mes': '%Y-%m', 'semana': '%Y-%m-%d', 'dia': '%Y-%m-%d'}[nome]
+        return pd.DatetimeIndex(valores).strftime(formato).to_numpy(dtype=object)
+
+    def estatisticas(self):
+        return {'sequencia': self.sequencia,
+                'atualizado_em': self.atualizado_em.isoformat(timespec='seconds') if self.atualizado_em else None,
+                'linhas': {tabela: len(quadro) for tabela, quadro in self.tabelas.items()},
+                'bytes': int(sum(quadro.memory_usage(deep=True).sum() for quadro in self.tabelas.values()))}
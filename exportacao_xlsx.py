@@ -0,0 +1,62 @@
+# exportacao_xlsx.py
+# Exportação de planilhas em fluxo, com o modo write-only do openpyxl.
+#
+# As linhas chegam de um iterável (consultas lidas em blocos) e são gravadas uma a uma no
+# XML temporário da planilha, sem manter a tabela em memória. O .xlsx final é montado em um
+# arquivo temporário e devolvido em blocos, para ser usado como corpo de uma resposta em
+# fluxo. Não importa app.py.
+
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+TAMANHO_BLOCO = 64 * 1024
+
+FORMATO_MOEDA = '#,##0.00'
+FORMATO_DATA = 'DD/MM/YYYY'
+FORMATO_DATA_HORA = 'DD/MM/YYYY HH:MM'
+
+
+class Coluna:
+    def __init__(self, titulo, largura=15, formato=None):
+        self.titulo = titulo
+        self.largura = largura
+        self.formato = formato
+
+
+def gerar_xlsx(nome_planilha, colunas, linhas):
+    """Gera os bytes de um .xlsx com `colunas` (lista de Coluna) e as `linhas`, em blocos."""
+    livro = Workbook(write_only=True)
+    planilha = livro.create_sheet(nome_planilha[:31])
+    for indice, coluna in enumerate(colunas, start=1):
+        planilha.column_dimensions[get_column_letter(indice)].width = coluna.largura
+    planilha.freeze_panes = 'A2'
+
+    negrito = Font(bold=True)
+    cabecalho = []
+    for coluna in colunas:
+        celula = WriteOnlyCell(planilha, value=coluna.titulo)
+        celula.font = negrito
+        cabecalho.append(celula)
+    planilha.append(cabecalho)
+
+    formatos = [(indice, coluna.formato) for indice, coluna in enumerate(colunas) if coluna.formato]
+    for linha in linhas:
+        if formatos:
+            linha = list(linha)
+            for indice, formato in formatos:
+                if linha[indice] is not None:
+                    celula = WriteOnlyCell(planilha, value=linha[indice])
+                    celula.number_format = formato
+                    linha[indice] = celula
+        planilha.append(linha)
+
+    with tempfile.TemporaryFile() as temporario:
+        livro.save(temporario)
+        temporario.seek(0)
+        while bloco := temporario.read(TAMANHO_BLOCO):
+            yield bloco
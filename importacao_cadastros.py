@@ -0,0 +1,303 @@
+# importacao_cadastros.py
+# Importação em massa de clientes e fornecedores a partir de CSV ou XLSX.
+#
+# O arquivo é lido em fluxo (csv.reader / openpyxl em read_only) e processado em lotes:
+# cada linha é normalizada com as mesmas regras dos formulários (só dígitos em documentos,
+# telefone e CEP; maiúsculas em nomes e endereço); os CPFs/CNPJs do lote são validados de uma vez;
+# duplicidades são checadas contra o próprio arquivo e, com uma única consulta por lote, contra as
+# colunas únicas da tabela; as linhas aprovadas entram com um INSERT executemany e o lote é
+# confirmado. Ao final há um relatório com o erro de cada linha rejeitada. Não importa app.py.
+
+import csv
+import io
+import re
+import time
+import unicodedata
+
+from openpyxl import load_workbook
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.exc import IntegrityError
+
+from validacao_documentos import validar_cpfs, validar_cnpjs
+
+LINHAS_POR_LOTE = 1000
+TAMANHO_AMOSTRA = 64 * 1024
+
+# Cabeçalhos aceitos além do próprio nome da coluna (já sem acentos, minúsculos, com "_")
+SINONIMOS = {
+    'cpf_cnpj': 'documento', 'cnpj_cpf': 'documento', 'doc': 'documento',
+    'nome_razao_social': 'nome', 'nome_completo': 'nome',
+    'endereco': 'rua', 'logradouro': 'rua',
+    'num': 'numero', 'no': 'numero', 'nro': 'numero',
+    'municipio': 'cidade', 'estado': 'uf',
+    'e_mail': 'email', 'fone': 'telefone', 'celular': 'telefone',
+    'ie': 'inscricao_estadual', 'fantasia': 'nome_fantasia',
+    'tipo': 'tipo_pessoa',
+}
+
+
+class ErroImportacao(Exception):
+    """O arquivo não pode ser lido (formato, codificação ou cabeçalho)."""
+
+
+# --- Leitura ---
+
+def _nome_campo(cabecalho):
+    texto = unicodedata.normalize('NFKD', str(cabecalho or '')).encode('ascii', 'ignore').decode()
+    texto = re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+    return SINONIMOS.get(texto, texto)
+
+
+def _linhas_csv(arquivo):
+    amostra = arquivo.read(TAMANHO_AMOSTRA)
+    arquivo.seek(0)
+    try:
+        # Corta na última quebra de linha para não partir um caractere multibyte ao meio
+        amostra.rsplit(b'\n', 1)[0].decode('utf-8-sig')
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacao = 'cp1252'  # CSV salvo pelo Excel em português
+    texto = io.TextIOWrapper(arquivo, encoding=codificacao, newline='')
+    try:
+        dialeto = csv.Sniffer().sniff(amostra.decode(codificacao, errors='ignore'), delimiters=';,\t')
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.reader(texto, dialeto)
+    cabecalho = next(leitor, None)
+    if not cabecalho:
+        raise ErroImportacao('Arquivo vazio.')
+    campos = [_nome_campo(c) for c in cabecalho]
+    for linha in leitor:
+        if any(valor.strip() for valor in linha):
+            yield dict(zip(campos, linha))
+        else:
+            yield None
+
+
+def _linhas_xlsx(arquivo):
+    try:
+        livro = load_workbook(arquivo, read_only=True, data_only=True)
+    except Exception as e:
+        raise ErroImportacao(f'Não foi possível abrir a planilha: {e}') from e
+    try:
+        linhas = livro.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if not cabecalho:
+            raise ErroImportacao('Planilha vazia.')
+        campos = [_nome_campo(c) for c in cabecalho]
+        for linha in linhas:
+            if any(valor not in (None, '') for valor in linha):
+                yield dict(zip(campos, linha))
+            else:
+                yield None
+    finally:
+        livro.close()
+
+
+def ler_linhas(arquivo, nome_arquivo):
+    """Gera um dict por linha (campo normalizado -> valor bruto), ou None para linhas em branco."""
+    if nome_arquivo.lower().endswith(('.xlsx', '.xlsm')):
+        return _linhas_xlsx(arquivo)
+    if nome_arquivo.lower().endswith(('.csv', '.txt')):
+        return _linhas_csv(arquivo)
+    raise ErroImportacao('Formato não suportado: envie um arquivo .csv ou .xlsx.')
+
+
+# --- Normalização (mesmas regras dos formulários de cadastro) ---
+
+def _texto(valor):
+    if valor is None: return ''
+    if isinstance(valor, float) and valor.is_integer(): valor = int(valor)
+    return str(valor).strip()
+
+def _digitos(valor, tamanho=None):
+    if isinstance(valor, (int, float)) and tamanho:
+        # Célula numérica do Excel perde os zeros à esquerda
+        return _texto(valor).zfill(tamanho)
+    return "".join(filter(str.isdigit, _texto(valor)))
+
+def _maiusculas(valor):
+    return _texto(valor).upper()
+
+def _endereco(registro):
+    return {
+        'telefone': _digitos(registro.get('telefone')),
+        'email': _texto(registro.get('email')) or None,
+        'cep': _digitos(registro.get('cep'), 8),
+        'rua': _maiusculas(registro.get('rua')),
+        'numero': _texto(registro.get('numero')) or None,
+        'bairro': _maiusculas(registro.get('bairro')),
+        'cidade': _maiusculas(registro.get('cidade')),
+        'uf': _maiusculas(registro.get('uf')),
+    }
+
+
+def normalizar_cliente(registro):
+    """Devolve (valores, documento a validar como (tipo, número), erros)."""
+    tipo = _maiusculas(registro.get('tipo_pessoa'))
+    cpf = _digitos(registro.get('cpf'), 11)
+    cnpj = _digitos(registro.get('cnpj'), 14)
+    documento = _digitos(registro.get('documento'))
+    if documento and not (cpf or cnpj):
+        if len(documento) <= 11: cpf = documento.zfill(11)
+        else: cnpj = documento.zfill(14)
+    if tipo.startswith('F'): tipo = 'FISICA'
+    elif tipo.startswith('J'): tipo = 'JURIDICA'
+    else: tipo = 'JURIDICA' if cnpj and not cpf else 'FISICA'
+
+    valores = {'tipo_pessoa': tipo}
+    if tipo == 'FISICA':
+        valores.update(nome=_maiusculas(registro.get('nome')), cpf=cpf)
+        documento, faltando = ('cpf', cpf), [c for c in ('nome', 'cpf') if not valores[c]]
+    else:
+        razao_social = _maiusculas(registro.get('razao_social')) or _maiusculas(registro.get('nome'))
+        valores.update(razao_social=razao_social, cnpj=cnpj,
+                       inscricao_estadual=_digitos(registro.get('inscricao_estadual')))
+        documento, faltando = ('cnpj', cnpj), [c for c in ('razao_social', 'cnpj') if not valores[c]]
+    valores.update(_endereco(registro))
+    return valores, documento, [f'{campo} não informado' for campo in faltando]
+
+
+def normalizar_fornecedor(registro):
+    valores = {
+        'razao_social': _maiusculas(registro.get('razao_social')) or _maiusculas(registro.get('nome')),
+        'nome_fantasia': _maiusculas(registro.get('nome_fantasia')),
+        # Sem CNPJ grava NULL (o formulário grava ''), senão o segundo fornecedor sem CNPJ violaria a coluna única
+        'cnpj': _digitos(registro.get('cnpj') or registro.get('documento'), 14) or None,
+    }
+    valores.update(_endereco(registro))
+    erros = [] if valores['razao_social'] else ['razao_social não informado']
+    return valores, ('cnpj', valores['cnpj']) if valores['cnpj'] else None, erros
+
+
+NORMALIZADORES = {'clientes': normalizar_cliente, 'fornecedores': normalizar_fornecedor}
+
+
+# --- Validação em lote ---
+
+def validar_documentos(tipo, numeros):
+    """Lista de booleanos com a validade de cada CPF ('cpf') ou CNPJ ('cnpj') de `numeros`."""
+    return (validar_cpfs if tipo == 'cpf' else validar_cnpjs)(numeros).tolist()
+
+
+def _existentes(conexao, tabela, colunas, lote):
+    """(coluna, valor) já gravados na tabela para os valores únicos do lote, numa única consulta."""
+    consultas = []
+    for coluna in colunas:
+        valores = {valores[coluna] for _, valores in lote if valores.get(coluna)}
+        if valores:
+            consultas.append(select(literal(coluna).label('coluna'), tabela.c[coluna].label('valor'))
+                             .where(tabela.c[coluna].in_(valores)))
+    if not consultas:
+        return set()
+    return {tuple(linha) for linha in conexao.execute(union_all(*consultas) if len(consultas) > 1 else consultas[0])}
+
+
+class ResultadoImportacao:
+    def __init__(self):
+        self.lidas = 0
+        self.importadas = 0
+        self.erros = []  # (número da linha no arquivo, mensagem)
+        self.segundos = 0.0
+
+    def rejeitar(self, numero_linha, mensagens):
+        self.erros.append((numero_linha, '; '.join(mensagens)))
+
+    def como_dict(self, limite_erros=None):
+        erros = self.erros if limite_erros is None else self.erros[:limite_erros]
+        return {'lidas': self.lidas, 'importadas': self.importadas, 'rejeitadas': len(self.erros),
+                'segundos': round(self.segundos, 3),
+                'erros': [{'linha': linha, 'erro': mensagem} for linha, mensagem in erros]}
+
+    def relatorio_csv(self):
+        saida = io.StringIO()
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(['linha', 'erro'])
+        escritor.writerows(self.erros)
+        return saida.getvalue()
+
+
+def importar(conexao, tabela, tipo, linhas, tamanho_lote=LINHAS_POR_LOTE):
+    """Importa as `linhas` (de ler_linhas) em `tabela`, confirmando a cada lote. Devolve um ResultadoImportacao.
+
+    `conexao` é uma Connection do SQLAlchemy (cada lote é confirmado com commit); `tipo` é 'clientes' ou 'fornecedores'.
+    """
+    inicio = time.perf_counter()
+    normalizar = NORMALIZADORES[tipo]
+    unicas = [coluna.name for coluna in tabela.columns if coluna.unique]
+    vistos = {coluna: {} for coluna in unicas}  # valor -> linha do arquivo onde apareceu primeiro
+    resultado = ResultadoImportacao()
+    lote = []
+
+    def processar(lote):
+        # 1. CPF/CNPJ do lote validados de uma vez
+        rejeitadas = set()
+        for tipo_documento in ('cpf', 'cnpj'):
+            pendentes = [(numero_linha, documento[1]) for numero_linha, _, documento in lote
+                         if documento and documento[0] == tipo_documento]
+            validos = validar_documentos(tipo_documento, [numero for _, numero in pendentes])
+            for (numero_linha, _), valido in zip(pendentes, validos):
+                if not valido:
+                    resultado.rejeitar(numero_linha, [f'{tipo_documento.upper()} inválido'])
+                    rejeitadas.add(numero_linha)
+        aprovadas = [(numero_linha, valores) for numero_linha, valores, _ in lote if numero_linha not in rejeitadas]
+
+        # 2. Duplicidade dentro do próprio arquivo
+        unicas_no_arquivo = []
+        for numero_linha, valores in aprovadas:
+            repetidas = [f'{coluna} repetido (linha {vistos[coluna][valores[coluna]]})'
+                         for coluna in unicas if valores.get(coluna) and valores[coluna] in vistos[coluna]]
+            if repetidas:
+                resultado.rejeitar(numero_linha, repetidas)
+                continue
+            for coluna in unicas:
+                if valores.get(coluna): vistos[coluna][valores[coluna]] = numero_linha
+            unicas_no_arquivo.append((numero_linha, valores))
+
+        # 3. Duplicidade contra o banco (uma consulta para todas as colunas únicas do lote)
+        existentes = _existentes(conexao, tabela, unicas, unicas_no_arquivo)
+        novas = []
+        for numero_linha, valores in unicas_no_arquivo:
+            ja_cadastradas = [f'{coluna} já cadastrado' for coluna in unicas
+                              if valores.get(coluna) and (coluna, valores[coluna]) in existentes]
+            if ja_cadastradas: resultado.rejeitar(numero_linha, ja_cadastradas)
+            else: novas.append((numero_linha, valores))
+
+        # 4. INSERT em lote; se algo concorrente causar conflito, refaz linha a linha para apontar qual
+        if not novas:
+            return
+        colunas = sorted(set().union(*(valores for _, valores in novas)))
+        registros = [{coluna: valores.get(coluna) for coluna in colunas} for _, valores in novas]
+        try:
+            conexao.execute(tabela.insert(), registros)
+            conexao.commit()
+            resultado.importadas += len(novas)
+        except IntegrityError:
+            conexao.rollback()
+            for (numero_linha, _), registro in zip(novas, registros):
+                try:
+                    conexao.execute(tabela.insert(), registro)
+                    conexao.commit()
+                    resultado.importadas += 1
+                except IntegrityError as e:
+                    conexao.rollback()
+                    resultado.rejeitar(numero_linha, [f'conflito ao gravar: {e.orig}'])
+
+    # A linha 1 é o cabeçalho
+    for numero_linha, registro in enumerate(linhas, start=2):
+        if registro is None:
+            continue
+        resultado.lidas += 1
+        valores, documento, erros = normalizar(registro)
+        if erros:
+            resultado.rejeitar(numero_linha, erros)
+            continue
+        lote.append((numero_linha, valores, documento))
+        if len(lote) >= tamanho_lote:
+            processar(lote)
+            lote = []
+    if lote:
+        processar(lote)
+    resultado.erros.sort()
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
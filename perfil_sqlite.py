@@ -0,0 +1,191 @@
+# perfil_sqlite.py
+# Perfis de configuração do SQLite, aplicados por PRAGMA a cada nova conexão do pool.
+#
+# "producao" usa WAL: leitores não bloqueiam o escritor nem são bloqueados por ele, e o commit
+# só faz fsync no checkpoint (synchronous=NORMAL, seguro contra queda do processo; numa queda de
+# energia perde no máximo as últimas transações, sem corromper o arquivo). busy_timeout faz a
+# conexão esperar pela trava de escrita em vez de falhar na hora com "database is locked".
+# "padrao" mantém o journal de fábrica (rollback) e só define a espera; "testes" troca
+# durabilidade por velocidade. O perfil vem de SQLITE_PERFIL e pragmas avulsos de SQLITE_PRAGMAS
+# ("nome=valor;nome=valor"). comparar_perfis mede leituras e escritas concorrentes, em processos
+# separados como os workers do gunicorn. Não importa app.py.
+
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import event
+
+PERFIS = {
+    'producao': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,          # KiB (negativo = tamanho, não páginas): 64 MB por conexão
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'journal_size_limit': 64 * 1024 * 1024,
+    },
+    'padrao': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+    },
+    'testes': {
+        'busy_timeout': 5000,
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'temp_store': 'MEMORY',
+    },
+}
+PERFIL_PADRAO = 'producao'
+
+
+def ler_pragmas(texto):
+    """'mmap_size=0;cache_size=-2000' -> {'mmap_size': '0', 'cache_size': '-2000'}."""
+    pragmas = {}
+    for item in (texto or '').replace(',', ';').split(';'):
+        if item.strip():
+            nome, _, valor = item.partition('=')
+            pragmas[nome.strip().lower()] = valor.strip()
+    return pragmas
+
+
+def pragmas_do_perfil(nome, extras=None):
+    if nome not in PERFIS:
+        raise ValueError(f"Perfil SQLite desconhecido: {nome!r} (use {', '.join(PERFIS)})")
+    pragmas = dict(PERFIS[nome])
+    pragmas.update(ler_pragmas(extras) if isinstance(extras, str) else extras or {})
+    return pragmas
+
+
+def aplicar_pragmas(conexao, pragmas):
+    """Executa os pragmas numa conexão DB-API do sqlite3 (busy_timeout primeiro, para a troca de journal esperar)."""
+    cursor = conexao.cursor()
+    try:
+        for nome in sorted(pragmas, key=lambda nome: nome != 'busy_timeout'):
+            cursor.execute(f'PRAGMA {nome} = {pragmas[nome]}')
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def instalar_perfil(engine, nome=PERFIL_PADRAO, extras=None):
+    """Aplica o perfil a toda conexão que `engine` abrir daqui em diante; devolve os pragmas. Ignora bancos não SQLite."""
+    if engine.dialect.name != 'sqlite':
+        return {}
+    pragmas = pragmas_do_perfil(nome, extras)
+
+    @event.listens_for(engine, 'connect')
+    def _ao_conectar(conexao_dbapi, registro):
+        aplicar_pragmas(conexao_dbapi, pragmas)
+
+    return pragmas
+
+
+def pragmas_em_uso(conexao, nomes=None):
+    """Valores efetivos dos pragmas numa conexão DB-API (para conferir o que o perfil aplicou)."""
+    nomes = nomes or sorted({nome for pragmas in PERFIS.values() for nome in pragmas})
+    return {nome: conexao.execute(f'PRAGMA {nome}').fetchone()[0] for nome in nomes}
+
+
+# --- Benchmark de concorrência ---
+
+LINHAS_INICIAIS = 50000
+CONTAS = 500
+
+
+def _preparar(caminho, pragmas):
+    conexao = sqlite3.connect(caminho)
+    aplicar_pragmas(conexao, pragmas)
+    conexao.executescript("""
+        CREATE TABLE conta (id INTEGER PRIMARY KEY, saldo REAL NOT NULL DEFAULT 0);
+        CREATE TABLE lancamento (id INTEGER PRIMARY KEY, conta_id INTEGER NOT NULL, valor REAL NOT NULL, descricao TEXT);
+        CREATE INDEX ix_lancamento_conta ON lancamento (conta_id);
+    """)
+    conexao.executemany('INSERT INTO conta (id) VALUES (?)', [(i,) for i in range(1, CONTAS + 1)])
+    conexao.executemany('INSERT INTO lancamento (conta_id, valor, descricao) VALUES (?, ?, ?)',
+                        [(i % CONTAS + 1, 10.0, 'CARGA INICIAL') for i in range(LINHAS_INICIAIS)])
+    conexao.commit()
+    conexao.close()
+
+
+def _trabalhador(caminho, pragmas, papel, largada, segundos, resultados):
+    # Mesmo padrão do app: leituras fora de transação, escrita = BEGIN implícito + INSERT/UPDATE + COMMIT
+    conexao = sqlite3.connect(caminho, timeout=0)  # a espera vem só do busy_timeout do perfil
+    aplicar_pragmas(conexao, pragmas)
+    sorteio = random.Random(os.getpid())
+    feitas, travadas, latencias = 0, 0, []
+    largada.wait(timeout=120)  # todos começam juntos, depois de subir e conectar
+    fim = time.time() + segundos
+    while time.time() < fim:
+        antes = time.perf_counter()
+        conta = sorteio.randint(1, CONTAS)
+        try:
+            if papel == 'escrita':
+                conexao.execute('INSERT INTO lancamento (conta_id, valor, descricao) VALUES (?, ?, ?)',
+                                (conta, 1.0, 'BENCHMARK'))
+                conexao.execute('UPDATE conta SET saldo = saldo + 1 WHERE id = ?', (conta,))
+                conexao.commit()
+            else:
+                conexao.execute('SELECT count(*), sum(valor) FROM lancamento WHERE conta_id = ?', (conta,)).fetchone()
+                conexao.execute('SELECT saldo FROM conta WHERE id = ?', (conta,)).fetchone()
+            feitas += 1
+            latencias.append(time.perf_counter() - antes)
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            travadas += 1
+            conexao.rollback()
+    conexao.close()
+    latencias.sort()
+    resultados.put((papel, feitas, travadas, latencias[int(len(latencias) * 0.99)] if latencias else 0.0))
+
+
+def medir_perfil(nome, escritores=4, leitores=4, segundos=5.0, extras=None, diretorio=None):
+    """Roda `escritores` + `leitores` processos contra um banco novo com o perfil `nome` e devolve as vazões."""
+    pragmas = pragmas_do_perfil(nome, extras)
+    temporario = tempfile.mkdtemp(prefix='benchmark_sqlite_', dir=diretorio)
+    try:
+        caminho = os.path.join(temporario, 'benchmark.db')
+        _preparar(caminho, pragmas)
+        contexto = multiprocessing.get_context('spawn')
+        resultados = contexto.Queue()
+        papeis = ['escrita'] * escritores + ['leitura'] * leitores
+        largada = contexto.Barrier(len(papeis))
+        processos = [contexto.Process(target=_trabalhador, args=(caminho, pragmas, papel, largada, segundos, resultados))
+                     for papel in papeis]
+        for processo in processos:
+            processo.start()
+        coletados = []
+        while len(coletados) < len(processos):
+            try:
+                coletados.append(resultados.get(timeout=1))
+            except queue.Empty:
+                if any(processo.exitcode not in (None, 0) for processo in processos):
+                    for processo in processos:
+                        processo.terminate()
+                    raise RuntimeError('Um processo do benchmark terminou com erro (veja a saída acima).')
+        for processo in processos:
+            processo.join()
+    finally:
+        shutil.rmtree(temporario, ignore_errors=True)
+
+    medicao = {'perfil': nome, 'segundos': segundos}
+    for papel in ('escrita', 'leitura'):
+        do_papel = [r for r in coletados if r[0] == papel]
+        medicao[papel] = {
+            'operacoes_por_segundo': round(sum(r[1] for r in do_papel) / segundos, 1),
+            'database_is_locked': sum(r[2] for r in do_papel),
+            'p99_ms': round(max((r[3] for r in do_papel), default=0.0) * 1000, 2),  # o pior p99 entre os processos
+        }
+    return medicao
+
+
+def comparar_perfis(nomes=None, escritores=4, leitores=4, segundos=5.0, diretorio=None):
+    return [medir_perfil(nome, escritores, leitores, segundos, diretorio=diretorio) for nome in nomes or PERFIS]
@@ -0,0 +1,66 @@
+# planos_consulta.py
+# Índices declarados nos modelos e conferência dos planos de execução do SQLite.
+#
+# criar_indices cria, numa base já existente, os índices que os modelos declaram e que ainda não
+# existem (db.create_all só cria tabelas novas); rodar de novo não faz nada. conferir_planos passa
+# cada consulta por EXPLAIN QUERY PLAN e aponta as varreduras completas de tabela ("SCAN tabela"
+# sem índice), que são o sinal de índice faltando ou não aproveitado. Não importa app.py.
+
+import re
+
+from sqlalchemy import inspect
+
+# "SCAN tabela", "SCAN tabela USING INDEX ix", "SCAN tabela VIRTUAL TABLE INDEX ...", "SCAN (subquery-1)"
+_VARREDURA = re.compile(r'^SCAN (\S+)(.*)$')
+
+
+def criar_indices(conexao, metadata):
+    """Cria os índices de `metadata` que faltam no banco; devolve (criados, existentes) com os nomes."""
+    inspetor = inspect(conexao)
+    tabelas_no_banco = set(inspetor.get_table_names())
+    criados, existentes = [], []
+    for tabela in metadata.sorted_tables:
+        if tabela.name not in tabelas_no_banco:
+            continue  # tabela nova: db.create_all cria com os índices
+        no_banco = {indice['name'] for indice in inspetor.get_indexes(tabela.name)}
+        for indice in sorted(tabela.indexes, key=lambda indice: indice.name):
+            if indice.name in no_banco:
+                existentes.append(indice.name)
+            else:
+                indice.create(conexao)
+                criados.append(indice.name)
+    return criados, existentes
+
+
+def plano(conexao, consulta):
+    """Linhas ("detail") do EXPLAIN QUERY PLAN de uma consulta SQLAlchemy (Select ou Query do ORM)."""
+    consulta = getattr(consulta, 'statement', consulta)
+    compilada = consulta.compile(dialect=conexao.dialect, compile_kwargs={'render_postcompile': True})
+    parametros = compilada.construct_params()
+    posicionais = tuple(parametros[nome] for nome in compilada.positiontup) if compilada.positional else parametros
+    # O cache de comandos do sqlite3 devolveria o plano antigo depois de um CREATE/DROP INDEX na mesma conexão
+    versao = conexao.exec_driver_sql('PRAGMA schema_version').scalar()
+    linhas = conexao.exec_driver_sql(f'EXPLAIN QUERY PLAN /* esquema {versao} */ ' + str(compilada), posicionais).all()
+    return [linha[-1] for linha in linhas]
+
+
+def varreduras_completas(linhas, tabelas, permitidas=()):
+    """Tabelas de `tabelas` lidas por inteiro no plano (apelidos como "cliente_1" contam como a tabela)."""
+    encontradas = []
+    for linha in linhas:
+        casamento = _VARREDURA.match(linha.strip())
+        if not casamento or casamento.group(2).strip():
+            continue  # não é SCAN, ou é SCAN por índice / tabela virtual
+        nome = re.sub(r'_\d+$', '', casamento.group(1))
+        if nome in tabelas and nome not in permitidas:
+            encontradas.append(nome)
+    return encontradas
+
+
+def conferir_planos(conexao, consultas, tabelas, permitidas=()):
+    """Para cada (nome, consulta), devolve (nome, linhas do plano, tabelas varridas por inteiro)."""
+    resultado = []
+    for nome, consulta in consultas:
+        linhas = plano(conexao, consulta)
+        resultado.append((nome, linhas, varreduras_completas(linhas, tabelas, permitidas)))
+    return resultado
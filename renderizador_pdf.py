@@ -0,0 +1,155 @@
+# renderizador_pdf.py
+# Pool de processos que executa o WeasyPrint fora das threads web.
+#
+# Cada processo é iniciado com "spawn" (não herda conexões nem threads do Flask e funciona
+# igual no Linux e no Windows). Na inicialização ele monta o RegistroAtivosPDF (logo, folhas
+# compiladas, configuração de fontes) e renderiza um documento mínimo, para que a primeira
+# tarefa real não pague esse carregamento. O pool nasce na primeira renderização (nunca na importação:
+# com "spawn" cada processo filho reimporta o módulo principal) e sobe todos os processos de uma vez,
+# em vez de um por tarefa. Cada worker do gunicorn tem o seu pool, então o
+# número de processos por pool é a fatia de núcleos do worker (ver PDF_WORKERS em app.py), não o
+# total de núcleos da máquina. O resultado é gravado direto
+# no CachePDF, então o identificador da tarefa é a própria chave do cache e qualquer
+# worker web consegue consultar o andamento pelo diretório compartilhado:
+#   <chave>.pdf       concluído
+#   <chave>.pendente  em processamento (marcador criado ao enfileirar)
+#   <chave>.erro      falhou (contém a mensagem)
+# Não importa app.py.
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ativos_pdf import RegistroAtivosPDF
+from cache_pdf import CachePDF
+
+CONCLUIDO, PROCESSANDO, ERRO, DESCONHECIDO = 'concluido', 'processando', 'erro', 'desconhecido'
+
+
+_registro = None
+
+
+def _aquecer(diretorio_static):
+    global _registro
+    _registro = RegistroAtivosPDF(diretorio_static)
+    for folha in _registro.folhas:
+        _registro.folhas_compiladas(folha)
+    _registro.renderizar('<p>aquecimento</p>')
+
+
+def _nada():
+    pass
+
+
+def _renderizar(html, base_url, folha, diretorio, chave):
+    # Executa no processo do pool
+    try:
+        pdf = _registro.renderizar(html, base_url, folha)
+        CachePDF(diretorio, limite_bytes=float('inf')).gravar(chave, pdf)
+    except Exception as e:
+        with open(os.path.join(diretorio, chave + '.erro'), 'w', encoding='utf-8') as arquivo:
+            arquivo.write(f'{type(e).__name__}: {e}')
+        raise
+    finally:
+        try:
+            os.remove(os.path.join(diretorio, chave + '.pendente'))
+        except FileNotFoundError:
+            pass
+
+
+class RenderizadorPDF:
+    def __init__(self, cache, diretorio_static, processos=None, tempo_limite=120):
+        self.cache = cache
+        self.diretorio_static = diretorio_static
+        self.processos = processos or os.cpu_count() or 1
+        self.tempo_limite = tempo_limite
+        self._pool = None
+        self._pool_pid = None
+        self._tarefas = {}
+        self._trava = threading.Lock()
+
+    def _obter_pool(self):
+        # Criado sob demanda e recriado após fork (cada worker do gunicorn tem o seu)
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.processos, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_aquecer, initargs=(self.diretorio_static,))
+            self._pool_pid = os.getpid()
+            self._tarefas = {}
+            # O executor só abre um processo novo quando não há nenhum ocioso: uma tarefa vazia por processo
+            # sobe todos agora, e as tarefas seguintes já encontram os irmãos aquecidos
+            for _ in range(self.processos):
+                self._pool.submit(_nada)
+        return self._pool
+
+    def iniciar(self):
+        """Sobe o pool antes da primeira renderização (p. ex. num hook post_fork do gunicorn).
+
+        Não faz nada dentro de um processo filho do multiprocessing, que reimporta o módulo principal.
+        """
+        if multiprocessing.parent_process() is not None:
+            return
+        with self._trava:
+            self._obter_pool()
+
+    def _marcador(self, chave, sufixo):
+        return os.path.join(self.cache.diretorio, chave + sufixo)
+
+    def _pendente_em_outro_processo(self, chave):
+        try:
+            return time.time() - os.path.getmtime(self._marcador(chave, '.pendente')) < self.tempo_limite
+        except FileNotFoundError:
+            return False
+
+    def enviar(self, chave, html, base_url, folha=None):
+        """Enfileira a renderização, a menos que o PDF já exista ou já esteja sendo gerado."""
+        with self._trava:
+            if chave in self._tarefas or os.path.exists(self.cache.caminho(chave)) or self._pendente_em_outro_processo(chave):
+                return
+            if os.path.exists(self._marcador(chave, '.erro')): os.remove(self._marcador(chave, '.erro'))
+            with open(self._marcador(chave, '.pendente'), 'w'): pass
+            try:
+                tarefa = self._obter_pool().submit(_renderizar, html, base_url, folha, self.cache.diretorio, chave)
+            except BrokenProcessPool:
+                self._pool = None
+                tarefa = self._obter_pool().submit(_renderizar, html, base_url, folha, self.cache.diretorio, chave)
+            self._tarefas[chave] = tarefa
+        tarefa.add_done_callback(lambda _: self._concluir(chave))
+
+    def _concluir(self, chave):
+        self._tarefas.pop(chave, None)
+        # O processo do pool grava sem limite; o descarte por LRU fica a cargo de quem enfileirou
+        self.cache.podar()
+
+    def aguardar(self, chave, segundos):
+        """Espera até `segundos` pela conclusão; devolve o estado final observado."""
+        limite = time.monotonic() + segundos
+        tarefa = self._tarefas.get(chave)
+        if tarefa is not None:
+            try:
+                tarefa.exception(timeout=segundos)
+            except Exception:
+                pass
+        while self.estado(chave) == PROCESSANDO and time.monotonic() < limite:
+            time.sleep(0.05)
+        return self.estado(chave)
+
+    def estado(self, chave):
+        if os.path.exists(self.cache.caminho(chave)): return CONCLUIDO
+        if os.path.exists(self._marcador(chave, '.erro')): return ERRO
+        if chave in self._tarefas or self._pendente_em_outro_processo(chave): return PROCESSANDO
+        return DESCONHECIDO
+
+    def erro(self, chave):
+        try:
+            with open(self._marcador(chave, '.erro'), encoding='utf-8') as arquivo:
+                return arquivo.read()
+        except FileNotFoundError:
+            return None
+
+    def encerrar(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
@@ -1,7 +1,14 @@
 # run.py
 
+import csv
+import time
+
+import click
+from sqlalchemy import select
+
 from app import criar_app, db, bcrypt
-from app.modelos import Usuario
+from app.modelos import Usuario, Cliente, Fornecedor
+from validacao_documentos import validar_cpfs_ou_cnpjs, validar_ceps, auditar
 
 # Cria a aplicação chamando a nossa função de fábrica
 app = criar_app()
@@ -25,6 +32,30 @@ def criar_banco_de_dados():
             print("Usuário 'Administrador' criado.")
         else:
             print("Usuário 'Administrador' já existe.")
+
+@app.cli.command("auditar_cadastros")
+@click.option('--relatorio', default='auditoria_cadastros.csv', show_default=True, help='CSV com os campos reprovados.')
+def auditar_cadastros(relatorio):
+    """Confere o CPF/CNPJ (documento) e o CEP de todos os clientes e fornecedores."""
+    inicio = time.perf_counter()
+    problemas, conferidos = [], 0
+    with app.app_context():
+        for tabela, modelo in (('clientes', Cliente), ('fornecedores', Fornecedor)):
+            consulta = select(modelo.id, modelo.documento, modelo.cep).order_by(modelo.id).execution_options(yield_per=50000)
+            for lote in db.session.execute(consulta).partitions():
+                ids, documentos, ceps = (list(coluna) for coluna in zip(*lote))
+                # O CEP é gravado como digitado, com ou sem máscara
+                ceps = [(cep or '').replace('-', '').replace('.', '') for cep in ceps]
+                problemas += auditar(tabela, ids, 'documento', documentos, validar_cpfs_ou_cnpjs, 'CPF/CNPJ inválido')
+                opcional = [bool(cep) for cep in ceps] if modelo is Fornecedor else None
+                problemas += auditar(tabela, ids, 'cep', ceps, validar_ceps, 'CEP inválido', opcional)
+                conferidos += len(ids)
+    with open(relatorio, 'w', encoding='utf-8-sig', newline='') as saida:
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(['tabela', 'id', 'campo', 'valor', 'problema'])
+        escritor.writerows(problemas)
+    print(f"{conferidos} cadastro(s) conferido(s) em {time.perf_counter() - inicio:.2f} s; "
+          f"{len(problemas)} problema(s) gravado(s) em {relatorio}.")
 # -----------------------------------------
 
 # Executa o servidor de desenvolvimento
@@ -0,0 +1,173 @@
+# snapshot_parquet.py
+# Exportação das tabelas para arquivos Parquet tipados, para consumo por ferramentas de BI.
+#
+# As linhas são lidas direto do SQLite pelo cursor DB-API, em blocos, e cada bloco vira um
+# RecordBatch do Arrow gravado no arquivo, sem passar pelo ORM. Os tipos vêm das colunas
+# SQLAlchemy (datas viram date32/timestamp, não texto). Para o modo incremental, triggers
+# registram em "registro_alteracao" a última alteração de cada linha (uma linha por registro,
+# com um número de sequência crescente); o manifesto guarda a sequência vista no snapshot
+# anterior e o incremental exporta apenas o que mudou depois dela, mais os ids excluídos.
+# Não importa app.py.
+
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import types
+
+TABELA_ALTERACOES = 'registro_alteracao'
+ARQUIVO_MANIFESTO = 'manifesto.json'
+LINHAS_POR_LOTE = 5000
+
+COMPLETO, INCREMENTAL = 'completo', 'incremental'
+
+_trava = threading.Lock()
+
+
+def ddl_registro_alteracao(tabelas):
+    """Comandos (idempotentes) que criam a tabela de alterações e os triggers de cada tabela."""
+    comandos = [f"""CREATE TABLE IF NOT EXISTS {TABELA_ALTERACOES} (
+        sequencia INTEGER PRIMARY KEY AUTOINCREMENT, tabela TEXT NOT NULL, registro_id INTEGER NOT NULL,
+        excluido INTEGER NOT NULL DEFAULT 0, UNIQUE (tabela, registro_id))"""]
+    # INSERT OR REPLACE apaga a entrada anterior da linha e cria outra com sequência nova
+    for tabela in tabelas:
+        nome = tabela.name
+        for evento, referencia, excluido in (('INSERT', 'new', 0), ('UPDATE', 'new', 0), ('DELETE', 'old', 1)):
+            comandos.append(f"""CREATE TRIGGER IF NOT EXISTS {nome}_alteracao_{evento.lower()} AFTER {evento} ON {nome} BEGIN
+                INSERT OR REPLACE INTO {TABELA_ALTERACOES}(tabela, registro_id, excluido) VALUES ('{nome}', {referencia}.id, {excluido});
+            END""")
+    return comandos
+
+
+def instalar_registro_alteracao(conexao, tabelas):
+    for comando in ddl_registro_alteracao(tabelas):
+        conexao.execute(comando)
+    conexao.commit()
+
+
+def tipo_arrow(coluna):
+    tipo = coluna.type
+    if isinstance(tipo, types.Boolean): return pa.bool_()
+    if isinstance(tipo, types.Integer): return pa.int64()
+    if isinstance(tipo, (types.Float, types.Numeric)): return pa.float64()
+    if isinstance(tipo, types.DateTime): return pa.timestamp('us')
+    if isinstance(tipo, types.Date): return pa.date32()
+    return pa.string()
+
+
+def _esquema(tabela):
+    return pa.schema([pa.field(coluna.name, tipo_arrow(coluna), nullable=coluna.nullable) for coluna in tabela.columns])
+
+
+def _lote(linhas, esquema):
+    colunas = []
+    for indice, campo in enumerate(esquema):
+        valores = [linha[indice] for linha in linhas]
+        if pa.types.is_timestamp(campo.type) or pa.types.is_date32(campo.type):
+            # O SQLite guarda datas como texto ISO; o Arrow converte a coluna inteira de uma vez
+            colunas.append(pa.array(valores, type=pa.string()).cast(campo.type))
+        else:
+            colunas.append(pa.array(valores, type=campo.type))
+    return pa.RecordBatch.from_arrays(colunas, schema=esquema)
+
+
+def _gravar_parquet(cursor, consulta, parametros, esquema, caminho):
+    linhas_gravadas = 0
+    with pq.ParquetWriter(caminho, esquema) as escritor:
+        cursor.execute(consulta, parametros)
+        while linhas := cursor.fetchmany(LINHAS_POR_LOTE):
+            escritor.write_batch(_lote(linhas, esquema))
+            linhas_gravadas += len(linhas)
+    return linhas_gravadas
+
+
+def ler_manifesto(diretorio):
+    try:
+        with open(os.path.join(diretorio, ARQUIVO_MANIFESTO), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return {'snapshots': []}
+
+
+def _gravar_manifesto(diretorio, manifesto):
+    temporario = os.path.join(diretorio, ARQUIVO_MANIFESTO + '.tmp')
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False, indent=2)
+    os.replace(temporario, os.path.join(diretorio, ARQUIVO_MANIFESTO))
+
+
+def exportar_snapshot(conexao, tabelas, diretorio, incremental=False):
+    """Grava um snapshot das `tabelas` (objetos Table do SQLAlchemy) em `diretorio` e devolve sua entrada no manifesto.
+
+    `conexao` é uma conexão DB-API do sqlite3. Sem um snapshot anterior, o incremental vira completo.
+    """
+    with _trava:
+        os.makedirs(diretorio, exist_ok=True)
+        manifesto = ler_manifesto(diretorio)
+        anterior = manifesto['snapshots'][-1] if manifesto['snapshots'] else None
+        tipo = INCREMENTAL if incremental and anterior else COMPLETO
+        inicio = time.perf_counter()
+        carimbo = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        nome = f'{tipo}-{carimbo}'
+
+        # Os triggers precisam existir antes da leitura, para que nada alterado depois dela se perca
+        instalar_registro_alteracao(conexao, tabelas)
+        temporario = os.path.join(diretorio, nome + '.tmp')
+        os.makedirs(temporario)
+        cursor = conexao.cursor()
+        try:
+            # Uma única transação de leitura: todas as tabelas e a sequência vêm do mesmo instante
+            cursor.execute('BEGIN')
+            sequencia = cursor.execute(f'SELECT coalesce(max(sequencia), 0) FROM {TABELA_ALTERACOES}').fetchone()[0]
+            desde = anterior['sequencia'] if tipo == INCREMENTAL else None
+            resultado = {}
+            for tabela in tabelas:
+                inicio_tabela = time.perf_counter()
+                esquema = _esquema(tabela)
+                colunas = ', '.join(f'"{coluna.name}"' for coluna in tabela.columns)
+                consulta, parametros = f'SELECT {colunas} FROM "{tabela.name}"', ()
+                if desde is not None:
+                    consulta += (f' WHERE id IN (SELECT registro_id FROM {TABELA_ALTERACOES}'
+                                 f' WHERE tabela = ? AND sequencia > ? AND excluido = 0)')
+                    parametros = (tabela.name, desde)
+                consulta += ' ORDER BY id'
+                arquivo = tabela.name + '.parquet'
+                linhas = _gravar_parquet(cursor, consulta, parametros, esquema, os.path.join(temporario, arquivo))
+                entrada = {'arquivo': arquivo, 'linhas': linhas}
+                if desde is not None:
+                    excluidos = [linha[0] for linha in cursor.execute(
+                        f'SELECT registro_id FROM {TABELA_ALTERACOES} WHERE tabela = ? AND sequencia > ? AND excluido = 1'
+                        ' ORDER BY registro_id', (tabela.name, desde))]
+                    entrada['excluidos'] = len(excluidos)
+                    if excluidos:
+                        entrada['arquivo_excluidos'] = tabela.name + '.excluidos.parquet'
+                        pq.write_table(pa.table({'id': pa.array(excluidos, type=pa.int64())}),
+                                       os.path.join(temporario, entrada['arquivo_excluidos']))
+                entrada['segundos'] = round(time.perf_counter() - inicio_tabela, 3)
+                resultado[tabela.name] = entrada
+            conexao.commit()
+        except BaseException:
+            conexao.rollback()
+            shutil.rmtree(temporario, ignore_errors=True)
+            raise
+        finally:
+            cursor.close()
+
+        os.replace(temporario, os.path.join(diretorio, nome))
+        snapshot = {
+            'nome': nome,
+            'tipo': tipo,
+            'criado_em': datetime.datetime.now().isoformat(timespec='seconds'),
+            'sequencia': sequencia,
+            'desde_sequencia': desde,
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'tabelas': resultado,
+        }
+        manifesto['snapshots'].append(snapshot)
+        _gravar_manifesto(diretorio, manifesto)
+        return snapshot
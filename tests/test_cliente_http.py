@@ -0,0 +1,38 @@
+import time
+
+import pytest
+import requests
+
+from cliente_http import ClienteHTTP, FECHADO, ABERTO
+from consultas_externas import ServidorStub
+
+
+@pytest.fixture
+def servidor():
+    servidor = ServidorStub().iniciar()
+    yield servidor
+    servidor.encerrar()
+
+
+def test_chamada_de_teste_com_corpo_quebrado_nao_trava_o_disjuntor(servidor):
+    cliente = ClienteHTTP(tentativas=1, circuito_falhas=1, circuito_espera=0.1)
+    url = servidor.url + '/api/cep/v1/01001000'
+    disjuntor = cliente.disjuntor(url)
+
+    servidor.taxa_erro = 1.0
+    assert cliente.get(url).status_code == 503
+    assert disjuntor.estado == ABERTO
+
+    # A chamada de teste (meio aberto) recebe uma resposta malformada: o disjuntor reabre
+    servidor.taxa_erro, servidor.corpo_quebrado = 0.0, True
+    time.sleep(0.15)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        cliente.get(url)
+    assert disjuntor.estado == ABERTO
+
+    # Com a API de volta, a próxima chamada de teste fecha o disjuntor
+    servidor.corpo_quebrado = False
+    time.sleep(0.15)
+    assert cliente.get(url).status_code == 200
+    assert disjuntor.estado == FECHADO
+    assert cliente.get(url).status_code == 200
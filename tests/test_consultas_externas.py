@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from consultas_externas import ErroConsulta, ServicoConsultas
+
+
+class _RespostaSemJSON:
+    status_code = 200
+
+    def json(self):
+        raise ValueError('Expecting value: line 1 column 1 (char 0)')
+
+
+class _SessaoFalsa:
+    def __init__(self, resposta=None, erro=None, atraso=0.0):
+        self.resposta, self.erro, self.atraso = resposta, erro, atraso
+        self.chamadas = 0
+
+    def get(self, url):
+        self.chamadas += 1
+        time.sleep(self.atraso)
+        if self.erro is not None:
+            raise self.erro
+        return self.resposta
+
+
+def test_json_invalido_vira_erro_consulta(tmp_path):
+    servico = ServicoConsultas(str(tmp_path / 'ce.db'), sessao=_SessaoFalsa(_RespostaSemJSON()))
+    with pytest.raises(ErroConsulta, match='JSON inválido'):
+        servico.consultar('cep', '01001-000')
+    assert servico.contadores['erros'] == 1
+
+
+def test_consultas_agrupadas_recebem_o_erro_inesperado_do_responsavel(tmp_path):
+    sessao = _SessaoFalsa(erro=RuntimeError('falha inesperada'), atraso=0.2)
+    servico = ServicoConsultas(str(tmp_path / 'ce.db'), sessao=sessao)
+    erros = []
+
+    def consultar():
+        try:
+            servico.consultar('cep', '01001000')
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=consultar) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sessao.chamadas == 1
+    assert servico.contadores['agrupadas'] == 3
+    assert [type(e) for e in erros] == [RuntimeError] * 4
@@ -0,0 +1,107 @@
+# Orçamento de comandos SQL por rota: o número de consultas não pode crescer com o número de O.S.
+import datetime
+import importlib.util
+import os
+import pathlib
+import sys
+
+import pytest
+from sqlalchemy import event
+
+RAIZ = pathlib.Path(__file__).resolve().parent.parent
+
+# Comandos SQL por requisição (inclui a carga do usuário logado), iguais com 3 ou 30 O.S. com peças
+ORCAMENTOS = {
+    '/ordens': 3,
+    '/relatorio/os': 4,
+    '/faturamento': 4,
+    '/api/ordens': 1,
+    '/api/ordens/1': 2,
+}
+
+
+@pytest.fixture(scope='module')
+def gestor(tmp_path_factory):
+    pasta = tmp_path_factory.mktemp('instancia')
+    os.environ.update(DATABASE_URL='sqlite://', CACHE_RELATORIOS='0',
+                      CACHE_RELATORIOS_DB=str(pasta / 'cache_relatorios.db'), PDF_CACHE_DIR=str(pasta / 'cache_pdf'),
+                      CONSULTAS_CACHE_DB=str(pasta / 'consultas_externas.db'), SNAPSHOT_DIR=str(pasta / 'snapshots'))
+    # app.py e o pacote app/ têm o mesmo nome: o módulo é carregado pelo caminho
+    spec = importlib.util.spec_from_file_location('gestor_app', RAIZ / 'app.py')
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules['gestor_app'] = modulo
+    spec.loader.exec_module(modulo)
+    modulo.app.config['TESTING'] = True
+    with modulo.app.app_context():
+        modulo.db.create_all()
+        usuario = modulo.User(username='ADMIN')
+        usuario.set_password('senha')
+        modulo.db.session.add_all([usuario] + [modulo.StatusOS(nome=nome) for nome in ('ABERTA', 'FINALIZADA', 'FATURADA')])
+        modulo.db.session.commit()
+    yield modulo
+    sys.modules.pop('gestor_app', None)
+
+
+@pytest.fixture(scope='module')
+def cliente(gestor):
+    cliente = gestor.app.test_client()
+    assert cliente.post('/login', data={'username': 'ADMIN', 'password': 'senha'}).status_code == 302
+    return cliente
+
+
+def criar_ordens(gestor, quantidade):
+    """`quantidade` O.S. (cada uma com cliente próprio e duas peças); uma em cada três vai para uma fatura."""
+    db = gestor.db
+    with gestor.app.app_context():
+        status = {s.nome: s for s in gestor.StatusOS.query.all()}
+        inicio = gestor.OrdemServico.query.count()
+        for i in range(inicio, inicio + quantidade):
+            cliente = gestor.Cliente(tipo_pessoa='FISICA', nome=f'CLIENTE {i}', cpf=f'{i:011d}')
+            db.session.add(cliente)
+            db.session.flush()
+            faturada = i % 3 == 0
+            ordem = gestor.OrdemServico(problema=f'PROBLEMA {i}', cliente_id=cliente.id, valor_servicos=100.0,
+                                        status_id=status['FATURADA' if faturada else 'FINALIZADA' if i % 3 == 1 else 'ABERTA'].id)
+            if i % 3 != 2:
+                ordem.data_fechamento = datetime.datetime.now()
+            db.session.add(ordem)
+            db.session.flush()
+            for j in range(2):
+                db.session.add(gestor.Peca(descricao=f'PECA {j}', quantidade=j + 1, valor_unitario=10.0, ordem_servico_id=ordem.id))
+            if faturada:
+                fatura = gestor.Faturamento(data_vencimento=datetime.date.today(), tipo_pagamento='PIX', cliente_id=cliente.id)
+                db.session.add(fatura)
+                db.session.flush()
+                db.session.execute(gestor.faturamento_os.insert().values(faturamento_id=fatura.id, ordem_servico_id=ordem.id))
+                db.session.add(gestor.Pagamento(faturamento_id=fatura.id, tipo_pagamento='PIX', valor=120.0,
+                                                data_vencimento=datetime.date.today()))
+        db.session.commit()
+
+
+def contar_comandos(gestor, cliente, url):
+    comandos = []
+
+    def contar(conexao, cursor, comando, *args):
+        comandos.append(comando)
+
+    with gestor.app.app_context():
+        motor = gestor.db.engine
+    event.listen(motor, 'before_cursor_execute', contar)
+    try:
+        resposta = cliente.get(url)
+        resposta.get_data()  # páginas transmitidas em partes só consultam ao serem lidas
+    finally:
+        event.remove(motor, 'before_cursor_execute', contar)
+    assert resposta.status_code == 200, (url, resposta.status_code)
+    return len(comandos)
+
+
+def test_comandos_nao_crescem_com_o_numero_de_ordens(gestor, cliente):
+    for total in (3, 30):
+        criar_ordens(gestor, total - total_de_ordens(gestor))
+        assert {url: contar_comandos(gestor, cliente, url) for url in ORCAMENTOS} == ORCAMENTOS, f'com {total} O.S.'
+
+
+def total_de_ordens(gestor):
+    with gestor.app.app_context():
+        return gestor.OrdemServico.query.count()
@@ -0,0 +1,180 @@
+# validacao_documentos.py
+# Validação vetorizada (NumPy) de CPF, CNPJ, telefone e CEP, para lotes grandes.
+#
+# Os dígitos verificadores são calculados com operações de matriz sobre os códigos dos caracteres,
+# em blocos, sem um laço Python por documento. O resultado é idêntico ao de validate_docbr
+# (CPF().validate / CNPJ().validate), inclusive nos casos de borda: máscara com "." "-" "/",
+# CPF com menos de 11 dígitos completado com zeros, dígitos todos iguais, CNPJ alfanumérico.
+# Entradas fora do caminho rápido (não ASCII, caracteres de controle, textos muito longos) são
+# raras e vão para o próprio validate_docbr, o que mantém a equivalência. `auditar` monta as linhas
+# do relatório de auditoria dos cadastros (comando auditar-cadastros). Não importa app.py.
+
+import numpy as np
+from validate_docbr import CPF, CNPJ
+
+TAMANHO_BLOCO = 100_000
+LARGURA_MAXIMA = 32
+
+_PESOS_CPF_1 = np.arange(10, 1, -1)
+_PESOS_CPF_2 = np.arange(11, 1, -1)
+_PESOS_CNPJ_1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_PESOS_CNPJ_2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_PONTO, _HIFEN, _BARRA = ord('.'), ord('-'), ord('/')
+
+_validador_cpf = CPF()
+_validador_cnpj = CNPJ()
+
+
+def _codigos(documentos):
+    """Matriz (n, largura) de códigos dos caracteres (0 = posição vazia) e máscara das linhas do caminho lento."""
+    try:
+        juntos = ''.join(documentos)  # caminho comum: todos str, sem laço Python
+    except TypeError:
+        documentos = ['' if d is None else str(d) for d in documentos]
+        juntos = ''.join(documentos)
+    matriz = np.array(documentos)
+    lentas = np.zeros(len(documentos), dtype=bool)
+    if matriz.itemsize // 4 > LARGURA_MAXIMA:
+        lentas |= np.char.str_len(matriz) > LARGURA_MAXIMA
+        matriz = matriz.astype(f'U{LARGURA_MAXIMA}')
+    if '\x00' in juntos:
+        # O NumPy descarta NUL no fim do texto; essas linhas precisam do texto original
+        lentas |= np.array(['\x00' in d for d in documentos], dtype=bool)
+    codigos = matriz.view(np.uint32).reshape(len(documentos), -1)
+    # Não ASCII (dígitos de outros alfabetos etc.) e controle (inclusive a quebra de linha final que o regex aceita)
+    lentas |= ((codigos > 127) | ((codigos < 32) & (codigos > 0))).any(axis=1)
+    return documentos, codigos, lentas
+
+
+def _em_blocos(funcao, documentos):
+    documentos = list(documentos)
+    if not documentos:
+        return np.zeros(0, dtype=bool)
+    if len(documentos) <= TAMANHO_BLOCO:
+        return funcao(documentos)
+    return np.concatenate([funcao(documentos[i:i + TAMANHO_BLOCO]) for i in range(0, len(documentos), TAMANHO_BLOCO)])
+
+
+def _alinhar_a_direita(codigos, mascara, largura):
+    """Valores dos caracteres marcados, na ordem, alinhados à direita em `largura` colunas (zeros à esquerda)."""
+    quantidade = mascara.sum(axis=1)
+    posicao_da_direita = quantidade[:, None] - np.cumsum(mascara, axis=1)  # 0 = último marcado
+    linhas, colunas = np.nonzero(mascara & (posicao_da_direita < largura))
+    saida = np.zeros((len(codigos), largura), dtype=np.int64)
+    saida[linhas, largura - 1 - posicao_da_direita[linhas, colunas]] = codigos[linhas, colunas].astype(np.int64) - 48
+    return saida, quantidade
+
+
+def _dv_cpf(digitos, pesos):
+    resto = (digitos @ pesos) * 10 % 11
+    return np.where(resto == 10, 0, resto)
+
+
+def _dv_cnpj(valores, pesos):
+    resto = (valores @ pesos) % 11
+    return np.where(resto < 2, 0, 11 - resto)
+
+
+def _validar_cpfs(documentos):
+    textos, codigos, lentas = _codigos(documentos)
+    digito = (codigos >= 48) & (codigos <= 57)
+    # Mesmo filtro de entrada de validate_docbr: só dígitos, "." e "-"
+    entrada_ok = (digito | (codigos == _PONTO) | (codigos == _HIFEN) | (codigos == 0)).all(axis=1)
+    digitos, quantidade = _alinhar_a_direita(codigos, digito, 11)
+    repetidos = (digitos == digitos[:, :1]).all(axis=1)
+    validos = (entrada_ok & (quantidade <= 11) & ~repetidos
+               & (_dv_cpf(digitos[:, :9], _PESOS_CPF_1) == digitos[:, 9])
+               & (_dv_cpf(digitos[:, :10], _PESOS_CPF_2) == digitos[:, 10]))
+    for i in np.nonzero(lentas)[0]:
+        validos[i] = _validador_cpf.validate(textos[i])
+    return validos
+
+
+def _validar_cnpjs(documentos):
+    textos, codigos, lentas = _codigos(documentos)
+    minuscula = (codigos >= 97) & (codigos <= 122)
+    codigos = np.where(minuscula, codigos - 32, codigos)
+    digito = (codigos >= 48) & (codigos <= 57)
+    alfanumerico = digito | ((codigos >= 65) & (codigos <= 90))
+    entrada_ok = (alfanumerico | (codigos == _PONTO) | (codigos == _BARRA) | (codigos == _HIFEN) | (codigos == 0)).all(axis=1)
+    # Letras valem ord(c) - 48, como no CNPJ alfanumérico
+    valores, quantidade = _alinhar_a_direita(codigos, alfanumerico, 14)
+    repetidos = (valores == valores[:, :1]).all(axis=1)
+    validos = (entrada_ok & (quantidade == 14) & ~repetidos
+               & (_dv_cnpj(valores[:, :12], _PESOS_CNPJ_1) == valores[:, 12])
+               & (_dv_cnpj(valores[:, :13], _PESOS_CNPJ_2) == valores[:, 13]))
+    for i in np.nonzero(lentas)[0]:
+        validos[i] = _validador_cnpj.validate(textos[i])
+    return validos
+
+
+def validar_cpfs(documentos):
+    """Array booleano: para cada item, o mesmo que CPF().validate(item). None conta como inválido."""
+    return _em_blocos(_validar_cpfs, documentos)
+
+
+def validar_cnpjs(documentos):
+    """Array booleano: para cada item, o mesmo que CNPJ().validate(item). None conta como inválido."""
+    return _em_blocos(_validar_cnpjs, documentos)
+
+
+def cpf_valido(documento):
+    return bool(_validar_cpfs([documento])[0])
+
+
+def cnpj_valido(documento):
+    return bool(_validar_cnpjs([documento])[0])
+
+
+def validar_cpfs_ou_cnpjs(documentos):
+    """Para documentos sem tipo definido: até 11 dígitos é CPF, mais que isso é CNPJ."""
+    documentos = ['' if d is None else str(d) for d in documentos]
+    if not documentos:
+        return np.zeros(0, dtype=bool)
+    eh_cpf = np.array([sum(c.isalnum() for c in d) <= 11 for d in documentos], dtype=bool)
+    return np.where(eh_cpf, validar_cpfs(documentos), validar_cnpjs(documentos))
+
+
+# --- Telefone e CEP (gravados só com dígitos pelos formulários) ---
+
+def _digitos(valores):
+    textos = ['' if v is None else str(v) for v in valores]
+    matriz = np.array(textos, dtype=f'U{max(max(map(len, textos), default=1), 1)}')
+    codigos = matriz.view(np.uint32).reshape(len(textos), -1)
+    return codigos, (codigos >= 48) & (codigos <= 57), (codigos > 0).sum(axis=1)
+
+
+def validar_telefones(valores):
+    """DDD válido (11 a 99, sem zero) + 8 dígitos (fixo, começando em 2-5) ou 9 dígitos (celular, começando em 9)."""
+    if not len(valores):
+        return np.zeros(0, dtype=bool)
+    codigos, digito, tamanho = _digitos(valores)
+    so_digitos = digito.sum(axis=1) == tamanho
+    if codigos.shape[1] < 3:
+        return np.zeros(len(valores), dtype=bool)
+    ddd_ok = (codigos[:, 0] >= 49) & (codigos[:, 1] >= 49)
+    terceiro = codigos[:, 2]
+    fixo = (tamanho == 10) & (terceiro >= 50) & (terceiro <= 53)
+    celular = (tamanho == 11) & (terceiro == 57)
+    return so_digitos & ddd_ok & (fixo | celular)
+
+
+def validar_ceps(valores):
+    """Exatamente 8 dígitos e diferente de 00000000."""
+    if not len(valores):
+        return np.zeros(0, dtype=bool)
+    codigos, digito, tamanho = _digitos(valores)
+    return (tamanho == 8) & (digito.sum(axis=1) == 8) & (codigos != 48).any(axis=1)
+
+
+# --- Auditoria ---
+
+def auditar(tabela, ids, campo, valores, validador, problema, conferir=None):
+    """(tabela, id, campo, valor, problema) de cada valor reprovado por `validador` (uma das funções acima).
+
+    `conferir` (sequência de booleanos) limita os itens verificados, p. ex. só os preenchidos ou só pessoa física.
+    """
+    reprovados = ~validador(valores)
+    if conferir is not None:
+        reprovados &= np.asarray(conferir, dtype=bool)
+    return [(tabela, ids[i], campo, valores[i], problema) for i in np.nonzero(reprovados)[0]]